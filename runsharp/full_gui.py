@@ -25,7 +25,7 @@ if frozenutils.isFrozen():
 from sharppy.viz.SPCWindow import SPCWindow
 from sharppy.viz.map import MapWidget 
 import sharppy.sharptab.profile as profile
-from sharppy.io.decoder import getDecoders
+from sharppy.io.decoder import openFile
 from sharppy._sharppy_version import __version__, __version_name__
 from datasources import data_source
 from utils.async import AsyncThreads
@@ -446,7 +446,9 @@ class Picker(QWidget):
             prof_collection.setMeta('loc', disp_name)
 
             if not prof_collection.getMeta('observed'):
-                # If it's not an observed profile, then generate profile objects in background.
+                # If it's not an observed profile, then generate profile objects in background. For ensembles, all
+                # the members get generated, so they're ready for drawing.
+                prof_collection.setCopyMode(all_members=prof_collection.isEnsemble())
                 prof_collection.setAsync(Picker.async)
 
             if self.skew is None:
@@ -479,17 +481,7 @@ class Picker(QWidget):
         for that archive sounding.
         """
 
-        for decname, deccls in getDecoders().iteritems():
-            try:
-                dec = deccls(filename)
-                break
-            except:
-                dec = None
-                continue
-
-        if dec is None:
-            raise IOError("Could not figure out the format of '%s'!" % filename)
-
+        dec = openFile(filename)
         profs = dec.getProfiles()
         stn_id = dec.getStnId()
 
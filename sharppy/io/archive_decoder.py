@@ -0,0 +1,210 @@
+import numpy as np
+import numpy.ma as ma
+import json
+import zlib
+import warnings
+from datetime import datetime, timedelta
+
+import sharppy.sharptab.profile as profile
+import sharppy.sharptab.prof_collection as prof_collection
+from sharppy.sharptab.prof_array import COLS
+from sharppy.io.decoder import Decoder, GZIP_MAGIC
+
+__fmtname__ = "archive"
+__classname__ = "ArchiveDecoder"
+__signature__ = r"\ASHARPARC"
+
+## The layout of an archive file:
+##   the header (HEADER_DTYPE)
+##   the collection information (JSON: the member names, dates, locations, and metadata), padded to 8 bytes
+##   the index, with one entry per profile (INDEX_DTYPE)
+##   the data for all the levels of all the profiles, one profile after the other (LEVEL_DTYPE)
+MAGIC = 'SHARPARC'
+VERSION = 1
+HEADER_DTYPE = np.dtype([ ('magic', 'S8'), ('version', '<u4'), ('n_profs', '<u4'), ('n_levels', '<u8'),
+    ('info_len', '<u8') ])
+INDEX_DTYPE = np.dtype([ ('member', '<u4'), ('time', '<u4'), ('location', '<u4'), ('cols', '<u4'), ('date', '<i8'),
+    ('latitude', '<f8'), ('missing', '<f8'), ('start', '<u8'), ('n_levels', '<u8') ])
+LEVEL_DTYPE = np.dtype([ (col, '<f8') for col in COLS ])
+
+# Dates are stored as microseconds since this time, and profiles without dates have NO_DATE
+EPOCH = datetime(1970, 1, 1)
+NO_DATE = np.iinfo(np.int64).min
+
+class ArchiveDecoder(Decoder):
+    '''
+        Decodes SHARPpy archive files (see writeArchive()).  The file is
+        memory-mapped, and the profiles are made when they're first used,
+        with their columns straight out of the map, so opening an archive
+        only reads the header and the index.
+    '''
+    def __init__(self, file_name, cache_size=128):
+        self._cache_size = cache_size
+        super(ArchiveDecoder, self).__init__(file_name)
+
+    def _parse(self):
+        file_data = self._downloadFile(mapped=True)
+        if file_data[:2] == GZIP_MAGIC:
+            # Archives written to a gzip stream (see writer.writeProfiles()) can't be mapped, so they're read into memory
+            file_data = bytearray(zlib.decompress(file_data[:], zlib.MAX_WBITS | 16))
+
+        header = np.frombuffer(file_data, dtype=HEADER_DTYPE, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise IOError("'%s' isn't a SHARPpy archive file" % self._file_name)
+        if header['version'] > VERSION:
+            raise IOError("'%s' is from a newer version of SHARPpy (archive version %d)" %
+                (self._file_name, header['version']))
+
+        n_profs, n_levels, info_len = int(header['n_profs']), int(header['n_levels']), int(header['info_len'])
+        info_start = HEADER_DTYPE.itemsize
+        info = json.loads(str(file_data[info_start:info_start + info_len]), object_hook=_fromJson)
+        index_start = _pad(info_start + info_len)
+        level_start = index_start + INDEX_DTYPE.itemsize * n_profs
+
+        self._index = np.frombuffer(file_data, dtype=INDEX_DTYPE, count=n_profs, offset=index_start)
+        self._levels = np.frombuffer(file_data, dtype=LEVEL_DTYPE, count=n_levels, offset=level_start)
+        self._locations = [ _toStr(loc) for loc in info['locations'] ]
+
+        members = [ _toStr(mem) for mem in info['members'] ]
+        records = [ (members[entry['member']], None, None, int(entry['start']), int(entry['start'] + entry['n_levels']), idx)
+            for idx, entry in enumerate(self._index) ]
+        profiles, dates, mem_order = self._streamProfiles(records, self._cache_size)
+
+        prof_coll = prof_collection.ProfCollection(profiles, info['dates'])
+        for key, value in info['meta'].iteritems():
+            prof_coll.setMeta(_toStr(key), value)
+        prof_coll.setHighlightedMember(members[0])
+        return prof_coll
+
+    def _loadRecord(self, member, idx):
+        # Make the profile with views of the level data as its columns
+        start, end, entry_idx = self._records[member][idx]
+        entry = self._index[entry_idx]
+        kwargs = dict(location=self._locations[entry['location']], missing=entry['missing'], profile='raw')
+        kwargs['date'] = None if entry['date'] == NO_DATE else EPOCH + timedelta(microseconds=int(entry['date']))
+        kwargs['latitude'] = ma.masked if np.isnan(entry['latitude']) else entry['latitude']
+
+        levels = self._levels[start:end]
+        for bit, col in enumerate(COLS):
+            if entry['cols'] & (1 << bit):
+                kwargs[col] = levels[col]
+        return profile.Profile(**kwargs)
+
+def writeArchive(prof_coll, file_name):
+    '''
+        Writes a profile collection to a SHARPpy archive file. All the data
+        are converted at once from the collection's dense arrays (see
+        ProfCollection.toArray()), and masked values are written as the
+        profiles' missing values.
+
+        Parameters
+        ----------
+        prof_coll : ProfCollection
+            The collection to write
+        file_name : string or file
+            The name of the file to write, or a file object open for
+            writing in binary mode
+
+    '''
+    prof_array = prof_coll.toArray()
+    n_mem, n_times = prof_array.n_levels.shape
+    n_lev = prof_array.data['pres'].shape[-1]
+    members = list(prof_array.members)
+    highlight = prof_coll.getHighlightedMember()
+    if highlight in members:
+        # The highlighted member goes first, so it's highlighted when the archive is read back in.
+        members.remove(highlight)
+        members.insert(0, highlight)
+    mem_order = [ prof_array.members.index(mem) for mem in members ]
+
+    ## the levels each profile uses in the arrays, one profile after the other
+    levels = np.arange(n_lev)
+    first = prof_array.first_level[mem_order][:, :, np.newaxis]
+    in_prof = (levels >= first) & (levels < first + prof_array.n_levels[mem_order][:, :, np.newaxis])
+    missing = np.array([ [ meta.get('missing', profile.MISSING) for meta in prof_array.meta[m] ] for m in mem_order ])
+
+    level_data = np.zeros((in_prof.sum(),), dtype=LEVEL_DTYPE)
+    cols = np.zeros((n_mem, n_times), dtype=np.uint32)
+    for bit, col in enumerate(COLS):
+        if col in prof_array.cols:
+            values = ma.filled(prof_array.data[col][mem_order], np.nan)
+            values = np.where(np.isnan(values), missing[:, :, np.newaxis], values)
+            level_data[col] = values[in_prof]
+            cols |= prof_array.has_col[col][mem_order].astype(np.uint32) << bit
+
+    locations = []
+    index = np.zeros((n_mem * n_times,), dtype=INDEX_DTYPE)
+    n_levels = prof_array.n_levels[mem_order].ravel()
+    index['member'] = np.repeat(np.arange(n_mem), n_times)
+    index['time'] = np.tile(np.arange(n_times), n_mem)
+    index['cols'] = cols.ravel()
+    index['missing'] = missing.ravel()
+    index['n_levels'] = n_levels
+    index['start'] = np.cumsum(n_levels) - n_levels
+    for idx, (m, t) in enumerate(zip(index['member'], index['time'])):
+        meta = prof_array.meta[mem_order[m]][t]
+        if meta.get('location') not in locations:
+            locations.append(meta.get('location'))
+        index['location'][idx] = locations.index(meta.get('location'))
+        index['date'][idx] = NO_DATE if meta.get('date') is None else _microseconds(meta['date'] - EPOCH)
+        latitude = meta.get('latitude', ma.masked)
+        index['latitude'][idx] = np.nan if latitude is ma.masked else latitude
+
+    meta = {}
+    for key in prof_coll.getMetaKeys():
+        try:
+            json.dumps(prof_coll.getMeta(key), default=_toJson)
+        except (TypeError, ValueError):
+            warnings.warn("Metadata '%s' can't be written to the archive, so it's left out" % key)
+            continue
+        meta[key] = prof_coll.getMeta(key)
+    info = json.dumps(dict(members=members, dates=prof_array.dates, locations=locations, meta=meta), default=_toJson)
+
+    header = np.zeros((1,), dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['n_profs'] = len(index)
+    header['n_levels'] = len(level_data)
+    header['info_len'] = len(info)
+
+    arc_file = file_name if hasattr(file_name, 'write') else open(file_name, 'wb')
+    try:
+        arc_file.write(header.tostring())
+        arc_file.write(info)
+        arc_file.write('\0' * (_pad(HEADER_DTYPE.itemsize + len(info)) - HEADER_DTYPE.itemsize - len(info)))
+        arc_file.write(index.tostring())
+        arc_file.write(level_data.tostring())
+    finally:
+        if arc_file is not file_name:
+            arc_file.close()
+
+def _pad(size):
+    # The index and level data start on 8-byte boundaries
+    return (size + 7) // 8 * 8
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _toJson(value):
+    # Dates and NumPy values in the metadata
+    if isinstance(value, datetime):
+        return { '__datetime__': _microseconds(value - EPOCH) }
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("%r can't be written to an archive" % value)
+
+def _fromJson(obj):
+    if '__datetime__' in obj:
+        return EPOCH + timedelta(microseconds=obj['__datetime__'])
+    return obj
+
+def _toStr(value):
+    # JSON strings come back as unicode
+    if isinstance(value, unicode):
+        try:
+            return str(value)
+        except UnicodeEncodeError:
+            pass
+    return value
@@ -1,4 +1,5 @@
 
+import re
 import numpy as np
 
 import sharppy.sharptab.profile as profile
@@ -9,112 +10,142 @@ from datetime import datetime
 
 __fmtname__ = "bufkit"
 __classname__ = "BufDecoder"
+__signature__ = r"SNPARM\s*="
+
+# Patterns that find the lines without the right number of whitespace-separated fields (see BufDecoder._allHaveFields()),
+#   by the number of fields
+_bad_line_patterns = {}
 
 class BufDecoder(Decoder):
-    def __init__(self, file_name):
+    '''
+        Decodes BUFKIT files.  If stream is True, the file is only scanned
+        for where each profile is (or the saved index is used, see
+        Decoder._recordIndex()), and the profiles are decoded when they're
+        first used, so getProfiles(indexes) only decodes those times.  The
+        last cache_size profiles that were used are kept around after that.
+    '''
+    def __init__(self, file_name, stream=False, cache_size=128):
+        self._stream = stream
+        self._cache_size = cache_size
         super(BufDecoder, self).__init__(file_name)
 
     def _parse(self):
-        file_data = self._downloadFile()
-
-        string = '\r\n\r\n\r\n'
-        members = np.array(file_data.split(string))
-        members = members[0:len(members)-1]
-        num_members = len(members)
-        profiles = {}
-        dates = None
-        mean_member = None
-
-        for n, mem_txt in enumerate(members):
-            mem_name, mem_profs, mem_dates = self._parseMember(mem_txt)
-            profiles[mem_name] = mem_profs
-            dates = mem_dates
+        records = self._recordIndex()
+        profiles, dates, members = self._streamProfiles(records, self._cache_size)
+        mean_member = members[0]
 
-            if mean_member is None:
-                mean_member = mem_name
+        if not self._stream:
+            profiles = dict( (mem, list(mem_profs)) for mem, mem_profs in profiles.iteritems() )
+            self._file_data = None
 
         prof_coll = prof_collection.ProfCollection(profiles, dates)
+        if not self._stream:
+            prof_coll.pack()
         prof_coll.setHighlightedMember(mean_member)
         prof_coll.setMeta('loc', profiles[mean_member][0].location)
         prof_coll.setMeta('observed', False)
         prof_coll.setMeta('base_time', dates[0])
         return prof_coll
 
-    def _parseMember(self, text):
-        data = np.array(text.split('\r\n'))
-        data_idxs = []
-        new_record = False
-        begin_idx = 0
-        member_name = data[0]
-        dates = []
-        # Figure out the indices for the data chunks
-        for i in range(len(data)):
-            if "STID" in data[i]:
-                # Here is information about the record
-                spl = data[i].split()
-
-                if spl[2].strip() == "STNM":
-                    station = "" # The bufkit file has a blank space for the station name
-                    wmo_id = spl[4]
-                    dates.append(datetime.strptime(spl[7], '%y%m%d/%H%M'))
-                else:
-                    station = spl[2]
-                    wmo_id = spl[5]
-                    dates.append(datetime.strptime(spl[8], '%y%m%d/%H%M'))
-
-                slat = float(data[i+1].split()[2])
-                slon = float(data[i+1].split()[5])
-                selv = float(data[i+1].split()[8])
-                stim = float(data[i+2].split()[2])
-
-            if data[i].find('HGHT') >= 0 and new_record == False:
-                # we've found a new data chunk
-                new_record = True
-                begin_idx = i+1
-            elif 'STID' in data[i] and new_record == True:
-                # We've found the end of the data chunk
-                new_record = False
-                data_idxs.append((begin_idx, i-1))
-            elif 'STN' in data[i] and new_record == True:
-                # We've found the end of the last data chunk of the file
-                new_record = False
-                data_idxs.append((begin_idx, i))
-            elif new_record == True:
-                continue
-                    ##print data[i]
-        
-        data_idxs = data_idxs[1:]
-        # Make arrays to store the data
-        profiles = []        
-
-        # Parse out the profiles
-        for i in range(len(data_idxs)):
-            data_stuff = data[data_idxs[i][0]: data_idxs[i][1]]
-            profile_length = len(data[data_idxs[i][0]: data_idxs[i][1]])/2
-
-            hght = np.zeros((profile_length,), dtype=float)
-            pres = np.zeros((profile_length,), dtype=float)
-            tmpc = np.zeros((profile_length,), dtype=float)
-            dwpc = np.zeros((profile_length,), dtype=float)
-            wdir = np.zeros((profile_length,), dtype=float)
-            wspd = np.zeros((profile_length,), dtype=float)
-            omeg = np.zeros((profile_length,), dtype=float)
-
-            for j in np.arange(0, profile_length * 2, 2):
-                if len(data_stuff[j+1].split()) == 1:
-                    hght[j / 2] = float(data_stuff[j+1].split()[0])
-                else:
-                    hght[j / 2] = float(data_stuff[j+1].split()[1])
-                tmpc[j / 2] = float(data_stuff[j].split()[1])
-                dwpc[j / 2] = float(data_stuff[j].split()[3])
-                pres[j / 2] = float(data_stuff[j].split()[0])
-                wspd[j / 2] = float(data_stuff[j].split()[6])
-                wdir[j / 2] = float(data_stuff[j].split()[5])
-                omeg[j / 2] = float(data_stuff[j].split()[7])
-
-            prof = profile.create_profile(profile='raw', pres=pres, hght=hght, tmpc=tmpc, dwpc=dwpc, 
-                wdir=wdir, wspd=wspd, omeg=omeg, location=station, date=dates[i], latitude=slat)
-
-            profiles.append(prof)
-
-        return member_name, profiles, dates
+    def _indexRecords(self, file_data):
+        # Find where each member and each profile in the members are in the file. The info for each profile is whether
+        #   it's the member's last one.
+        sep = '\r\n\r\n\r\n'
+        records = []
+        mem_start = 0
+        mem_end = file_data.find(sep)
+        while mem_end >= 0:
+            name_end = file_data.find('\r\n', mem_start, mem_end)
+            mem_name = file_data[mem_start:mem_end if name_end < 0 else name_end]
+
+            mem_records = []
+            stid = file_data.find('STID', mem_start, mem_end)
+            while stid >= 0:
+                line_start = file_data.rfind('\r\n', mem_start, stid)
+                line_start = mem_start if line_start < 0 else line_start + 2
+                line_end = file_data.find('\r\n', stid, mem_end)
+                line_end = mem_end if line_end < 0 else line_end
+
+                station, date = self._parseStid(file_data[line_start:line_end])
+                if len(mem_records) > 0:
+                    # Each profile runs up to the CRLF before the next one's STID line
+                    mem_records[-1][4] = line_start - 2
+                mem_records.append([ mem_name, date, station, line_start, mem_end, False ])
+                stid = file_data.find('STID', line_end, mem_end)
+
+            if len(mem_records) > 0:
+                mem_records[-1][5] = True
+            records.extend( tuple(rec) for rec in mem_records )
+
+            mem_start = mem_end + len(sep)
+            mem_end = file_data.find(sep, mem_start)
+        return records
+
+    def _parseStid(self, stid_line):
+        spl = stid_line.split()
+        if spl[2].strip() == "STNM":
+            station = "" # The bufkit file has a blank space for the station name
+            date = datetime.strptime(spl[7], '%y%m%d/%H%M')
+        else:
+            station = spl[2]
+            date = datetime.strptime(spl[8], '%y%m%d/%H%M')
+        return station, date
+
+    def _parseRecord(self, text, is_last):
+        # Decodes the profile from the text starting at its STID line
+        data = text.split('\r\n')
+
+        # Here is information about the record
+        station, date = self._parseStid(data[0])
+        wmo_id = data[0].split()[4 if station == "" else 5]
+
+        loc_line = data[1].split()
+        slat = float(loc_line[2])
+        slon = float(loc_line[5])
+        selv = float(loc_line[8])
+        stim = float(data[2].split()[2])
+
+        # The data chunk starts after the header line with HGHT in it, and ends at the blank line before the next
+        #   profile, or at the surface data (STN) after the last profile.
+        begin_idx = next( i for i, line in enumerate(data) if 'HGHT' in line ) + 1
+        if is_last:
+            end_idx = next( (i for i, line in enumerate(data) if i >= begin_idx and 'STN' in line), len(data) )
+        else:
+            end_idx = len(data) - 1
+
+        pres, hght, tmpc, dwpc, wdir, wspd, omeg = self._parseBlock(data[begin_idx:end_idx])
+        return profile.create_profile(profile='raw', pres=pres, hght=hght, tmpc=tmpc, dwpc=dwpc,
+            wdir=wdir, wspd=wspd, omeg=omeg, location=station, date=date, latitude=slat)
+
+    def _parseBlock(self, lines):
+        # Each level takes up two lines: the pressure, temperatures, winds, and omega on the first, and the height last
+        #   on the second (after the cloud fraction, if it's there).  The whole block is split up and converted at once,
+        #   and then the levels are the rows.
+        profile_length = len(lines) / 2
+        lines = lines[:2 * profile_length]
+        if profile_length == 0:
+            return [ np.zeros((0,), dtype=float) ] * 7
+
+        first_len, second_len = len(lines[0].split()), len(lines[1].split())
+        values = ' '.join(lines).split()
+
+        if len(values) != profile_length * (first_len + second_len) or first_len < 8 or second_len < 1 or \
+                not self._allHaveFields(lines[::2], first_len) or not self._allHaveFields(lines[1::2], second_len):
+            # The lines aren't all the same length, so fall back to going level by level
+            first = np.array([ [ float(v) for v in line.split()[:8] ] for line in lines[::2] ])
+            second = [ line.split() for line in lines[1::2] ]
+            hght = np.array([ float(spl[0] if len(spl) == 1 else spl[1]) for spl in second ])
+        else:
+            values = np.array(values, dtype=float).reshape((profile_length, first_len + second_len))
+            first = values[:, :first_len]
+            hght = values[:, first_len if second_len == 1 else first_len + 1]
+
+        pres, tmpc, dwpc, wdir, wspd, omeg = [ first[:, col].copy() for col in [ 0, 1, 3, 5, 6, 7 ] ]
+        return pres, hght.copy(), tmpc, dwpc, wdir, wspd, omeg
+
+    def _allHaveFields(self, lines, n_fields):
+        # Checks that every line has exactly n_fields whitespace-separated fields. A short line followed by a long one
+        #   has the right number of values in all, but the rows wouldn't line up when they're reshaped.
+        if n_fields not in _bad_line_patterns:
+            _bad_line_patterns[n_fields] = re.compile(r'^(?![ \t]*\S+(?:[ \t]+\S+){%d}[ \t]*$)' % (n_fields - 1), re.M)
+        return _bad_line_patterns[n_fields].search('\n'.join(lines)) is None
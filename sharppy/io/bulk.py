@@ -0,0 +1,162 @@
+import os
+import glob
+import tarfile
+import zipfile
+import tempfile
+import shutil
+import Queue
+from collections import deque
+
+from decoder import getDecoder, openFile, INDEX_SUFFIX
+from utils.frozenutils import Pool, cpu_count
+
+# How long to wait for a result before checking whether any failed without calling back (seconds)
+POLL_TIME = 0.1
+
+def decodeFiles(source, decoder=None, processes=None, ordered=False, max_pending=None):
+    '''
+        Decodes a lot of sounding files at once in worker processes.
+
+        Parameters
+        ----------
+        source : string or list
+            A directory (every file under it is decoded), a tar or zip
+            archive, a glob pattern, or a list of file names
+        decoder : string or Decoder subclass (optional)
+            The format name (e.g. 'spc') or the decoder to use. Default is
+            to figure out the format of each file (see decoder.openFile()).
+        processes : int (optional)
+            The number of worker processes. Default is one per core.
+        ordered : bool (optional)
+            If True, the results come back in the order the files were
+            found. Default is to return them as they finish.
+        max_pending : int (optional)
+            The most files being decoded (or decoded and waiting to be
+            returned) at once. Default is 4 per worker process.
+
+        Yields
+        ------
+        (path, ProfCollection or the exception that was raised decoding it)
+        For archives, the path is the archive name joined with the name of
+        the file in the archive.
+
+    '''
+    if processes is None:
+        processes = cpu_count()
+    if max_pending is None:
+        max_pending = 4 * processes
+
+    pool = Pool(processes)
+    finished = Queue.Queue()
+    pending = deque()
+
+    def nextResult():
+        if ordered:
+            path, tmp_name, result = pending.popleft()
+        else:
+            while not any( result.ready() for path, tmp_name, result in pending ):
+                try:
+                    finished.get(timeout=POLL_TIME)
+                except Queue.Empty:
+                    pass
+            path, tmp_name, result = next( item for item in pending if item[2].ready() )
+            pending.remove((path, tmp_name, result))
+
+        try:
+            prof_coll = result.get()
+        except Exception as e:
+            # The collection couldn't be sent back from the worker
+            prof_coll = e
+        _removeTemp(tmp_name)
+        return path, prof_coll
+
+    completed = False
+    try:
+        for path, file_name, tmp_name in _findFiles(source):
+            result = pool.apply_async(_decodeFile, (file_name, decoder), callback=lambda prof_coll: finished.put(None))
+            pending.append((path, tmp_name, result))
+
+            while len(pending) >= max_pending:
+                yield nextResult()
+
+        while len(pending) > 0:
+            yield nextResult()
+        completed = True
+    finally:
+        if completed:
+            pool.close()
+        else:
+            # The caller stopped early (or something went wrong), so don't wait for the rest
+            pool.terminate()
+        pool.join()
+        for path, tmp_name, result in pending:
+            _removeTemp(tmp_name)
+
+def _decodeFile(file_name, decoder):
+    # Runs in the worker processes. Errors are sent back instead of raised, so they go with the right file.
+    try:
+        if decoder is None:
+            return openFile(file_name).getProfiles()
+
+        if isinstance(decoder, basestring):
+            decoder = getDecoder(decoder)
+        return decoder(file_name).getProfiles()
+    except Exception as e:
+        return e
+
+def _findFiles(source):
+    # Yields (the path to report, the file to decode, the temporary file to delete afterwards or None)
+    if isinstance(source, (list, tuple)):
+        for file_name in source:
+            yield file_name, file_name, None
+
+    elif os.path.isdir(source):
+        for dir_name, sub_dirs, file_names in os.walk(source):
+            sub_dirs.sort()
+            for file_name in sorted(file_names):
+                if not file_name.endswith(INDEX_SUFFIX):
+                    path = os.path.join(dir_name, file_name)
+                    yield path, path, None
+
+    elif os.path.isfile(source) and zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        try:
+            for info in archive.infolist():
+                if not info.filename.endswith('/'):
+                    tmp_name = _extract(archive.open(info), info.filename)
+                    yield os.path.join(source, info.filename), tmp_name, tmp_name
+        finally:
+            archive.close()
+
+    elif os.path.isfile(source) and tarfile.is_tarfile(source):
+        # Read the archive as a stream, so compressed archives only get decompressed once
+        archive = tarfile.open(source, 'r|*')
+        try:
+            for info in archive:
+                if info.isfile():
+                    tmp_name = _extract(archive.extractfile(info), info.name)
+                    yield os.path.join(source, info.name), tmp_name, tmp_name
+        finally:
+            archive.close()
+
+    elif os.path.isfile(source):
+        yield source, source, None
+
+    else:
+        for file_name in sorted(glob.glob(source)):
+            for item in _findFiles(file_name if os.path.isdir(file_name) else [ file_name ]):
+                yield item
+
+def _extract(member_file, name):
+    # Copy a file out of an archive into a temporary file for a worker to decode
+    fd, tmp_name = tempfile.mkstemp(prefix='sharppy_', suffix='_' + os.path.basename(name))
+    with os.fdopen(fd, 'wb') as tmp_file:
+        shutil.copyfileobj(member_file, tmp_file)
+    return tmp_name
+
+def _removeTemp(tmp_name):
+    if tmp_name is not None:
+        try:
+            os.remove(tmp_name)
+        except OSError:
+            pass
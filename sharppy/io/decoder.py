@@ -2,12 +2,19 @@
 import numpy as np
 
 import sharppy.sharptab.profile as profile
+import sharppy.sharptab.prof_array as prof_array
 
 import urllib2
 from datetime import datetime
 import glob
 import os
 import imp
+import mmap
+import ast
+import re
+import hashlib
+import json
+import zlib
 
 class abstract(object):
     def __init__(self, func):
@@ -19,46 +26,265 @@ class abstract(object):
 # Comment this file
 
 HOME_DIR = os.path.join(os.path.expanduser("~"), ".sharppy", "decoders")
-_decoders = {}
+# Where to put the record indexes for files in directories we can't write to
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".sharppy", "index")
+INDEX_VERSION = 2
+INDEX_SUFFIX = '.idx'
+# How the dates are written in the record indexes
+INDEX_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+# Record indexes are only saved for files at least this big (bytes)
+INDEX_MIN_SIZE = 2 ** 20
+# Where the discovered decoders are saved between runs
+REGISTRY_CACHE = os.path.join(os.path.expanduser("~"), ".sharppy", "decoders.cache")
+REGISTRY_VERSION = 2
+# How much of the start of a file to look at to figure out its format (bytes)
+SNIFF_SIZE = 4096
+# The start of a gzip stream
+GZIP_MAGIC = '\x1f\x8b'
+BUILT_INS = [ 'buf_decoder', 'spc_decoder', 'pecan_decoder', 'archive_decoder' ]
+_decoders = None
+# Patterns that find the lines of data without the right number of fields (see Decoder._countRows()), by the number
+#   of fields
+_bad_row_patterns = {}
+
+class DecoderRegistry(object):
+    '''
+        The decoders, by format name. It can be used like a dictionary of
+        the decoder classes, but a decoder's module is only imported the
+        first time the decoder is asked for.
+    '''
+    def __init__(self):
+        self._entries = {}
+        self._order = []
+        self._classes = {}
+
+    def add(self, fmt_name, module, class_name, signature=None, path=None):
+        '''
+            Adds a decoder. module is the name of the module to import, or
+            the name to load the file at path as (for custom decoders).
+            signature is a regular expression that matches the start of
+            files in the format (see sniff()).
+        '''
+        if fmt_name not in self._entries:
+            self._order.append(fmt_name)
+        self._entries[fmt_name] = (module, class_name, signature, path)
+        self._classes.pop(fmt_name, None)
+
+    def __getitem__(self, fmt_name):
+        if fmt_name not in self._classes:
+            module, class_name, signature, path = self._entries[fmt_name]
+            if path is None:
+                dec_imp = __import__(module, globals(), locals(), [ class_name ], 0)
+            else:
+                dec_imp = imp.load_source(module, path)
+            self._classes[fmt_name] = getattr(dec_imp, class_name)
+        return self._classes[fmt_name]
+
+    def __contains__(self, fmt_name):
+        return fmt_name in self._entries
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def keys(self):
+        return list(self._order)
+
+    def iterkeys(self):
+        return iter(self._order)
+
+    def itervalues(self):
+        for fmt_name in self._order:
+            yield self[fmt_name]
+
+    def iteritems(self):
+        for fmt_name in self._order:
+            yield fmt_name, self[fmt_name]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def sniff(self, head):
+        '''
+            Returns the names of the formats whose signatures match the start
+            of a file (a string), in the order the decoders were added.
+        '''
+        return [ fmt_name for fmt_name in self._order if self._entries[fmt_name][2] is not None
+            and re.search(self._entries[fmt_name][2], head, re.MULTILINE) ]
 
 def findDecoders():
+    '''
+        Finds the built-in decoders and the custom decoders in
+        ~/.sharppy/decoders. The decoder modules aren't imported; their
+        format names, class names, and signatures are read from the source
+        (or from the saved results, if the files haven't changed since the
+        last time).
+    '''
     global _decoders
 
-    built_ins = [ 'buf_decoder', 'spc_decoder', 'pecan_decoder' ]
-    io = __import__('sharppy.io', globals(), locals(), built_ins, -1)
+    registry = DecoderRegistry()
+    built_in_dir = os.path.dirname(os.path.abspath(__file__))
+    built_ins = [ os.path.join(built_in_dir, dec + '.py') for dec in BUILT_INS ]
+    custom = sorted(glob.glob(os.path.join(HOME_DIR, '*.py')))
 
-    for dec in built_ins:
-        # Load build-in decoders
-        print "Loading decoder '%s'." % dec
-        dec_imp = getattr(io, dec)
+    cache = _loadJSON(REGISTRY_CACHE)
+    if not isinstance(cache, dict) or cache.get('version') != REGISTRY_VERSION or not isinstance(cache.get('dirs'), dict):
+        cache = { 'version':REGISTRY_VERSION, 'dirs':{} }
 
-        dec_name = dec_imp.__classname__
-        fmt_name = dec_imp.__fmtname__
+    changed = False
+    for dec_dir, dec_files, package in [ (built_in_dir, built_ins, 'sharppy.io.'), (HOME_DIR, custom, None) ]:
+        key = [ _mtime(dec_dir), [ [ dec, _mtime(dec) ] for dec in dec_files ] ]
+        entries = None
+        if dec_dir in cache['dirs']:
+            entries = _checkRegistryEntries(cache['dirs'][dec_dir], key, dec_files, package)
 
-        _decoders[fmt_name] = getattr(dec_imp, dec_name)
+        if entries is None:
+            entries = []
+            for dec in dec_files:
+                dec_mod_name = os.path.basename(dec)[:-3]
+                meta = _readMetadata(dec)
+                if package is None:
+                    entries.append((meta['__fmtname__'], dec_mod_name, meta['__classname__'], meta.get('__signature__'), dec))
+                else:
+                    entries.append((meta['__fmtname__'], package + dec_mod_name, meta['__classname__'], meta.get('__signature__'), None))
+            cache['dirs'][dec_dir] = { 'key':key, 'entries':entries }
+            changed = True
 
-    custom = glob.glob(os.path.join(HOME_DIR, '*.py'))
+        for entry in entries:
+            registry.add(*entry)
+
+    if changed:
+        try:
+            with open(REGISTRY_CACHE, 'wb') as cache_file:
+                json.dump(cache, cache_file)
+        except (IOError, OSError, TypeError, ValueError):
+            pass
 
-    for dec in custom:
-        # Find and load custom decoders
-        dec_mod_name = os.path.basename(dec)[:-3]
-        print "Found custom decoder '%s'." % dec_mod_name
-        dec_imp = imp.load_source(dec_mod_name, dec)
-        
-        dec_name = dec_imp.__classname__
-        fmt_name = dec_imp.__fmtname__
+    _decoders = registry
 
-        _decoders[fmt_name] = getattr(dec_imp, dec_name)
+def _checkRegistryEntries(saved, key, dec_files, package):
+    # Returns the saved decoders for a directory if they're up to date and well-formed, or None. The cache is plain data,
+    #   and an entry can only name one of the modules that were found in the directory, so a tampered cache can't load
+    #   code from anywhere else.
+    try:
+        if saved['key'] != key:
+            return None
+
+        entries = []
+        for fmt_name, module, class_name, signature, path in saved['entries']:
+            if not all( isinstance(val, basestring) for val in [ fmt_name, module, class_name ] ):
+                return None
+            if signature is not None and not isinstance(signature, basestring):
+                return None
+
+            if package is None:
+                if path not in dec_files or module != os.path.basename(path)[:-3]:
+                    return None
+            elif path is not None or module not in [ package + os.path.basename(dec)[:-3] for dec in dec_files ]:
+                return None
+            entries.append((_str(fmt_name), _str(module), _str(class_name), _str(signature), _str(path)))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return entries
+
+def _loadJSON(file_name):
+    # Reads a JSON file, or returns None if it can't be read or isn't JSON
+    try:
+        with open(file_name, 'rb') as json_file:
+            return json.load(json_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _str(value):
+    # JSON strings come back as unicode
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _readMetadata(dec_file):
+    # Read __fmtname__, __classname__, and __signature__ out of a decoder module without running it. If they aren't
+    #   plain strings, the module has to be imported to find out what they are.
+    names = [ '__fmtname__', '__classname__', '__signature__' ]
+    meta = {}
+    with open(dec_file, 'rb') as src:
+        tree = ast.parse(src.read(), dec_file)
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Str):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id in names:
+                    meta[target.id] = node.value.s
+
+    if '__fmtname__' not in meta or '__classname__' not in meta:
+        dec_imp = imp.load_source(os.path.basename(dec_file)[:-3], dec_file)
+        meta = dict( (name, getattr(dec_imp, name)) for name in names if hasattr(dec_imp, name) )
+    return meta
 
 def getDecoder(dec_name):
     return getDecoders()[dec_name]
 
 def getDecoders():
-    if _decoders == {}:
+    if _decoders is None:
         findDecoders()
 
     return _decoders
 
+def sniffFormat(file_name):
+    '''
+        Figures out the format of a file (local or URL) from the start of
+        it. Returns the format name, or None if no decoder's signature
+        matches.
+    '''
+    fmt_names = _sniff(file_name)
+    return fmt_names[0] if len(fmt_names) > 0 else None
+
+def _sniff(file_name):
+    # Returns the names of all the formats that match the start of the file
+    try:
+        try:
+            head_file = urllib2.urlopen(file_name)
+        except (ValueError, IOError):
+            head_file = open(file_name, 'rb')
+        head = head_file.read(SNIFF_SIZE)
+        head_file.close()
+    except IOError:
+        return []
+
+    if head[:2] == GZIP_MAGIC:
+        # Look at the start of what's in a gzip stream (e.g. a compressed archive)
+        try:
+            head = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(head, SNIFF_SIZE)
+        except zlib.error:
+            return []
+    return getDecoders().sniff(head)
+
+def openFile(file_name):
+    '''
+        Decodes a file without knowing the format ahead of time. The
+        decoders whose signatures match the start of the file are tried
+        first, then the rest.
+        Returns the decoder object.
+    '''
+    decoders = getDecoders()
+    fmt_names = _sniff(file_name)
+    for fmt_name in fmt_names + [ fmt for fmt in decoders if fmt not in fmt_names ]:
+        try:
+            return decoders[fmt_name](file_name)
+        except Exception:
+            continue
+    raise IOError("Could not figure out the format of '%s'!" % file_name)
+
 class Decoder(object):
     def __init__(self, file_name):
         self._file_name = file_name
@@ -68,7 +294,18 @@ class Decoder(object):
     def _parse(self):
         pass
 
-    def _downloadFile(self):
+    def _downloadFile(self, mapped=False):
+        '''
+            Reads in the file. If mapped is True, a local file is memory-mapped
+            instead, so the text is never all in memory at once. The mapped
+            file can be sliced and searched like a string (slices are
+            strings), but it doesn't have the rest of the string methods.
+            Files from URLs are always read into memory (a temporary file
+            can't be deleted while it's mapped on Windows).
+        '''
+        if mapped and os.path.isfile(self._file_name):
+            return self._mapFile(self._file_name)
+
         # Try to open the file.  This is a dirty hack right now until
         # I can figure out a cleaner way to make sure the file (either local or URL)
         # gets opened.
@@ -79,14 +316,164 @@ class Decoder(object):
                 f = open(self._file_name, 'rb')
             except IOError:
                 raise IOError("File '%s' cannot be found" % self._file_name)
+
         file_data = f.read()
 #       f.close() # Apparently, this multiplies the time this function takes by anywhere from 2 to 6 ... ???
         return file_data
 
+    @abstract
+    def _indexRecords(self, file_data):
+        '''
+            For decoders that can decode profiles one at a time: returns a list
+            of (member, date, station, start, end, info) for the profiles in the
+            file, where start and end are the byte range of the profile in the
+            file, and info is anything else _parseRecord() needs.
+        '''
+        pass
+
+    @abstract
+    def _parseRecord(self, text, info):
+        '''
+            For decoders that can decode profiles one at a time: returns the
+            profile decoded from the text of one record.
+        '''
+        pass
+
+    def _recordIndex(self):
+        '''
+            Returns the record index for the file (see _indexRecords()). The
+            indexes for big local files are saved next to the file (or in
+            ~/.sharppy/index if that doesn't work) and reused until the file's
+            size or modification time changes. Local files are memory-mapped,
+            so only the records that get decoded are read in.
+        '''
+        self._file_data = self._downloadFile(mapped=True)
+        if not os.path.isfile(self._file_name):
+            return self._indexRecords(self._file_data)
+
+        stat = os.stat(self._file_name)
+        key = dict(version=INDEX_VERSION, decoder=self.__class__.__name__, size=stat.st_size, mtime=stat.st_mtime)
+        idx_names = self._indexFileNames()
+
+        for idx_name in idx_names:
+            records = self._readIndex(_loadJSON(idx_name), key)
+            if records is not None:
+                return records
+
+        records = self._indexRecords(self._file_data)
+        if stat.st_size >= INDEX_MIN_SIZE and len(records) > 0:
+            try:
+                index = dict(key, records=[ [ member, None if date is None else date.strftime(INDEX_DATE_FORMAT),
+                    station, start, end, info ] for member, date, station, start, end, info in records ])
+                index = json.dumps(index)
+            except (TypeError, ValueError):
+                # Something in the records can't be saved (e.g. member names that aren't UTF-8)
+                return records
+
+            for idx_name in idx_names:
+                try:
+                    if not os.path.exists(os.path.dirname(idx_name)):
+                        os.makedirs(os.path.dirname(idx_name))
+                    with open(idx_name, 'wb') as idx_file:
+                        idx_file.write(index)
+                    break
+                except (IOError, OSError):
+                    continue
+        return records
+
+    def _readIndex(self, index, key):
+        '''
+            Returns the records from a saved record index (the JSON object
+            from the file), or None if it isn't for this version of the file
+            and decoder, or anything in it isn't what it should be. Saved
+            indexes are only ever read as data.
+        '''
+        try:
+            if any( index[name] != value for name, value in key.iteritems() ):
+                return None
+
+            records = []
+            for member, date, station, start, end, info in index['records']:
+                if not isinstance(member, basestring) or not (station is None or isinstance(station, basestring)):
+                    return None
+                if type(start) not in [ int, long ] or type(end) not in [ int, long ] or not 0 <= start <= end <= key['size']:
+                    return None
+                if not (info is None or type(info) in [ bool, int, long, float ] or isinstance(info, basestring)):
+                    return None
+                if date is not None:
+                    date = datetime.strptime(date, INDEX_DATE_FORMAT)
+                records.append((_str(member), date, _str(station), start, end, _str(info)))
+        except (KeyError, TypeError, ValueError):
+            return None
+        return records
+
+    def _indexFileNames(self):
+        # The places to look for the record index, in order
+        file_name = os.path.abspath(self._file_name)
+        return [ file_name + INDEX_SUFFIX, os.path.join(INDEX_DIR, hashlib.md5(file_name).hexdigest() + INDEX_SUFFIX) ]
+
+    def _mapFile(self, file_name):
+        # Memory-map a local file. Empty files can't be mapped, but there's nothing to read in them anyway. The map is
+        #   copy-on-write, so arrays made straight from it can be changed without changing the file.
+        map_file = open(file_name, 'rb')
+        try:
+            return mmap.mmap(map_file.fileno(), 0, access=mmap.ACCESS_COPY)
+        except ValueError:
+            return ''
+        finally:
+            map_file.close()
+
+    def _countRows(self, text, n_cols):
+        '''
+            Returns the number of lines of data in text if every line that
+            isn't blank has exactly n_cols comma-separated fields, or None if
+            any line doesn't. The decoders check this before reading all the
+            numbers in a block at once, so a short line can't be made up for
+            by a long one.
+        '''
+        if n_cols not in _bad_row_patterns:
+            field = r'[ \t]*[^\s,]+[ \t]*'
+            _bad_row_patterns[n_cols] = re.compile(r'^(?![ \t\r]*$)(?!%s(?:,%s){%d}\r?$)' % (field, field, n_cols - 1),
+                re.M)
+
+        if _bad_row_patterns[n_cols].search(text) is not None:
+            return None
+        return text.count(',') // (n_cols - 1)
+
+    def _streamProfiles(self, records, cache_size):
+        '''
+            Makes the lists of profiles for a collection from a record index.
+            The profiles are decoded when they're first used (see
+            sharppy.sharptab.prof_array.LazyProfs). Returns the profiles for
+            each member, the dates (from the first member), and the member
+            names in the order they're in the file.
+        '''
+        self._records = {}
+        members = []
+        dates = {}
+        for member, date, station, start, end, info in records:
+            if member not in self._records:
+                members.append(member)
+                self._records[member] = []
+                dates[member] = []
+            self._records[member].append((start, end, info))
+            dates[member].append(date)
+
+        cache = prof_array.ProfCache(cache_size)
+        profiles = dict( (mem, prof_array.LazyProfs(self._loadRecord, mem, len(recs), cache))
+            for mem, recs in self._records.iteritems() )
+        return profiles, dates[members[0]] if len(members) > 0 else [], members
+
+    def _loadRecord(self, member, idx):
+        start, end, info = self._records[member][idx]
+        return self._parseRecord(self._file_data[start:end], info)
+
     def getProfiles(self, indexes=None):
         '''
             Returns a list of profile objects generated from the
-            file that was read in.
+            file that was read in. For decoders that were opened to
+            stream the profiles, only the profiles asked for are
+            decoded.
 
             Parameters
             ----------
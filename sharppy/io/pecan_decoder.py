@@ -1,53 +1,202 @@
 import numpy as np
+import numpy.ma as ma
+import warnings
 import sharppy.sharptab.profile as profile
 import sharppy.sharptab.prof_collection as prof_collection
+from sharppy.sharptab.prof_array import ProfArray
 from datetime import datetime
 from sharppy.io.decoder import Decoder
-from StringIO import StringIO
 
 __fmtname__ = "pecan"
 __classname__ = "PECANDecoder"
+__signature__ = r"^TIME = \d{6}/\d{4}\s*$"
+
+# The columns in each line of data
+COLS = [ 'pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd', 'omeg' ]
+# The number of lines before the data in each section (the member, time, station, etc., and the column names)
+HEADER_LINES = 6
+MISSING = -999.0
 
 class PECANDecoder(Decoder):
-    def __init__(self, file_name):
+    '''
+        Decodes PECAN files.  If stream is True, the profiles are decoded when
+        they're first used (see BufDecoder).  Sections of the file that can't
+        be decoded are left out, with a warning (see getMalformedSections()).
+    '''
+    def __init__(self, file_name, stream=False, cache_size=128):
+        self._stream = stream
+        self._cache_size = cache_size
+        self._malformed = []
         super(PECANDecoder, self).__init__(file_name)
 
     def _parse(self):
-        file_data = self._downloadFile()
-
-        file_profiles = file_data.split('\n\n\n')
-
-        profiles = {}
-        dates = []
-        for m in file_profiles:
-            try:
-                prof, dt_obj, member = self._parseSection(m)
-            except:
-                continue
-
-            # Try to add the profile object to the list of profiles for this member
-            try:
-                profiles[member] = profiles[member] + [prof]
-            except Exception,e:
-                profiles[member] = [prof]
-            dates.append(dt_obj)
-
-        prof_coll = prof_collection.ProfCollection(profiles, dates)
+        if self._stream:
+            profiles, dates, members = self._streamProfiles(self._recordIndex(), self._cache_size)
+            prof_coll = prof_collection.ProfCollection(profiles, dates)
+            prof_coll.setMeta('observed', False)
+            prof_coll.setMeta('base_time', dates[0])
+            return prof_coll
+
+        file_data = self._downloadFile(mapped=True)
+
+        sections = []
+        for sec_num, start, end, data_start, header in self._scanSections(file_data):
+            if isinstance(header, Exception):
+                self._reportMalformed(file_data, sec_num, start, "can't read the header (%s)" % header)
+            else:
+                sections.append((sec_num, start, header, file_data[data_start:end]))
+
+        # Convert the data in every section at once. If any line doesn't have all the columns, or the numbers don't add
+        #   up, go through the sections one at a time to find the bad ones.
+        n_rows = [ self._countRows(text, len(COLS)) for sec_num, start, header, text in sections ]
+        values = np.zeros((0,))
+        if all( n_rows ):
+            values = np.fromstring('\n'.join( text for sec_num, start, header, text in sections ).replace(',', ' '), sep=' ')
+
+        if all( n_rows ) and len(values) == len(COLS) * sum(n_rows):
+            values = values.reshape((-1, len(COLS)))
+        else:
+            good_sections, n_rows, values = [], [], []
+            for sec_num, start, header, text in sections:
+                try:
+                    sec_values = self._parseValues(text)
+                except ValueError as e:
+                    self._reportMalformed(file_data, sec_num, start, str(e))
+                    continue
+                good_sections.append((sec_num, start, header, text))
+                n_rows.append(len(sec_values))
+                values.append(sec_values)
+            sections = good_sections
+            values = np.concatenate(values) if len(values) > 0 else np.zeros((0, len(COLS)))
+
+        if len(sections) == 0:
+            raise IOError("No profiles could be decoded from '%s'" % self._file_name)
+
+        prof_coll = self._makeCollection([ header for sec_num, start, header, text in sections ], n_rows, values)
         prof_coll.setMeta('observed', False)
-        prof_coll.setMeta('base_time', dates[0])
+        prof_coll.setMeta('base_time', prof_coll._dates[0])
         return prof_coll
 
-    def _parseSection(self, section):
-        parts = section.split('\n')
+    def _makeCollection(self, headers, n_rows, values):
+        # Put the profiles for all the members and times straight into dense arrays (see ProfArray). The dates come
+        #   from the first member.
+        members = []
+        mem_idxs, time_idxs = [], []
+        dates = {}
+        meta = []
+        for dt_obj, member, location in headers:
+            if member not in dates:
+                members.append(member)
+                dates[member] = []
+                meta.append([])
+            mem_idx = members.index(member)
+            mem_idxs.append(mem_idx)
+            time_idxs.append(len(dates[member]))
+            dates[member].append(dt_obj)
+            meta[mem_idx].append(dict(location=location, date=dt_obj, latitude=ma.masked, missing=MISSING, profile='raw'))
+
+        n_times = len(dates[members[0]])
+        if any( len(mem_dates) != n_times for mem_dates in dates.itervalues() ):
+            # The members don't all have the same times, so the profiles can't go into one array.
+            profiles = dict( (mem, []) for mem in members )
+            for (dt_obj, member, location), sec_values in zip(headers, np.split(values, np.cumsum(n_rows)[:-1])):
+                kwargs = dict( (col, sec_values[:, idx]) for idx, col in enumerate(COLS) )
+                profiles[member].append(profile.create_profile(profile='raw', location=location, date=dt_obj,
+                    missing=MISSING, **kwargs))
+            return prof_collection.ProfCollection(profiles, dates[members[0]])
+
+        # Where each line of data goes in the arrays
+        n_rows = np.array(n_rows)
+        sec_idxs = np.repeat(np.arange(len(n_rows)), n_rows)
+        levels = np.arange(len(values)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+        mem_idxs, time_idxs = np.array(mem_idxs)[sec_idxs], np.array(time_idxs)[sec_idxs]
+
+        shape = (len(members), n_times, n_rows.max())
+        data = {}
+        for idx, col in enumerate(COLS):
+            data[col] = ma.masked_all(shape, dtype=float)
+            data[col][mem_idxs, time_idxs, levels] = values[:, idx]
+
+        has_col = dict( (col, np.ones(shape[:2], dtype=bool)) for col in COLS )
+        first_level = np.zeros(shape[:2], dtype=int)
+        level_counts = np.zeros(shape[:2], dtype=int)
+        level_counts[np.array(mem_idxs)[np.cumsum(n_rows) - 1], np.array(time_idxs)[np.cumsum(n_rows) - 1]] = n_rows
+
+        prof_array = ProfArray.fromData(members, dates[members[0]], data, has_col, first_level, level_counts, meta)
+        return prof_collection.ProfCollection.fromArray(prof_array)
+
+    def _reportMalformed(self, file_data, sec_num, start, reason):
+        line_num = file_data[:start].count('\n') + 1
+        self._malformed.append((sec_num, line_num, reason))
+        warnings.warn("Skipping section %d (line %d) of '%s': %s" % (sec_num, line_num, self._file_name, reason))
+
+    def getMalformedSections(self):
+        '''
+            Returns a list of (section number, line number, reason) for the
+            sections of the file that couldn't be decoded.
+        '''
+        return list(self._malformed)
+
+    def _scanSections(self, file_data):
+        # The sections are separated by two blank lines. Yields (section number, start, end, where the data start,
+        #   (date, member, location) or the error reading the header) for each section that isn't blank.
+        sep = '\n\n\n'
+        sec_start = 0
+        sec_num = 0
+        while sec_start <= len(file_data):
+            sec_end = file_data.find(sep, sec_start)
+            if sec_end < 0:
+                sec_end = len(file_data)
+
+            data_start = sec_start
+            for i in xrange(HEADER_LINES):
+                data_start = file_data.find('\n', data_start, sec_end) + 1
+                if data_start == 0:
+                    data_start = sec_end
+                    break
+
+            if file_data[sec_start:sec_end].strip() != '':
+                try:
+                    header = self._parseHeader(file_data[sec_start:data_start].split('\n'))
+                except (ValueError, IndexError) as e:
+                    header = e
+                yield sec_num, sec_start, sec_end, data_start, header
+                sec_num += 1
+            sec_start = sec_end + len(sep)
+
+    def _indexRecords(self, file_data):
+        # Sections with headers that can't be read are left out.
+        return [ (member, dt_obj, location, start, end, None)
+            for sec_num, start, end, data_start, (dt_obj, member, location)
+            in ( sec for sec in self._scanSections(file_data) if not isinstance(sec[4], Exception) ) ]
+
+    def _parseRecord(self, text, info):
+        return self._parseSection(text)[0]
+
+    def _parseHeader(self, parts):
         dt_obj = datetime.strptime(parts[1], 'TIME = %y%m%d/%H%M')
         member = parts[0].split('=')[-1].strip()
         location = parts[2].split('SLAT')[0].split('=')[-1].strip()
-        data = '\n'.join(parts[5:])
-        sound_data = StringIO( data )
-        p, h, t, td, wdir, wspd, omeg = np.genfromtxt( sound_data, delimiter=',', unpack=True)
+        return dt_obj, member, location
+
+    def _parseValues(self, text):
+        # Read the lines of comma-separated data into an array with the levels as rows
+        n_rows = self._countRows(text, len(COLS))
+        if not n_rows:
+            raise ValueError("the data aren't %d comma-separated numbers on every line" % len(COLS))
+
+        values = np.fromstring(text.replace(',', ' '), sep=' ')
+        if len(values) != len(COLS) * n_rows:
+            raise ValueError("the data aren't %d comma-separated numbers on every line" % len(COLS))
+        return values.reshape((n_rows, len(COLS)))
+
+    def _parseSection(self, section):
+        parts = section.split('\n', HEADER_LINES)
+        dt_obj, member, location = self._parseHeader(parts)
+        values = self._parseValues(parts[HEADER_LINES] if len(parts) > HEADER_LINES else '')
+        kwargs = dict( (col, values[:, idx]) for idx, col in enumerate(COLS) )
 
-        prof = profile.create_profile(profile='raw', pres=p[1:], hght=h[1:], tmpc=t[1:], dwpc=td[1:], wspd=wspd[1:],\
-                                      wdir=wdir[1:], omeg=omeg[1:], location=location, date=dt_obj, missing=-999.0)
+        prof = profile.create_profile(profile='raw', location=location, date=dt_obj, missing=MISSING, **kwargs)
         return prof, dt_obj, member
 
 if __name__ == '__main__':
@@ -10,23 +10,26 @@ from datetime import datetime
 
 __fmtname__ = "spc"
 __classname__ = "SPCDecoder"
+__signature__ = r"^\s*%TITLE%\s*$"
 
 class SPCDecoder(Decoder):
     def __init__(self, file_name):
         super(SPCDecoder, self).__init__(file_name)
 
     def _parse(self):
-        file_data = self._downloadFile()
-        ## read in the file
-        data = np.array([l.strip() for l in file_data.split('\n')])
+        file_data = self._downloadFile(mapped=True)
 
         ## necessary index points
-        title_idx = np.where( data == '%TITLE%')[0][0]
-        start_idx = np.where( data == '%RAW%' )[0][0] + 1
-        finish_idx = np.where( data == '%END%')[0][0]
+        title_start, title_end = self._findLine(file_data, '%TITLE%')
+        raw_start, raw_end = self._findLine(file_data, '%RAW%')
+        finish_start, finish_end = self._findLine(file_data, '%END%', raw_end)
+
+        ## the line after the title marker has the station and time
+        header_end = file_data.find('\n', title_end + 1)
+        header = file_data[title_end + 1:len(file_data) if header_end < 0 else header_end]
 
         ## create the plot title
-        data_header = data[title_idx + 1].split()
+        data_header = header.split()
         location = data_header[0]
         time = datetime.strptime(data_header[1][:11], '%y%m%d/%H%M')
         
@@ -35,12 +38,8 @@ class SPCDecoder(Decoder):
             # i.e. a 1957 sounding becomes 2057 sounding...ensure that it's a part of the 20th century
             time = datetime.strptime('19' + data_header[1][:11], '%Y%m%d/%H%M')
 
-        ## put it all together for StringIO
-        full_data = '\n'.join(data[start_idx : finish_idx][:])
-        sound_data = StringIO( full_data )
-
-        ## read the data into arrays
-        p, h, T, Td, wdir, wspd = np.genfromtxt( sound_data, delimiter=',', comments="%", unpack=True )
+        ## only the data section gets copied out of the file
+        p, h, T, Td, wdir, wspd = self._parseData( file_data[raw_end + 1:finish_start] )
 #       idx = np.argsort(p, kind='mergesort')[::-1] # sort by pressure in case the pressure array is off.
 
         pres = p #[idx]
@@ -63,3 +62,28 @@ class SPCDecoder(Decoder):
         prof_coll.setMeta('observed', True)
         prof_coll.setMeta('base_time', time)
         return prof_coll
+
+    def _parseData(self, text):
+        # Read the six comma-separated columns all at once. If any line doesn't have six fields, or they aren't all
+        #   numbers (missing values, comments, etc.), fall back to genfromtxt.
+        n_rows = self._countRows(text, 6)
+        if n_rows and '%' not in text:
+            values = np.fromstring(text.replace(',', ' '), sep=' ')
+            if len(values) == 6 * n_rows:
+                return values.reshape((n_rows, 6)).T.copy()
+
+        ## read the data into arrays
+        return np.genfromtxt( StringIO(text), delimiter=',', comments="%", unpack=True )
+
+    def _findLine(self, file_data, marker, start=0):
+        # Find the line that's just the marker. Returns where the line starts and ends (at the newline).
+        pos = file_data.find(marker, start)
+        while pos >= 0:
+            line_start = file_data.rfind('\n', 0, pos) + 1
+            line_end = file_data.find('\n', pos)
+            if line_end < 0:
+                line_end = len(file_data)
+            if file_data[line_start:line_end].strip() == marker:
+                return line_start, line_end
+            pos = file_data.find(marker, line_end)
+        raise IndexError("Couldn't find the %s line" % marker)
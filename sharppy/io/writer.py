@@ -0,0 +1,200 @@
+import numpy as np
+import numpy.ma as ma
+import gzip
+import getpass
+from datetime import datetime
+
+import sharppy.sharptab.profile as profile
+import sharppy.sharptab.prof_collection as prof_collection
+import sharppy.sharptab.utils as utils
+from archive_decoder import writeArchive
+
+FORMATS = [ 'spc', 'csv', 'archive' ]
+
+## The columns in the SPC text format, and the value written for masked data
+SPC_COLS = [ 'pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd' ]
+CSV_COLS = SPC_COLS + [ 'omeg' ]
+FILL = -9999.
+
+def writeProfiles(profs, file_name, fmt='spc', compress=False):
+    '''
+        Writes a lot of soundings at once. Each column is formatted for a
+        whole profile in one go from the dense arrays of the collection
+        (see ProfCollection.toArray()), rather than one value at a time.
+
+        SPC text files hold one profile each, and archive files hold one
+        collection each, so when there's more than one to write, file_name
+        is a template for str.format() with these fields: index (counting
+        from 0), member, date, and location. CSV files hold everything, with
+        a row for each level of each profile.
+
+        Parameters
+        ----------
+        profs : Profile, ProfCollection, or list
+            What to write. A list can hold profiles and collections (e.g.
+            from bulk.decodeFiles()); the loose profiles in it are written
+            as one collection.
+        file_name : string
+            The name of the file to write, or a template for the names (see
+            above)
+        fmt : string (optional)
+            'spc' (default), 'csv', or 'archive' (see archive_decoder)
+        compress : bool (optional)
+            If True, the files are written as gzip streams. Default is False.
+
+        Returns
+        -------
+        The list of the names of the files written
+
+    '''
+    if fmt not in FORMATS:
+        raise ValueError("Unknown format '%s'" % fmt)
+
+    colls = _collections(profs)
+    if fmt == 'csv':
+        out_file = _open(file_name, compress)
+        try:
+            out_file.write(','.join([ 'member', 'location', 'date' ] + CSV_COLS) + '\n')
+            for coll in colls:
+                _writeCSV(coll.toArray(), out_file)
+        finally:
+            out_file.close()
+        return [ file_name ]
+
+    if fmt == 'archive':
+        ## the file names come from the highlighted member's first profile
+        units = []
+        for coll in colls:
+            prof_array = coll.toArray()
+            m = prof_array.members.index(coll.getHighlightedMember())
+            meta = prof_array.meta[m][0] if len(prof_array.dates) > 0 else {}
+            units.append((coll, dict(member=coll.getHighlightedMember(), date=meta.get('date'),
+                location=meta.get('location'))))
+    else:
+        now = datetime.utcnow()
+        user = getpass.getuser()
+        units = []
+        for coll in colls:
+            prof_array = coll.toArray()
+            values = _columns(prof_array, SPC_COLS)
+            for m, mem in enumerate(prof_array.members):
+                for t, meta in enumerate(prof_array.meta[m]):
+                    units.append(((prof_array, values, m, t), dict(member=mem, date=meta.get('date'),
+                        location=meta.get('location'))))
+
+    file_names = _fileNames(file_name, [ fields for unit, fields in units ])
+    for (unit, fields), name in zip(units, file_names):
+        out_file = _open(name, compress)
+        try:
+            if fmt == 'archive':
+                writeArchive(unit, out_file)
+            else:
+                prof_array, values, m, t = unit
+                out_file.write(_spcText(prof_array, values, m, t, now, user))
+        finally:
+            out_file.close()
+    return file_names
+
+def _collections(profs):
+    # Turns what's to be written into a list of collections
+    if isinstance(profs, prof_collection.ProfCollection):
+        return [ profs ]
+    if isinstance(profs, profile.Profile):
+        profs = [ profs ]
+
+    colls = []
+    loose = []
+    for item in profs:
+        if isinstance(item, prof_collection.ProfCollection):
+            colls.append(item)
+        else:
+            loose.append(item)
+    if len(loose) > 0:
+        colls.append(prof_collection.ProfCollection({'':loose}, [ prof.date for prof in loose ]))
+    return colls
+
+def _columns(prof_array, cols):
+    '''
+        Returns the columns to write for all the profiles in a ProfArray, as
+        (member, time, level) arrays with the masked values filled in. The
+        wind direction and speed are computed from the components for the
+        profiles that only have those.
+    '''
+    values = {}
+    for col in cols:
+        if col in prof_array.cols:
+            values[col] = prof_array.data[col].copy()
+            values[col][~prof_array.has_col[col]] = ma.masked
+        else:
+            values[col] = ma.masked_all(prof_array.n_levels.shape + (prof_array.data['pres'].shape[-1],))
+
+    if 'wdir' in cols and 'u' in prof_array.cols:
+        no_vec = prof_array.has_col['u'].copy()
+        if 'wdir' in prof_array.cols:
+            no_vec &= ~prof_array.has_col['wdir']
+        if no_vec.any():
+            values['wdir'][no_vec], values['wspd'][no_vec] = utils.comp2vec(prof_array.data['u'][no_vec],
+                prof_array.data['v'][no_vec])
+
+    return dict( (col, ma.filled(vals, FILL)) for col, vals in values.iteritems() )
+
+def _levels(prof_array, values, cols, m, t):
+    # The (level, column) array of the values for one profile
+    first = prof_array.first_level[m, t]
+    levs = slice(first, first + prof_array.n_levels[m, t])
+    return np.column_stack([ values[col][m, t, levs] for col in cols ])
+
+def _spcText(prof_array, values, m, t, now, user):
+    meta = prof_array.meta[m][t]
+    location = meta.get('location') or ''
+    date = meta.get('date')
+
+    snd_loc = (" " * (4 - len(location))) + location
+    text = "%TITLE%\n"
+    text += "%s   %s\n Saved by user: %s on %s UTC\n" % (snd_loc, date.strftime("%y%m%d/%H%M") if date is not None else '',
+        user, now.strftime('%Y%m%d/%H%M'))
+    text += "   LEVEL       HGHT       TEMP       DWPT       WDIR       WSPD\n"
+    text += "-------------------------------------------------------------------\n"
+    text += "%RAW%\n"
+
+    ## all the levels are formatted at once
+    levels = _levels(prof_array, values, SPC_COLS, m, t)
+    line = ",  ".join([ "%8.2f" ] * len(SPC_COLS)) + "\n"
+    text += (line * len(levels)) % tuple(levels.ravel().tolist())
+    text += "%END%\n"
+    return text
+
+def _writeCSV(prof_array, out_file):
+    values = _columns(prof_array, CSV_COLS)
+    for m, mem in enumerate(prof_array.members):
+        for t, meta in enumerate(prof_array.meta[m]):
+            date = meta.get('date')
+            prefix = ','.join([ _csvField(mem), _csvField(meta.get('location') or ''),
+                date.strftime('%Y-%m-%d %H:%M:%S') if date is not None else '' ])
+
+            ## all the levels are formatted at once
+            levels = _levels(prof_array, values, CSV_COLS, m, t)
+            line = prefix.replace('%', '%%') + ''.join([ ",%.2f" ] * len(CSV_COLS)) + "\n"
+            out_file.write((line * len(levels)) % tuple(levels.ravel().tolist()))
+
+def _csvField(value):
+    value = str(value)
+    if any( char in value for char in ',"\n' ):
+        value = '"%s"' % value.replace('"', '""')
+    return value
+
+def _fileNames(file_name, fields):
+    # Fills in the file name template for each file to write
+    if len(fields) == 1:
+        return [ file_name ]
+
+    file_names = [ file_name.format(index=idx, **flds) for idx, flds in enumerate(fields) ]
+    if len(set(file_names)) < len(file_names):
+        raise ValueError("The file name '%s' gives the same name to more than one file (use {index}, {member}, {date}, "
+            "or {location} in it)" % file_name)
+    return file_names
+
+def _open(file_name, compress):
+    if compress:
+        return gzip.open(file_name, 'wb')
+    return open(file_name, 'wb')
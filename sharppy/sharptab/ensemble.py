@@ -0,0 +1,110 @@
+''' Ensemble Statistics Routines '''
+from __future__ import division
+import warnings
+import numpy as np
+import numpy.ma as ma
+from sharppy.sharptab import utils
+from sharppy.sharptab.constants import *
+
+__all__ = ['INDICES', 'get_index', 'ens_stats']
+
+## How to get each index from a ConvectiveProfile
+INDICES = {
+    'sbcape': lambda prof: prof.sfcpcl.bplus,
+    'sbcin': lambda prof: prof.sfcpcl.bminus,
+    'mlcape': lambda prof: prof.mlpcl.bplus,
+    'mlcin': lambda prof: prof.mlpcl.bminus,
+    'mucape': lambda prof: prof.mupcl.bplus,
+    'mucin': lambda prof: prof.mupcl.bminus,
+    'mllcl': lambda prof: prof.mlpcl.lclhght,
+    'srh1km': lambda prof: prof.srh1km[0],
+    'srh3km': lambda prof: prof.srh3km[0],
+    'esrh': lambda prof: prof.right_esrh[0],
+    'shear1km': lambda prof: utils.mag(*prof.sfc_1km_shear),
+    'shear6km': lambda prof: utils.mag(*prof.sfc_6km_shear),
+    'ebwspd': lambda prof: prof.ebwspd,
+    'stp_cin': lambda prof: prof.stp_cin,
+    'stp_fixed': lambda prof: prof.stp_fixed,
+    'scp': lambda prof: prof.right_scp,
+    'ship': lambda prof: prof.ship,
+    'pwat': lambda prof: prof.pwat,
+    'k_idx': lambda prof: prof.k_idx,
+    'totals_totals': lambda prof: prof.totals_totals,
+    'lapserate_700_500': lambda prof: prof.lapserate_700_500,
+    'lapserate_3km': lambda prof: prof.lapserate_3km,
+    'wndg': lambda prof: prof.wndg,
+}
+
+def get_index(prof, name):
+    '''
+    Gets the value of an index from a profile.
+
+    Parameters
+    ----------
+    prof : ConvectiveProfile object
+    name : string
+        The name of the index (one of the keys of INDICES)
+
+    Returns
+    -------
+    The value of the index (float), or ma.masked if it's missing
+
+    '''
+    if name not in INDICES:
+        raise ValueError("Unknown index '%s'" % name)
+
+    val = INDICES[name](prof)
+
+    if val is None or not utils.QC(val) or val == MISSING:
+        return ma.masked
+    return float(val)
+
+def ens_stats(vals, percentiles=(10, 25, 50, 75, 90), thresholds=()):
+    '''
+    Computes the distribution of an index across the ensemble members
+    at each time.  Missing values are left out.
+
+    Parameters
+    ----------
+    vals : masked array
+        The index values, with dimensions (member, time)
+    percentiles : list (optional)
+        The percentiles to compute
+    thresholds : list (optional)
+        The thresholds to compute the exceedance probabilities for
+
+    Returns
+    -------
+    stats : dictionary
+        'mean', 'std', 'median', 'min', 'max', and 'count' map to
+        arrays over time, 'percentiles' maps each percentile to an array
+        over time, and 'prob' maps each threshold to the fraction of the
+        members with a value above the threshold (an array over time).
+        Times with no values are masked.
+
+    '''
+    vals = ma.asanyarray(vals, dtype=float)
+    valid = ~ma.getmaskarray(vals)
+    count = valid.sum(axis=0)
+    no_vals = count == 0
+    filled = ma.filled(vals, np.nan)
+
+    with warnings.catch_warnings():
+        # All-missing times give NaNs, which get masked below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stats = {
+            'mean': vals.mean(axis=0),
+            'std': vals.std(axis=0),
+            'min': vals.min(axis=0),
+            'max': vals.max(axis=0),
+            'median': ma.masked_invalid(np.nanmedian(filled, axis=0)),
+            'count': count,
+        }
+        pctls = np.nanpercentile(filled, percentiles, axis=0) if len(percentiles) > 0 else []
+        stats['percentiles'] = dict( (pct, ma.masked_invalid(pctl)) for pct, pctl in zip(percentiles, pctls) )
+
+    stats['prob'] = {}
+    for thresh in thresholds:
+        n_above = (valid & (ma.getdata(vals) > thresh)).sum(axis=0)
+        stats['prob'][thresh] = ma.array(n_above / np.maximum(count, 1), mask=no_vals)
+    return stats
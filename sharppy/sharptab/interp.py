@@ -350,3 +350,60 @@ def generic_interp_pres(p, pres, field):
         field_intrp = field_intrp[()]
 
     return field_intrp
+
+def generic_interp_pres_stack(p, pres, fields):
+    '''
+    Interpolation routine for many profiles at once.  This gives the same
+    answer as calling generic_interp_pres() for each profile, but all the
+    profiles are interpolated with a single call to np.interp(), by
+    shifting each profile's pressures so they don't overlap any other's.
+
+    Parameters
+    ----------
+    p : numpy array
+        The pressures (in the same space as pres) to interpolate to, with
+        dimensions (profile, level)
+    pres : list of numpy arrays
+        The pressures for each profile, in ascending order
+    fields : list of numpy arrays
+        The variable being interpolated for each profile
+
+    Returns
+    -------
+    A masked array (profile, level) of the 'field' variables at the given
+    pressures
+
+    '''
+    p = np.asarray(p, dtype=float)
+    xs, ys = [], []
+    bounds = np.zeros((len(pres), 2))
+    firsts = np.zeros((len(pres), 2))
+    empty = np.zeros(len(pres), dtype=bool)
+    for i, (prs, fld) in enumerate(zip(pres, fields)):
+        not_masked = ~ma.getmaskarray(prs) & ~ma.getmaskarray(fld)
+        x = ma.getdata(prs)[not_masked].astype(float)
+        y = ma.getdata(fld)[not_masked].astype(float)
+        empty[i] = len(x) == 0
+        if not empty[i]:
+            bounds[i] = x[0], x[-1]
+            firsts[i] = y[0], y[-1]
+        xs.append(x)
+        ys.append(y)
+
+    # Each profile gets its own stretch of the x-axis, wider than any of the profiles
+    finite = np.concatenate(xs + [ p[np.isfinite(p)] ])
+    width = 2 * (np.abs(finite).max() + 1) if len(finite) > 0 else 1.
+    shift = width * np.arange(len(pres))
+    if len(xs) > 0 and not empty.all():
+        field_intrp = np.interp((p + shift[:, np.newaxis]).ravel(),
+            np.concatenate([ x + s for x, s in zip(xs, shift) ]), np.concatenate(ys)).reshape(p.shape)
+    else:
+        field_intrp = np.empty(p.shape)
+        field_intrp[:] = np.nan
+
+    # Out of range is masked, except within roundoff of the ends, as in generic_interp_pres()
+    at_bot = np.isclose(p, bounds[:, :1])
+    at_top = np.isclose(p, bounds[:, 1:])
+    field_intrp = np.where(at_top, firsts[:, 1:], np.where(at_bot, firsts[:, :1], field_intrp))
+    outside = (p < bounds[:, :1]) & ~at_bot | (p > bounds[:, 1:]) & ~at_top | empty[:, np.newaxis]
+    return ma.masked_where(outside | np.isnan(field_intrp), field_intrp)
@@ -21,14 +21,14 @@ from sharppy.sharptab.constants import *
     
 '''
 
-__all__ = ['DefineParcel', 'Parcel', 'inferred_temp_advection']
+__all__ = ['DefineParcel', 'Parcel', 'inferred_temp_advection', 'inferred_temp_adv_series']
 __all__ += ['k_index', 't_totals', 'c_totals', 'v_totals', 'precip_water']
 __all__ += ['temp_lvl', 'max_temp', 'mean_mixratio', 'mean_theta', 'mean_thetae', 'mean_relh']
 __all__ += ['lapse_rate', 'most_unstable_level', 'parcelx', 'bulk_rich']
 __all__ += ['bunkers_storm_motion', 'effective_inflow_layer']
 __all__ += ['convective_temp', 'esp', 'pbl_top', 'precip_eff', 'dcape', 'sig_severe']
 __all__ += ['dgz', 'ship', 'stp_cin', 'stp_fixed', 'scp', 'mmp', 'wndg', 'sherb', 'tei', 'cape']
-__all__ += ['mburst', 'dcp', 'ehi', 'sweat', 'hgz', 'lhp']
+__all__ += ['mburst', 'dcp', 'ehi', 'sweat', 'hgz', 'lhp', 'IndexContext', 'composite_indices']
 
 
 class DefineParcel(object):
@@ -394,8 +394,9 @@ def ship(prof, **kwargs):
         mupcl : (optional) Most-Unstable Parcel
         lr75 : (optional) 700 - 500 mb lapse rate (C/km)
         h5_temp : (optional) 500 mb temperature (C)
-        shr06 : (optional) 0-6 km shear (m/s)
+        sfc6shr : (optional) 0-6 km shear (m/s)
         frz_lvl : (optional) freezing level (m)
+        ctx : (optional) IndexContext holding the shared ingredients
 
         Returns
         -------
@@ -409,7 +410,7 @@ def ship(prof, **kwargs):
         The significant hail parameter (SHIP; SPC 2014) is
         an index developed in-house at the SPC. (Johnson and Sugden 2014)
     '''
-      
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
     mupcl = kwargs.get('mupcl', None)
     sfc6shr = kwargs.get('sfc6shr', None)
     frz_lvl = kwargs.get('frz_lvl', None)
@@ -417,34 +418,25 @@ def ship(prof, **kwargs):
     lr75 = kwargs.get('lr75', None)
 
     if not mupcl:
-        try:
-            mupcl = prof.mupcl
-        except:
-            mulplvals = DefineParcel(prof, flag=3, pres=300)
-            mupcl = cape(prof, lplvals=mulplvals)
+        mupcl = ctx.mupcl
     mucape = mupcl.bplus
     mumr = thermo.mixratio(mupcl.pres, mupcl.dwpc)
 
     if not frz_lvl:
-        frz_lvl = interp.hght(prof, temp_lvl(prof, 0))
+        frz_lvl = ctx.frz_lvl
 
     if not h5_temp:
-        h5_temp = interp.temp(prof, 500.)
+        h5_temp = ctx.h5_temp
 
     if not lr75:
-        lr75 = lapse_rate(prof, 700., 500., pres=True)
+        lr75 = ctx.lr75
 
     if not sfc6shr:
-        try:
-            sfc_6km_shear = prof.sfc_6km_shear
-        except:
-            sfc = prof.pres[prof.sfc]
-            p6km = interp.pres(prof, interp.to_msl(prof, 6000.))
-            sfc_6km_shear = winds.wind_shear(prof, pbot=sfc, ptop=p6km)
-    
-    sfc_6km_shear = utils.mag(sfc_6km_shear[0], sfc_6km_shear[1])
-    shr06 = utils.KTS2MS(sfc_6km_shear)
-    
+        sfc_6km_shear = utils.mag(ctx.sfc_6km_shear[0], ctx.sfc_6km_shear[1])
+        shr06 = utils.KTS2MS(sfc_6km_shear)
+    else:
+        shr06 = sfc6shr
+
     if shr06 > 27:
         shr06 = 27.
     elif shr06 < 7:
@@ -719,7 +711,57 @@ def precip_water(prof, pbot=None, ptop=400, dp=-1, exact=False):
     return (((w[:-1]+w[1:])/2 * (p[:-1]-p[1:])) * 0.00040173).sum()
 
 
-def inferred_temp_adv(prof, lat=35):
+def _layer_levels(pbots, ptops, dp=-1):
+    '''
+        Returns the pressures np.arange(pbot, ptop+dp, dp) would generate for
+        each layer, as a 2D array (layer, level) padded at the top, and a mask
+        of the padding.  Returns (None, None) if there are no levels.
+    '''
+    if dp > 0: dp = -dp
+
+    # The number of levels np.arange(pbot, ptop+dp, dp) would generate for each layer
+    nlevs = np.maximum(np.ceil((ptops + dp - pbots) / dp), 0).astype(int)
+    if len(nlevs) == 0 or nlevs.max() == 0:
+        return None, None
+
+    steps = np.arange(nlevs.max())
+    ps = pbots[:, np.newaxis] + dp * steps[np.newaxis, :]
+    pad = steps[np.newaxis, :] >= nlevs[:, np.newaxis]
+    return ps, pad
+
+
+def _layer_mean_wind(prof, pbots, ptops, dp=-1):
+    '''
+        Calculates the pressure-weighted mean wind through many layers at once.
+        This gives the same answer as calling winds.mean_wind() for each
+        (pbot, ptop) pair, but interpolates the winds for all of the layers in
+        a single pass.
+
+        Parameters
+        ----------
+        prof : Profile object
+        pbots : array of the pressures of the bottoms of the layers (hPa)
+        ptops : array of the pressures of the tops of the layers (hPa)
+        dp : negative integer (optional; default -1)
+        The pressure increment for the interpolated sounding
+
+        Returns
+        -------
+        mnu : array of the U-components of the mean wind in each layer
+        mnv : array of the V-components of the mean wind in each layer
+    '''
+    pbots = np.asarray(pbots, dtype=float)
+    ps, pad = _layer_levels(pbots, np.asarray(ptops, dtype=float), dp)
+    if ps is None:
+        return ma.masked_all(pbots.shape), ma.masked_all(pbots.shape)
+
+    u, v = interp.components(prof, ps.ravel())
+    u = ma.masked_where(pad, ma.asanyarray(u).reshape(ps.shape))
+    v = ma.masked_where(pad, ma.asanyarray(v).reshape(ps.shape))
+    return ma.average(u, axis=1, weights=ps), ma.average(v, axis=1, weights=ps)
+
+
+def inferred_temp_adv(prof, lat=35, pbounds=None):
     '''
         Inferred Temperature Advection
 
@@ -736,10 +778,14 @@ def inferred_temp_adv(prof, lat=35):
 
         This code uses Equation 4.1.139 from Bluestein's "Synoptic-Dynamic Meteorology in Midlatitudes (Volume I)"
 
+        All of the layers are evaluated at once using array operations.
+
         Parameters
         ----------
         prof : Profile object
         lat : latitude in decimal degrees (optional)
+        pbounds : array of the layer boundaries in hPa, ordered from the bottom up (optional;
+            default is every 100 mb from the surface to 100 mb)
 
         Returns
         -------
@@ -748,62 +794,122 @@ def inferred_temp_adv(prof, lat=35):
     '''
 
     omega = (2. * np.pi) / (86164.)
-       
-    dp = -100
-    pres_idx = np.where(prof.pres >= 100.)[0]
-    pressures = np.arange(prof.pres[prof.get_sfc()], prof.pres[pres_idx][-1], dp, dtype=type(prof.pres[prof.get_sfc()])) # Units: mb
+
+    if pbounds is None:
+        dp = -100
+        pres_idx = np.where(prof.pres >= 100.)[0]
+        pbounds = np.arange(prof.pres[prof.get_sfc()], prof.pres[pres_idx][-1], dp, dtype=type(prof.pres[prof.get_sfc()])) # Units: mb
+
+    pressures = np.asarray(pbounds, dtype=float)
+    bottom_pres = pressures[:-1]
+    top_pres = pressures[1:]
+    pressure_bounds = np.column_stack((bottom_pres, top_pres))
+
+    if not utils.QC(lat):
+        temp_adv = np.empty(len(pressures) - 1)
+        temp_adv[:] = np.nan
+        return temp_adv, pressure_bounds
+
+    f = 2. * omega * np.sin(np.radians(lat)) # Units: (s**-1)
+    multiplier = (f / 9.81) * (np.pi / 180.) # Units: (s**-1 / (m/s**2)) * (radians/degrees)
+
+    # Get the temperatures (in Kelvin), heights (in meters), and wind directions at the layer boundaries
     temps = thermo.ctok(interp.temp(prof, pressures))
     heights = interp.hght(prof, pressures)
-    temp_adv = np.empty(len(pressures) - 1)
     dirs = interp.vec(prof, pressures)[0]
-    pressure_bounds = np.empty((len(pressures) - 1, 2))
 
-    if utils.QC(lat):
-        f = 2. * omega * np.sin(np.radians(lat)) # Units: (s**-1)
+    # Calculate the average temperature
+    avg_temp = (temps[1:] + temps[:-1]) * 2.
+
+    # Calculate the mean wind in each layer (this is assumed to be geostrophic)
+    mean_u, mean_v = _layer_mean_wind(prof, bottom_pres, top_pres)
+    mean_wspd = utils.KTS2MS(utils.mag(mean_u, mean_v)) # Convert this geostrophic wind speed to m/s
+
+    # Here we calculate the change in wind direction with height (thanks to Andrew Mackenzie for help with this)
+    # The sign of d_theta will dictate whether or not it is warm or cold advection
+    d_theta = ma.mod(dirs[1:] - dirs[:-1] + 180., 360.) - 180.
+
+    # Here we calculate t_adv (which is -V_g * del(T) or the local change in temperature term)
+    # K/s  s * rad/m * deg   m^2/s^2          K        degrees / m
+    t_adv = multiplier * np.power(mean_wspd, 2) * avg_temp * (d_theta / (heights[1:] - heights[:-1])) # Units: Kelvin / seconds
+    temp_adv = t_adv * 60. * 60. # Converts Kelvin/seconds to Kelvin/hour (or Celsius/hour)
+
+    return temp_adv, pressure_bounds
+
+
+def inferred_temp_adv_series(profs, lat=35, pbounds=None):
+    '''
+        Inferred Temperature Advection for a sequence of profiles (*)
+
+        Evaluates inferred_temp_adv() for every profile in 'profs' (for instance, every
+        forecast hour of one member of a ProfCollection) on a common set of layer boundaries,
+        so that the results can be stacked into a single time-height array.  Layers that
+        extend below the surface or above the top of a profile are masked.
+
+        All of the profiles are evaluated at once: the interpolation for every profile is
+        done in one pass (see interp.generic_interp_pres_stack()), and the rest of the
+        calculation is done on (profile, layer) arrays.
+
+        Parameters
+        ----------
+        profs : list of Profile objects
+        lat : latitude in decimal degrees, or a list with one latitude per profile (optional)
+        pbounds : array of the layer boundaries in hPa, ordered from the bottom up (optional;
+            default is every 100 mb from 1000 mb to 100 mb)
+
+        Returns
+        -------
+        temp_adv : a 2D masked array (profile, layer) of temperature advection values in C/hr
+        pressure_bounds: a 2D array indicating the top and bottom bounds of the temperature advection layers.
+    '''
+    if pbounds is None:
+        pbounds = np.arange(1000., 99., -100.)
+    pbounds = np.asarray(pbounds, dtype=float)
+
+    if np.iterable(lat):
+        lats = list(lat)
     else:
-        temp_adv[:] = np.nan
-        return temp_adv, pressure_bounds
+        lats = [ lat for p in profs ]
+
+    pressure_bounds = np.column_stack((pbounds[:-1], pbounds[1:]))
+    ps, pad = _layer_levels(pbounds[:-1], pbounds[1:])
+    if len(profs) == 0 or ps is None:
+        return ma.masked_all((len(profs), len(pbounds) - 1)), pressure_bounds
 
+    # Interpolates a column of every profile to the same pressures
+    logps = [ prof.logp[::-1] for prof in profs ]
+    def interp_all(col, p):
+        p = np.tile(np.log10(p).ravel(), (len(profs), 1))
+        return interp.generic_interp_pres_stack(p, logps, [ getattr(prof, col)[::-1] for prof in profs ])
+
+    omega = (2. * np.pi) / (86164.)
+    lats = np.array([ prof_lat if utils.QC(prof_lat) else np.nan for prof_lat in lats ], dtype=float)
+    f = 2. * omega * np.sin(np.radians(lats))[:, np.newaxis] # Units: (s**-1)
     multiplier = (f / 9.81) * (np.pi / 180.) # Units: (s**-1 / (m/s**2)) * (radians/degrees)
 
-    for i in xrange(1, len(pressures)):
-        bottom_pres = pressures[i-1]
-        top_pres = pressures[i]
-        # Get the temperatures from both levels (in Kelvin)
-        btemp = temps[i-1]
-        ttemp = temps[i]
-        # Get the two heights of the top and bottom layer
-        bhght = heights[i-1] # Units: meters
-        thght = heights[i] # Units: meters
-        bottom_wdir = dirs[i-1] # Meteorological degrees (degrees from north)
-        top_wdir = dirs[i] # same units as top_wdir
-        
-        # Calculate the average temperature
-        avg_temp = (ttemp + btemp) * 2.
-        
-        # Calculate the mean wind between the two levels (this is assumed to be geostrophic)
-        mean_u, mean_v = winds.mean_wind(prof, pbot=bottom_pres, ptop=top_pres)
-        mean_wdir, mean_wspd = utils.comp2vec(mean_u, mean_v) # Wind speed is in knots here
-        mean_wspd = utils.KTS2MS(mean_wspd) # Convert this geostrophic wind speed to m/s
-        
-        # Here we calculate the change in wind direction with height (thanks to Andrew Mackenzie for help with this)
-        # The sign of d_theta will dictate whether or not it is warm or cold advection
-        mod = 180 - bottom_wdir
-        top_wdir = top_wdir + mod
-        
-        if top_wdir < 0:
-            top_wdir = top_wdir + 360
-        elif top_wdir >= 360:
-            top_wdir = top_wdir - 360
-        d_theta = top_wdir - 180.
-        
-        # Here we calculate t_adv (which is -V_g * del(T) or the local change in temperature term)
-        # K/s  s * rad/m * deg   m^2/s^2          K        degrees / m
-        t_adv = multiplier * np.power(mean_wspd,2) * avg_temp * (d_theta / (thght - bhght)) # Units: Kelvin / seconds
-        
-        # Append the pressure bounds so the person knows the pressure
-        pressure_bounds[i-1, :] = bottom_pres, top_pres
-        temp_adv[i-1] = t_adv*60.*60. # Converts Kelvin/seconds to Kelvin/hour (or Celsius/hour)
+    # Get the temperatures (in Kelvin), heights (in meters), and wind directions at the layer boundaries
+    temps = thermo.ctok(interp_all('tmpc', pbounds))
+    heights = interp_all('hght', pbounds)
+    dirs = utils.comp2vec(interp_all('u', pbounds), interp_all('v', pbounds))[0]
+
+    # Calculate the average temperature
+    avg_temp = (temps[:, 1:] + temps[:, :-1]) * 2.
+
+    # Calculate the mean wind in each layer (this is assumed to be geostrophic), as _layer_mean_wind() does
+    shape = (len(profs),) + ps.shape
+    weights = np.broadcast_to(ps, shape)
+    mean_u = ma.average(ma.masked_where(np.broadcast_to(pad, shape), interp_all('u', ps).reshape(shape)), axis=2,
+        weights=weights)
+    mean_v = ma.average(ma.masked_where(np.broadcast_to(pad, shape), interp_all('v', ps).reshape(shape)), axis=2,
+        weights=weights)
+    mean_wspd = utils.KTS2MS(utils.mag(mean_u, mean_v)) # Convert this geostrophic wind speed to m/s
+
+    # The sign of d_theta will dictate whether or not it is warm or cold advection
+    d_theta = ma.mod(dirs[:, 1:] - dirs[:, :-1] + 180., 360.) - 180.
+
+    # K/s  s * rad/m * deg   m^2/s^2          K        degrees / m
+    t_adv = multiplier * np.power(mean_wspd, 2) * avg_temp * (d_theta / (heights[:, 1:] - heights[:, :-1])) # Units: Kelvin / seconds
+    temp_adv = ma.masked_invalid(t_adv * 60. * 60.) # Converts Kelvin/seconds to Kelvin/hour (or Celsius/hour)
 
     return temp_adv, pressure_bounds
 
@@ -2208,7 +2314,176 @@ def convective_temp(prof, **kwargs):
         if pcl.bplus == 0.: pcl.bminus = ma.masked
     return tmpc
 
-def tei(prof):
+class IndexContext(object):
+    '''
+        Holds the ingredients shared by the composite indices (SHIP, SHERB, MMP,
+        WNDG, SigSevere, ESP, TEI, DCP, MBURST, and SWEAT) so that they only need
+        to be computed once per profile.
+
+        Each ingredient is read from the profile if it is already there (e.g. the
+        parcels and shear vectors of a ConvectiveProfile).  Otherwise, it is computed
+        the first time it is requested and cached on the context, so no parcel is
+        lifted more than once.  Ingredients may also be supplied as keyword arguments.
+
+        Parameters
+        ----------
+        prof : Profile object
+
+        Optional Keywords
+        mupcl, mlpcl, sfcpcl : Most-Unstable, Mixed-Layer, and Surface-Based Parcel objects
+        lr03, lr36, lr38 : 0-3, 3-6, and 3-8 km AGL lapse rates (C/km)
+        lr85, lr75 : 850-500 and 700-500 mb lapse rates (C/km)
+        sfc_1km_shear, sfc_3km_shear, sfc_6km_shear, sfc_8km_shear : shear vectors (kts)
+        mean_6km : 0-6 km pressure-weighted mean wind (direction, speed in kts)
+        ebottom, etop : bottom and top of the effective inflow layer (mb)
+        ebwd : effective bulk wind difference vector (kts)
+        pwat : precipitable water (in)
+        dcape : downdraft CAPE (J/kg)
+        h5_temp : 500 mb temperature (C)
+        frz_lvl : freezing level height (m)
+        totals_totals, vertical_totals : Total Totals and Vertical Totals indices
+    '''
+    ingredients = [ 'mupcl', 'mlpcl', 'sfcpcl', 'lr03', 'lr36', 'lr38', 'lr85', 'lr75',
+        'sfc_1km_shear', 'sfc_3km_shear', 'sfc_6km_shear', 'sfc_8km_shear', 'mean_6km',
+        'ebottom', 'etop', 'ebwd', 'pwat', 'dcape', 'h5_temp', 'frz_lvl', 'totals_totals',
+        'vertical_totals' ]
+
+    # The attributes a Profile object may already have for each ingredient
+    _prof_attrs = { 'mupcl':'mupcl', 'mlpcl':'mlpcl', 'sfcpcl':'sfcpcl', 'lr03':'lapserate_3km',
+        'lr36':'lapserate_3_6km', 'lr85':'lapserate_850_500', 'lr75':'lapserate_700_500',
+        'sfc_1km_shear':'sfc_1km_shear', 'sfc_3km_shear':'sfc_3km_shear',
+        'sfc_6km_shear':'sfc_6km_shear', 'sfc_8km_shear':'sfc_8km_shear', 'mean_6km':'mean_6km',
+        'ebottom':'ebottom', 'etop':'etop', 'ebwd':'ebwd', 'pwat':'pwat', 'dcape':'dcape',
+        'totals_totals':'totals_totals', 'vertical_totals':'vertical_totals' }
+
+    # The ingredients that are computed from other ingredients
+    _depends = { 'ebottom':[ 'mupcl' ], 'etop':[ 'mupcl' ], 'ebwd':[ 'mupcl', 'ebottom', 'etop' ] }
+
+    def __init__(self, prof, **kwargs):
+        self.prof = prof
+        for name, value in kwargs.iteritems():
+            if name not in IndexContext.ingredients:
+                raise ValueError("'%s' is not an index context ingredient" % name)
+            setattr(self, name, value)
+
+    def __getattr__(self, name):
+        # Only called when the ingredient hasn't been cached yet
+        if name not in IndexContext.ingredients:
+            raise AttributeError("'IndexContext' object has no attribute '%s'" % name)
+
+        prof_attr = IndexContext._prof_attrs.get(name, None)
+        if prof_attr is not None and hasattr(self.prof, prof_attr):
+            value = getattr(self.prof, prof_attr)
+        else:
+            value = getattr(self, '_get_' + name)()
+        setattr(self, name, value)
+        return value
+
+    def copy(self, **kwargs):
+        '''
+            Returns a new context for the same profile with the ingredients cached
+            so far, except that the ones given as keyword arguments are replaced.
+            Cached ingredients that were computed from a replaced one are dropped.
+        '''
+        cached = dict( (name, value) for name, value in self.__dict__.iteritems() if name in IndexContext.ingredients )
+        for name, deps in IndexContext._depends.iteritems():
+            if name not in kwargs and any( dep in kwargs for dep in deps ):
+                cached.pop(name, None)
+        cached.update(kwargs)
+        return IndexContext(self.prof, **cached)
+
+    def precompute(self, names=None):
+        '''
+            Computes (or looks up) the ingredients in 'names' up front.  Defaults
+            to all of the ingredients.  Returns the context.
+        '''
+        if names is None:
+            names = IndexContext.ingredients
+        for name in names:
+            getattr(self, name)
+        return self
+
+    def _agl_pres(self, hght):
+        return interp.pres(self.prof, interp.to_msl(self.prof, hght))
+
+    def _sfc_shear(self, hght):
+        return winds.wind_shear(self.prof, pbot=self.prof.pres[self.prof.sfc], ptop=self._agl_pres(hght))
+
+    def _get_mupcl(self):
+        return parcelx(self.prof, flag=3)
+
+    def _get_mlpcl(self):
+        return parcelx(self.prof, flag=4)
+
+    def _get_sfcpcl(self):
+        return parcelx(self.prof, flag=1)
+
+    def _get_lr03(self):
+        return lapse_rate(self.prof, 0., 3000., pres=False)
+
+    def _get_lr36(self):
+        return lapse_rate(self.prof, 3000., 6000., pres=False)
+
+    def _get_lr38(self):
+        return lapse_rate(self.prof, 3000., 8000., pres=False)
+
+    def _get_lr85(self):
+        return lapse_rate(self.prof, 850., 500., pres=True)
+
+    def _get_lr75(self):
+        return lapse_rate(self.prof, 700., 500., pres=True)
+
+    def _get_sfc_1km_shear(self):
+        return self._sfc_shear(1000.)
+
+    def _get_sfc_3km_shear(self):
+        return self._sfc_shear(3000.)
+
+    def _get_sfc_6km_shear(self):
+        return self._sfc_shear(6000.)
+
+    def _get_sfc_8km_shear(self):
+        return self._sfc_shear(8000.)
+
+    def _get_mean_6km(self):
+        sfc = self.prof.pres[self.prof.sfc]
+        return utils.comp2vec(*winds.mean_wind(self.prof, pbot=sfc, ptop=self._agl_pres(6000.)))
+
+    def _get_ebottom(self):
+        self.ebottom, self.etop = effective_inflow_layer(self.prof, mupcl=self.mupcl)
+        return self.ebottom
+
+    def _get_etop(self):
+        self._get_ebottom()
+        return self.etop
+
+    def _get_ebwd(self):
+        if self.ebottom is ma.masked or self.etop is ma.masked:
+            return [ma.masked, ma.masked]
+        ebotm = interp.to_agl(self.prof, interp.hght(self.prof, self.ebottom))
+        depth = ( self.mupcl.elhght - ebotm ) / 2
+        elh = self._agl_pres(ebotm + depth)
+        return winds.wind_shear(self.prof, pbot=self.ebottom, ptop=elh)
+
+    def _get_pwat(self):
+        return precip_water(self.prof)
+
+    def _get_dcape(self):
+        return dcape(self.prof)[0]
+
+    def _get_h5_temp(self):
+        return interp.temp(self.prof, 500.)
+
+    def _get_frz_lvl(self):
+        return interp.hght(self.prof, temp_lvl(self.prof, 0))
+
+    def _get_totals_totals(self):
+        return t_totals(self.prof)
+
+    def _get_vertical_totals(self):
+        return v_totals(self.prof)
+
+def tei(prof, **kwargs):
     '''
         Theta-E Index (TEI)
         TEI is the difference between the surface theta-e and the minimum theta-e value
@@ -2224,6 +2499,8 @@ def tei(prof):
         Parameters
         ----------
         prof : Profile object
+        ctx : IndexContext (optional; accepted for consistency with the other
+              composite indices, TEI only needs the theta-e profile)
         
         Returns
         -------
@@ -2256,21 +2533,19 @@ def esp(prof, **kwargs):
         ----------
         prof : Profile object
         mlpcl : Mixed-Layer Parcel object (optional)
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
         esp : ESP index
         '''
-     
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
     mlpcl = kwargs.get('mlpcl', None)
     if not mlpcl:
-        try:
-            mlpcl = prof.mlpcl
-        except:
-            mlpcl = parcelx(prof, flag=4)
+        mlpcl = ctx.mlpcl
     mlcape = mlpcl.b3km
     
-    lr03 = prof.lapserate_3km # C/km
+    lr03 = ctx.lr03 # C/km
     if lr03 < 7. or mlpcl.bplus < 250.:
         return 0
     esp = (mlcape / 50.) * ((lr03 - 7.0) / (1.0))
@@ -2301,6 +2576,7 @@ def sherb(prof, **kwargs):
         ebottom : bottom of the effective inflow layer (mb) (optional) 
         etop :top of the effective inflow layer (mb) (optional) 
         mupcl : Most-Unstable Parcel (optional)
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
@@ -2313,53 +2589,32 @@ def sherb(prof, **kwargs):
     effective = kwargs.get('effective', False)
     ebottom = kwargs.get('ebottom', None)
     etop = kwargs.get('etop', None)
+    mupcl = kwargs.get('mupcl', None)
 
-    lr03 = lapse_rate(prof, 0, 3000, pres=False)
-    lr75 = lapse_rate(prof, 700, 500, pres=True)
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
+    overrides = {}
+    if mupcl:
+        overrides['mupcl'] = mupcl
+    if ebottom is not None and etop is not None:
+        overrides['ebottom'], overrides['etop'] = ebottom, etop
+    if len(overrides) > 0:
+        # The supplied ingredients take precedence over the context's (which is left as it is)
+        ctx = ctx.copy(**overrides)
+        if 'ebottom' in overrides:
+            # Use the supplied effective inflow layer instead of the one in the profile
+            ctx.ebwd = ctx._get_ebwd()
+
+    lr03 = ctx.lr03
+    lr75 = ctx.lr75
 
     if effective == False:
-        p3km = interp.pres(prof, interp.to_msl(prof, 3000))
-        sfc_pres = prof.pres[prof.get_sfc()]
-        shear = utils.KTS2MS(utils.mag(*winds.wind_shear(prof, pbot=sfc_pres, ptop=p3km)))
+        shear = utils.KTS2MS(utils.mag(*ctx.sfc_3km_shear))
         sherb = ( shear / 26. ) * ( lr03 / 5.2 ) * ( lr75 / 5.6 )
     else:
-        if hasattr(prof, 'ebwd'):
-            # If the Profile object has the attribute "ebwd"
-            shear = utils.KTS2MS(utils.mag( prof.ebwd[0], prof.ebwd[1] ))
-
-        elif ((not ebottom) or (not etop)) or \
-             ((not hasattr(prof, 'ebottom') or not hasattr(prof, 'etop'))):
-            # if the effective inflow layer hasn't been specified via the function arguments
-            # or doesn't exist in the Profile object we need to calculate it, but we need mupcl
-            if ebottom is None or etop is None:
-                #only calculate ebottom and etop if they're not supplied by the kwargs
-                if not hasattr(prof, 'mupcl') or not kwargs.get('mupcl', None):
-                    # If the mupcl attribute doesn't exist in the Profile
-                    # or the mupcl hasn't been passed as an argument
-                    # compute the mupcl
-                    mulplvals = DefineParcel(prof, flag=3, pres=300)
-                    mupcl = cape(prof, lplvals=mulplvals)
-                else:
-                    mupcl = prof.mupcl
-           
-                # Calculate the effective inflow layer
-                ebottom, etop = effective_inflow_layer( prof, mupcl=mupcl )
-            
-            if ebottom is np.masked or etop is np.masked:
-                # If the inflow layer doesn't exist, return missing
-                return prof.missing
-            else:
-                # Calculate the Effective Bulk Wind Difference
-                ebotm = interp.to_agl(prof, interp.hght(prof, ebottom))
-                depth = ( mupcl.elhght - ebotm ) / 2
-                elh = interp.pres(prof, interp.to_msl(prof, ebotm + depth))
-                ebwd = winds.wind_shear(prof, pbot=ebottom, ptop=elh)
-        else:
-            # If there's no way to compute the effective SHERB
-            # because there's no information about how to get the
-            # inflow layer, return missing.
+        if ctx.ebottom is ma.masked or ctx.etop is ma.masked:
+            # If the inflow layer doesn't exist, return missing
             return prof.missing
-        shear = utils.KTS2MS(utils.mag( prof.ebwd[0], prof.ebwd[1] ))
+        shear = utils.KTS2MS(utils.mag( ctx.ebwd[0], ctx.ebwd[1] ))
         sherb = ( shear / 27. ) * ( lr03 / 5.2 ) * ( lr75 / 5.6 )
 
     return sherb
@@ -2381,6 +2636,7 @@ def mmp(prof, **kwargs):
         ----------
         prof : Profile object
         mupcl : Most-Unstable Parcel object (optional)
+        ctx : IndexContext holding the shared ingredients (optional)
         
         Returns
         -------
@@ -2392,14 +2648,10 @@ def mmp(prof, **kwargs):
         in the lowest 1 km and all the wind vectors in the 6-10 km layer.
         The maximum speed shear from this is the max_bulk_shear value (m/s).
         """
-    
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
     mupcl = kwargs.get('mupcl', None)
     if not mupcl:
-        try:
-            mupcl = prof.mupcl
-        except:
-            mulplvals = DefineParcel(prof, flag=3, pres=300)
-            mupcl = cape(prof, lplvals=mulplvals)
+        mupcl = ctx.mupcl
     mucape = mupcl.bplus
 
     if mucape < 100.:
@@ -2411,6 +2663,7 @@ def mmp(prof, **kwargs):
     if len(lowest_idx) == 0 or len(highest_idx) == 0:
         return ma.masked
     possible_shears = np.empty((len(lowest_idx),len(highest_idx)))
+    possible_shears[:] = np.nan # Pairs that are skipped below must not be included in the maximum
     pbots = interp.pres(prof, prof.hght[lowest_idx])
     ptops = interp.pres(prof, prof.hght[highest_idx])
 
@@ -2420,7 +2673,7 @@ def mmp(prof, **kwargs):
             u_shear, v_shear = winds.wind_shear(prof, pbot=pbots[b], ptop=ptops[t])
             possible_shears[b,t] = utils.mag(u_shear, v_shear)
     max_bulk_shear = utils.KTS2MS(np.nanmax(possible_shears.ravel()))
-    lr38 = lapse_rate(prof, 3000., 8000., pres=False)
+    lr38 = ctx.lr38
     plower = interp.pres(prof, interp.to_msl(prof, 3000.))
     pupper = interp.pres(prof, interp.to_msl(prof, 12000.))
     mean_wind_3t12 = winds.mean_wind( prof, pbot=plower, ptop=pupper)
@@ -2455,22 +2708,19 @@ def wndg(prof, **kwargs):
         ----------
         prof : Profile object
         mlpcl : Mixed-Layer Parcel object (optional) 
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
         wndg : WNDG index
         '''
-    
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
     mlpcl = kwargs.get('mlpcl', None)
     if not mlpcl:
-        try:
-            mlpcl = prof.mlpcl
-        except:
-            mllplvals = DefineParcel(prof, flag=4)
-            mlpcl = cape(prof, lplvals=mllplvals)
+        mlpcl = ctx.mlpcl
     mlcape = mlpcl.bplus
 
-    lr03 = lapse_rate( prof, 0, 3000., pres=False ) # C/km
+    lr03 = ctx.lr03 # C/km
     bot = interp.pres( prof, interp.to_msl( prof, 1000. ) )
     top = interp.pres( prof, interp.to_msl( prof, 3500. ) )
     mean_wind = winds.mean_wind(prof, pbot=bot, ptop=top) # needs to be in m/s
@@ -2498,32 +2748,25 @@ def sig_severe(prof, **kwargs):
         ----------
         prof : Profile object
         mlpcl : Mixed-Layer Parcel object (optional) 
+        sfc6shr : 0-6 km shear (m/s) (optional)
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
         sigsevere : significant severe parameter (m3/s3)
     '''
-     
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
     mlpcl = kwargs.get('mlpcl', None)
     sfc6shr = kwargs.get('sfc6shr', None)
     if not mlpcl:
-        try:
-            mlpcl = prof.mlpcl
-        except:
-            mllplvals = DefineParcel(prof, flag=4)
-            mlpcl = cape(prof, lplvals=mllplvals)
+        mlpcl = ctx.mlpcl
     mlcape = mlpcl.bplus
 
     if not sfc6shr:
-        try:
-            sfc_6km_shear = prof.sfc_6km_shear
-        except:
-            sfc = prof.pres[prof.sfc]
-            p6km = interp.pres(prof, interp.to_msl(prof, 6000.))
-            sfc_6km_shear = winds.wind_shear(prof, pbot=sfc, ptop=p6km)
-
-    sfc_6km_shear = utils.mag(sfc_6km_shear[0], sfc_6km_shear[1])
-    shr06 = utils.KTS2MS(sfc_6km_shear)
+        sfc_6km_shear = utils.mag(ctx.sfc_6km_shear[0], ctx.sfc_6km_shear[1])
+        shr06 = utils.KTS2MS(sfc_6km_shear)
+    else:
+        shr06 = sfc6shr
     
     sigsevere = mlcape * shr06
     return sigsevere
@@ -2696,7 +2939,7 @@ def pbl_top(prof):
 
     return prof.pres[level]
 
-def dcp(prof):
+def dcp(prof, **kwargs):
     '''
         Derecho Composite Parameter (*)
 
@@ -2719,6 +2962,7 @@ def dcp(prof):
         Parameters
         ----------
         prof : Profile object
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
@@ -2726,12 +2970,11 @@ def dcp(prof):
             Derecho Composite Parameter (unitless)
 
     '''
-    sfc = prof.pres[prof.sfc]
-    p6km = interp.pres(prof, interp.to_msl(prof, 6000.))
-    dcape_val = getattr(prof, 'dcape', dcape( prof )[0])
-    mupcl = getattr(prof, 'mupcl', parcelx(prof, flag=1))
-    sfc_6km_shear = getattr(prof, 'sfc_6km_shear', winds.wind_shear(prof, pbot=sfc, ptop=p6km))
-    mean_6km = getattr(prof, 'mean_6km', utils.comp2vec(*winds.mean_wind(prof, pbot=sfc, ptop=p6km)))
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
+    dcape_val = ctx.dcape
+    mupcl = ctx.mupcl
+    sfc_6km_shear = ctx.sfc_6km_shear
+    mean_6km = ctx.mean_6km
     mag_shear = utils.mag(sfc_6km_shear[0], sfc_6km_shear[1])
     mag_mean_wind = mean_6km[1]
 
@@ -2740,7 +2983,7 @@ def dcp(prof):
     return dcp
 
 
-def mburst(prof):
+def mburst(prof, **kwargs):
     '''
         Microburst Composite Index
 
@@ -2763,18 +3006,19 @@ def mburst(prof):
         Parameters
         ----------
         prof : Profile object
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
         mburst : number
             Microburst Composite (unitless)
     '''
-
-    sbpcl = getattr(prof, 'sfcpcl', parcelx(prof, flag=1))
-    lr03 = getattr(prof, 'lapserate_3km', lapse_rate( prof, 0., 3000., pres=False ))
-    vt = getattr(prof, 'vertical_totals', v_totals(prof))
-    dcape_val = getattr(prof, 'dcape', dcape( prof )[0])
-    pwat = getattr(prof, 'pwat', precip_water( prof ))
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
+    sbpcl = ctx.sfcpcl
+    lr03 = ctx.lr03
+    vt = ctx.vertical_totals
+    dcape_val = ctx.dcape
+    pwat = ctx.pwat
     tei_val = thetae_diff(prof)
 
     sfc_thetae = thermo.thetae(sbpcl.lplvals.pres, sbpcl.lplvals.tmpc, sbpcl.lplvals.dwpc)
@@ -2909,7 +3153,7 @@ def ehi(prof, pcl, hbot, htop, stu=0, stv=0):
 
     return ehi
 
-def sweat(prof):
+def sweat(prof, **kwargs):
     '''
         SWEAT Index (*)
 
@@ -2929,17 +3173,18 @@ def sweat(prof):
         Parameters
         ----------
         prof : Profile object
+        ctx : IndexContext holding the shared ingredients (optional)
 
         Returns
         -------
         sweat : number
             SWEAT Index (number)
     '''
-
+    ctx = kwargs.get('ctx', None) or IndexContext(prof)
     td850 = interp.dwpt(prof, 850)
     vec850 = interp.vec(prof, 850)
     vec500 = interp.vec(prof, 500)
-    tt = getattr(prof, 'totals_totals', t_totals( prof ))
+    tt = ctx.totals_totals
 
     if td850 > 0:
         term1 = 12. * td850
@@ -2998,3 +3243,35 @@ def thetae_diff(prof):
         return thetae_diff
 
 
+COMPOSITE_INDICES = [ 'ship', 'sherb', 'mmp', 'wndg', 'sig_severe', 'esp', 'tei', 'dcp', 'mburst', 'sweat' ]
+
+def composite_indices(prof, names=None, ctx=None):
+    '''
+        Composite Indices (*)
+
+        Evaluates several composite indices at once.  The ingredients they share
+        (parcels, lapse rates, shear vectors, PWAT, DCAPE, etc.) are gathered once
+        in an IndexContext, so each index is only a bit of arithmetic on top of it.
+
+        Parameters
+        ----------
+        prof : Profile object
+        names : list of the names of the indices to compute (optional; default is
+                all of the indices in COMPOSITE_INDICES)
+        ctx : IndexContext to use (optional; one is created if not given)
+
+        Returns
+        -------
+        indices : dictionary of index name to index value
+    '''
+    if names is None:
+        names = COMPOSITE_INDICES
+    if ctx is None:
+        ctx = IndexContext(prof)
+
+    indices = {}
+    for name in names:
+        if name not in COMPOSITE_INDICES:
+            raise ValueError("'%s' is not a composite index" % name)
+        indices[name] = globals()[name](prof, ctx=ctx)
+    return indices
@@ -0,0 +1,383 @@
+''' Dense (member x time x level) storage for the profiles in a collection '''
+from __future__ import absolute_import
+
+import weakref
+import threading
+from collections import OrderedDict
+import numpy as np
+import numpy.ma as ma
+import sharppy.sharptab.profile as profile
+import sharppy.sharptab.utils as utils
+from sharppy.sharptab.constants import MISSING
+
+## The columns that can be stored in the arrays
+COLS = [ 'pres', 'hght', 'tmpc', 'dwpc', 'omeg', 'wdir', 'wspd', 'u', 'v' ]
+## The other attributes a raw profile is built from
+META = [ 'location', 'date', 'latitude', 'missing', 'profile' ]
+
+class ProfArray(object):
+    '''
+    Stores the raw data for all the profiles in a collection as one
+    masked array per variable, with dimensions (member, time, level).
+    Profiles with fewer levels than the longest one are padded with
+    masked values at the top.  Profiles are made from the arrays when
+    they're needed, and their columns are views of the arrays, so the
+    data are only stored once.
+
+    Parameters
+    ----------
+    profiles : dictionary
+    The ensemble member names mapped to lists of profiles over time
+    dates : list
+    The datetime objects for the times in the lists of profiles
+
+    '''
+    def __init__(self, profiles, dates):
+        self.members = sorted(profiles.keys())
+        self.dates = list(dates)
+
+        all_profs = [ prof for mem in self.members for prof in profiles[mem] ]
+        self.n_levels = np.array([ [ len(prof.pres) for prof in profiles[mem] ] for mem in self.members ], dtype=int)
+        self.n_levels = self.n_levels.reshape((len(self.members), len(self.dates)))
+        n_lev = self.n_levels.max() if self.n_levels.size > 0 else 0
+        ## the profiles start at the bottom of the arrays
+        self.first_level = np.zeros(self.n_levels.shape, dtype=int)
+
+        ## only store the columns that the profiles have (e.g. just one form of the wind)
+        self.cols = [ col for col in COLS if any( prof.__dict__.get(col, None) is not None for prof in all_profs ) ]
+
+        shape = (len(self.members), len(self.dates), n_lev)
+        self.data = {}
+        ## which profiles had each column
+        self.has_col = {}
+        for col in self.cols:
+            self.data[col] = ma.masked_all(shape, dtype=float)
+            self.has_col[col] = np.zeros(shape[:2], dtype=bool)
+
+        self.meta = []
+        for m, mem in enumerate(self.members):
+            self.meta.append([])
+            for t, prof in enumerate(profiles[mem]):
+                for col in self.cols:
+                    values = prof.__dict__.get(col, None)
+                    if values is not None:
+                        self.data[col][m, t, :len(values)] = values
+                        self.has_col[col][m, t] = True
+                self.meta[m].append(dict( (k, prof.__dict__[k]) for k in META if k in prof.__dict__ ))
+
+    @classmethod
+    def fromData(cls, members, dates, data, has_col, first_level, n_levels, meta):
+        '''
+        Makes a ProfArray straight from the arrays (see the attributes of
+        the same names).
+        '''
+        prof_array = cls.__new__(cls)
+        prof_array.members = list(members)
+        prof_array.dates = list(dates)
+        prof_array.cols = [ col for col in COLS if col in data ]
+        prof_array.data = data
+        prof_array.has_col = has_col
+        prof_array.first_level = first_level
+        prof_array.n_levels = n_levels
+        prof_array.meta = meta
+        return prof_array
+
+    def nbytes(self):
+        '''
+        Returns the number of bytes taken up by the data and masks.
+        '''
+        return sum( arr.data.nbytes + ma.getmaskarray(arr).nbytes for arr in self.data.itervalues() )
+
+    def getProf(self, member, idx):
+        '''
+        Makes a raw profile from the arrays.  The profile's columns are
+        views of the arrays, not copies.
+
+        Parameters
+        ----------
+        member : the name of the ensemble member
+        idx : the time index
+
+        Returns
+        -------
+        A Profile object
+        '''
+        m = self.members.index(member)
+        first = self.first_level[m, idx]
+        levs = slice(first, first + self.n_levels[m, idx])
+        kwargs = dict(self.meta[m][idx])
+        for col in self.cols:
+            if self.has_col[col][m, idx]:
+                kwargs[col] = self.data[col][m, idx, levs]
+        return profile.Profile(**kwargs)
+
+    def regrid(self, levels, coord='pres'):
+        '''
+        Interpolates every profile onto the same vertical levels at once.
+        The same interpolation as sharppy.sharptab.interp is used (linear
+        in log pressure for pressure levels, linear in height for height
+        levels), and the levels a profile doesn't reach are masked.
+
+        Parameters
+        ----------
+        levels : array_like
+        The pressure (hPa) or height (m MSL) levels
+        coord : string (default: 'pres')
+        Either 'pres' or 'hght', for what the levels are
+
+        Returns
+        -------
+        A ProfArray on the new levels (with the winds as u and v)
+        '''
+        if coord not in [ 'pres', 'hght' ]:
+            raise ValueError("Can only regrid to 'pres' or 'hght' levels, not '%s'" % coord)
+
+        levels = np.asarray(levels, dtype=float)
+        shape = self.n_levels.shape
+        n_prof, n_lev = int(np.prod(shape)), self.data['pres'].shape[-1]
+
+        fields = dict( (col, self._missingMasked(col).reshape((n_prof, n_lev))) for col in self.cols
+            if col in [ 'pres', 'hght', 'tmpc', 'dwpc', 'omeg' ] )
+        if 'u' in self.cols and self.has_col['u'].all():
+            fields['u'] = self._missingMasked('u').reshape((n_prof, n_lev))
+            fields['v'] = self._missingMasked('v').reshape((n_prof, n_lev))
+        else:
+            wdir, wspd = self._missingMasked('wdir'), self._missingMasked('wspd')
+            u, v = utils.vec2comp(wdir, wspd)
+            fields['u'] = ma.array(u, mask=ma.getmaskarray(wdir) | ma.getmaskarray(wspd)).reshape((n_prof, n_lev))
+            fields['v'] = ma.array(v, mask=ma.getmaskarray(wdir) | ma.getmaskarray(wspd)).reshape((n_prof, n_lev))
+
+        ## pressure is interpolated in log space, and the interpolation
+        ## coordinate has to go up with height
+        fields['pres'] = ma.log10(fields['pres'])
+        if coord == 'pres':
+            x = -fields['pres']
+            x_new = -np.log10(levels)
+        else:
+            x = fields['hght']
+            x_new = levels
+
+        ## move the levels where the coordinate is missing to the top of each
+        ## profile, so the rest are in order
+        x_valid = ~ma.getmaskarray(x)
+        order = np.argsort(~x_valid, axis=1, kind='mergesort')
+        n_valid = x_valid.sum(axis=1)
+        x = np.take_along_axis(ma.getdata(x), order, axis=1)
+        x_valid = np.take_along_axis(x_valid, order, axis=1)
+
+        ## find the levels on either side of each new level in every profile
+        ## in one search, by offsetting each profile so they're all in order
+        x_min, x_max = x[x_valid].min(), x[x_valid].max()
+        x = np.where(x_valid, x, x_max + 1.)
+        x_new = np.tile(x_new, (n_prof, 1))
+        offset = (x_max - x_min + 2.) * np.arange(n_prof)[:, np.newaxis]
+        above = np.searchsorted((x + offset).ravel(), (x_new + offset).ravel(), side='right').reshape(x_new.shape)
+        above -= n_lev * np.arange(n_prof)[:, np.newaxis]
+        below = np.clip(above - 1, 0, np.maximum(n_valid - 2, 0)[:, np.newaxis])
+        above = below + 1
+
+        x_below = np.take_along_axis(x, below, axis=1)
+        x_above = np.take_along_axis(x, np.minimum(above, n_lev - 1), axis=1)
+        x_top = np.take_along_axis(x, np.maximum(n_valid - 1, 0)[:, np.newaxis], axis=1)
+        in_range = (n_valid[:, np.newaxis] > 1) & (x_new >= x[:, :1]) & (x_new <= x_top)
+        weight = (x_new - x_below) / np.where(x_above == x_below, 1., x_above - x_below)
+
+        data = {}
+        for col, field in fields.iteritems():
+            field_valid = np.take_along_axis(~ma.getmaskarray(field), order, axis=1) & x_valid
+            field = np.take_along_axis(ma.getdata(field), order, axis=1)
+
+            f_below = np.take_along_axis(field, below, axis=1)
+            f_above = np.take_along_axis(field, np.minimum(above, n_lev - 1), axis=1)
+            new = f_below + weight * (f_above - f_below)
+            ok = np.take_along_axis(field_valid, below, axis=1) & \
+                np.take_along_axis(field_valid, np.minimum(above, n_lev - 1), axis=1)
+
+            ## profiles that are missing data next to a new level skip over the
+            ## missing data, like the interp module does
+            mask = ~in_range
+            for prf in np.where((~ok & in_range).any(axis=1))[0]:
+                valid = field_valid[prf]
+                if valid.sum() < 2:
+                    mask[prf] = True
+                    continue
+                xp, fp = x[prf][valid], field[prf][valid]
+                new[prf] = np.interp(x_new[prf], xp, fp)
+                mask[prf] = (x_new[prf] < xp[0]) | (x_new[prf] > xp[-1])
+
+            data[col] = ma.array(new, mask=mask).reshape(shape + (len(levels),))
+
+        data['pres'] = 10 ** data['pres']
+        if coord == 'pres':
+            data['pres'] = ma.array(np.tile(levels, shape + (1,)), mask=ma.getmaskarray(data['pres']))
+        else:
+            data['hght'] = ma.array(np.tile(levels, shape + (1,)), mask=ma.getmaskarray(data['hght']))
+
+        has_col = dict( (col, np.ones(shape, dtype=bool)) for col in data )
+        has_col['omeg'] = self.has_col['omeg'] if 'omeg' in self.has_col else np.zeros(shape, dtype=bool)
+
+        ## the profiles are made from just the levels they reach
+        first_level = np.argmax(in_range, axis=1).reshape(shape)
+        n_levels = in_range.sum(axis=1).reshape(shape)
+        meta = [ [ dict(meta, missing=MISSING) for meta in mem_meta ] for mem_meta in self.meta ]
+        return ProfArray.fromData(self.members, self.dates, data, has_col, first_level, n_levels, meta)
+
+    def _missingMasked(self, col):
+        # The raw data can have missing values that aren't masked yet
+        data = self.data[col]
+        missing = np.array([ [ meta.get('missing', MISSING) for meta in mem_meta ] for mem_meta in self.meta ])
+        return ma.masked_where(ma.getdata(data) == missing[:, :, np.newaxis], data)
+
+class MemberProfs(object):
+    '''
+    The profiles for one ensemble member over time, which can be used
+    like a list.  Profiles that haven't been replaced (e.g. by
+    converted or modified profiles) are made from the ProfArray when
+    they're asked for, and they're only kept around for as long as
+    something else is using them.
+
+    Parameters
+    ----------
+    prof_array : the ProfArray with the data
+    member : the name of the ensemble member
+
+    '''
+    def __init__(self, prof_array, member):
+        self._array = prof_array
+        self._member = member
+        self._profs = {}
+        self._views = weakref.WeakValueDictionary()
+        self._length = len(prof_array.dates)
+
+    def __len__(self):
+        return self._length
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_views']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views = weakref.WeakValueDictionary()
+
+    def _index(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError("profile index out of range")
+        return idx
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [ self[i] for i in xrange(*idx.indices(len(self))) ]
+
+        idx = self._index(idx)
+        if idx in self._profs:
+            return self._profs[idx]
+
+        prof = self._views.get(idx, None)
+        if prof is None:
+            prof = self._makeProf(idx)
+            self._views[idx] = prof
+        return prof
+
+    def _makeProf(self, idx):
+        return self._array.getProf(self._member, idx)
+
+    def getStored(self, idx):
+        '''
+        Returns the profile that was put in the list at an index (e.g. a
+        converted profile), or None if the profile at that index would
+        have to be made (or decoded).
+        '''
+        return self._profs.get(self._index(idx), None)
+
+    def __setitem__(self, idx, prof):
+        self._profs[self._index(idx)] = prof
+
+    def __iter__(self):
+        for idx in xrange(len(self)):
+            yield self[idx]
+
+    def append(self, prof):
+        '''
+        Adds a profile for a new time.  It isn't put in the ProfArray.
+        '''
+        self._profs[self._length] = prof
+        self._length += 1
+
+class LazyProfs(MemberProfs):
+    '''
+    The profiles for one ensemble member over time, which are only
+    decoded when they're first asked for.  The most recently used
+    profiles are kept in a ProfCache (which can be shared by all the
+    members of a collection), and the rest are decoded again if
+    they're needed after they've been dropped.  As with MemberProfs,
+    a profile that's still being used somewhere else is always the
+    same object.
+
+    Parameters
+    ----------
+    loader : a function that takes the member name and the time index
+    and returns the profile
+    member : the name of the ensemble member
+    length : the number of times
+    cache : the ProfCache to keep the decoded profiles in
+
+    '''
+    def __init__(self, loader, member, length, cache):
+        self._loader = loader
+        self._member = member
+        self._cache = cache
+        self._profs = {}
+        self._views = weakref.WeakValueDictionary()
+        self._length = length
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [ self[i] for i in xrange(*idx.indices(len(self))) ]
+
+        ## the collection's background thread and the GUI can ask for the
+        ## same profile at the same time
+        with self._cache.lock:
+            prof = super(LazyProfs, self).__getitem__(idx)
+            if self._index(idx) not in self._profs:
+                self._cache.add((self._member, self._index(idx)), prof)
+        return prof
+
+    def _makeProf(self, idx):
+        return self._loader(self._member, idx)
+
+    def __reduce__(self):
+        # The loader usually can't be pickled, so the profiles get decoded and pickled as a plain list.
+        return (list, (list(self),))
+
+class ProfCache(object):
+    '''
+    Keeps references to the most recently used profiles, so they
+    don't have to be decoded again.
+
+    Parameters
+    ----------
+    size : the number of profiles to keep
+
+    '''
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.RLock()
+        self._profs = OrderedDict()
+
+    def __len__(self):
+        return len(self._profs)
+
+    def add(self, key, prof):
+        '''
+        Marks a profile as the most recently used one, dropping the
+        least recently used profile if the cache is full.
+        '''
+        with self.lock:
+            self._profs.pop(key, None)
+            self._profs[key] = prof
+            while len(self._profs) > self.size:
+                self._profs.popitem(last=False)
@@ -0,0 +1,192 @@
+''' Shared-memory transport of profile columns to and from worker processes '''
+from __future__ import absolute_import
+
+import os
+import atexit
+import tempfile
+import numpy as np
+import numpy.ma as ma
+
+## The columns that a profile is built from
+IN_COLS = [ 'pres', 'hght', 'tmpc', 'dwpc', 'omeg', 'wdir', 'wspd', 'u', 'v' ]
+## The columns that come back from a converted profile
+OUT_COLS = IN_COLS + [ 'logp', 'vtmp', 'wetbulb', 'thetae' ]
+## The other attributes a profile is built from (the same ones Profile.copy() passes, so a profile converts the same way
+## whether or not it goes through a block)
+META = [ 'location', 'date', 'latitude' ]
+## The files behind the blocks that haven't been closed yet, which are deleted when the program exits
+_open_files = set()
+
+def profBytes(prof):
+    '''
+    Returns the number of bytes a profile takes up in a ProfBlock.
+    '''
+    n_cols = len([ col for col in IN_COLS if prof.__dict__.get(col, None) is not None ]) + len(OUT_COLS)
+    return 9 * len(prof.pres) * n_cols
+
+class ProfBlock(object):
+    '''
+    A block of shared memory (a memory-mapped temporary file) holding
+    the columns of every profile in a collection.  Worker processes
+    map the same file, so a profile can be sent to a worker as a
+    SharedProf, which only holds the file name and where its columns
+    are in the file.  The worker reads the input columns without
+    copying them and writes the columns of the converted profile back
+    into the block.  Everything else in the converted profile (the
+    parcels with their traces and the scalar indices) is still pickled
+    on the way back, and for a ConvectiveProfile that's most of it: the
+    columns are only about 40% of a whole pickled profile.
+
+    Parameters
+    ----------
+    profs : dictionary
+    The profiles to put in the block, keyed by anything picklable
+
+    '''
+    def __init__(self, profs):
+        self.layout = {}
+        size = 0
+        for key, prof in profs.iteritems():
+            length = len(prof.pres)
+            in_cols = [ col for col in IN_COLS if prof.__dict__.get(col, None) is not None ]
+            self.layout[key] = (size, length, in_cols)
+            size += length * (len(in_cols) + len(OUT_COLS))
+
+        self.size = size
+        fd, self.filename = tempfile.mkstemp(prefix='sharppy_', suffix='.blk')
+        _open_files.add(self.filename)
+        blk_file = os.fdopen(fd, 'wb')
+        blk_file.truncate(9 * max(size, 1))
+        blk_file.close()
+
+        data, mask = _map(self.filename, self.size, 'r+')
+        for key, prof in profs.iteritems():
+            offset, length, in_cols = self.layout[key]
+            for col in in_cols:
+                values = prof.__dict__[col]
+                data[offset:offset + length] = ma.getdata(values)
+                mask[offset:offset + length] = ma.getmaskarray(values)
+                offset += length
+        data.flush()
+        mask.flush()
+        del data, mask
+
+    def __contains__(self, key):
+        return key in self.layout
+
+    def getProf(self, key, prof):
+        '''
+        Returns a SharedProf to send to a worker in place of a profile.
+
+        Parameters
+        ----------
+        key : the key the profile was stored under
+        prof : the profile itself (for the location, date, etc.)
+
+        Returns
+        -------
+        A SharedProf object
+        '''
+        meta = dict( (k, prof.__dict__[k]) for k in META if k in prof.__dict__ )
+        return SharedProf(self.filename, self.size, self.layout[key], meta)
+
+    def close(self):
+        '''
+        Deletes the file behind the block.  Workers still using it keep
+        their mappings (except on Windows, where the delete fails and
+        the file is left until the program exits).
+        '''
+        try:
+            os.remove(self.filename)
+        except OSError:
+            return
+        _open_files.discard(self.filename)
+
+class SharedProf(object):
+    '''
+    Stands in for a profile in a ProfBlock when it's sent to a worker
+    process.  Pickling it only pickles the file name, the position of
+    the profile's columns, and the profile's metadata.
+    '''
+    def __init__(self, filename, size, layout, meta):
+        self.filename = filename
+        self.size = size
+        self.offset, self.length, self.in_cols = layout
+        self.meta = meta
+
+    def _slice(self, idx):
+        start = self.offset + idx * self.length
+        return slice(start, start + self.length)
+
+    def read(self):
+        '''
+        Returns the keyword arguments for building the profile.  The
+        columns are read-only views of the shared memory.
+        '''
+        data, mask = _map(self.filename, self.size, 'r')
+        kwargs = dict(self.meta)
+        for idx, col in enumerate(self.in_cols):
+            sl = self._slice(idx)
+            kwargs[col] = ma.array(np.asarray(data[sl]), mask=np.asarray(mask[sl]), copy=False)
+        return kwargs
+
+    def write(self, prof):
+        '''
+        Writes the columns of a converted profile into the shared memory
+        and takes them out of the profile, so they don't get pickled.
+        Returns a dictionary of the fill values and data types needed to
+        put them back.
+        '''
+        data, mask = _map(self.filename, self.size, 'r+')
+        col_info = {}
+        for idx, col in enumerate(OUT_COLS):
+            values = prof.__dict__.get(col, None)
+            if not isinstance(values, np.ndarray) or values.shape != (self.length,):
+                continue
+
+            sl = self._slice(len(self.in_cols) + idx)
+            data[sl] = ma.getdata(values)
+            mask[sl] = ma.getmaskarray(values)
+            col_info[col] = (values.dtype, ma.getmask(values) is ma.nomask, getattr(values, 'fill_value', None))
+            del prof.__dict__[col]
+
+        data.flush()
+        mask.flush()
+        return col_info
+
+    def restore(self, prof, col_info):
+        '''
+        Puts the columns that were written by write() back into the
+        converted profile.  The columns are copied out of the shared
+        memory, so the block can be deleted afterwards.
+        '''
+        data, mask = _map(self.filename, self.size, 'r')
+        for idx, col in enumerate(OUT_COLS):
+            if col not in col_info:
+                continue
+
+            dtype, no_mask, fill_value = col_info[col]
+            sl = self._slice(len(self.in_cols) + idx)
+            values = ma.array(np.array(data[sl], dtype=dtype), mask=ma.nomask if no_mask else np.array(mask[sl]))
+            if fill_value is not None:
+                values.set_fill_value(fill_value)
+            prof.__dict__[col] = values
+        return prof
+
+def _removeFiles():
+    # Deletes the files behind any blocks that are still around (e.g. a conversion that raised or was still running),
+    #   so they don't pile up in the temporary directory.
+    for filename in list(_open_files):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    _open_files.clear()
+
+atexit.register(_removeFiles)
+
+def _map(filename, size, mode):
+    # The data are stored first, followed by the masks
+    data = np.memmap(filename, dtype=np.float64, mode=mode, shape=(max(size, 1),))
+    mask = np.memmap(filename, dtype=np.bool_, mode=mode, shape=(max(size, 1),), offset=8 * max(size, 1))
+    return data, mask
@@ -3,18 +3,104 @@ from __future__ import absolute_import
 
 import sharppy.sharptab.profile as profile
 import sharppy.sharptab.interp as interp
-from utils.frozenutils import Process, Queue
-import platform
+import sharppy.sharptab.utils as utils
+import sharppy.sharptab.ensemble as ensemble
+from sharppy.sharptab.prof_block import ProfBlock, SharedProf, profBytes
+from sharppy.sharptab.prof_array import ProfArray, MemberProfs
+from utils.frozenutils import Pool, cpu_count
+import threading
+import Queue
+import time
 import numpy as np
+from datetime import datetime
+import numpy.ma as ma
+
+WIND_VARS = [ 'u', 'v', 'wdir', 'wspd' ]
+# How long the background conversion waits for a profile before checking whether it's been cancelled or a profile failed
+#   without calling back (seconds)
+POLL_TIME = 0.1
+# How long a conversion that's being waited on goes without getting a profile back before giving up on the worker pool
+#   (e.g. because a worker was killed and its profile is never coming back) (seconds)
+CONVERT_TIMEOUT = 60.
+
+def modVars(mods):
+    """
+    Returns the set of variables touched by a list of (idx, kwargs) modifications. The wind components and the wind
+        direction and speed are always modified together.
+    """
+    mod_vars = set( k for idx, kwargs in mods for k in kwargs.iterkeys() )
+    if any(k in mod_vars for k in WIND_VARS):
+        mod_vars.update(WIND_VARS)
+    return mod_vars
+
+_copy_pool = None
+_copy_pool_lock = threading.Lock()
+
+def getCopyPool():
+    """
+    Returns the pool of worker processes used to convert profiles in the background. The pool is started the first time
+        it's needed (with one worker per core) and shared by all the collections after that.
+    """
+    global _copy_pool
+    with _copy_pool_lock:
+        if _copy_pool is None:
+            _copy_pool = Pool(cpu_count())
+    return _copy_pool
+
+def doCopy(target_type, prof, key):
+    try:
+        if isinstance(prof, SharedProf):
+            # Build the profile straight from the shared memory, and send the columns back the same way.
+            new_prof = target_type(**prof.read())
+            col_info = prof.write(new_prof)
+            return (new_prof, col_info), key
+        return target_type.copy(prof), key
+    except Exception as e:
+        # Send the error back instead of raising it in the worker, so the results don't stop coming.
+        return e, key
+
+def timeInterp(prof1, prof2, weight, date):
+    """
+    Interpolates linearly in time between two profiles. Profiles with the same number of levels (e.g. from the same model)
+        are interpolated level by level, with the pressure interpolated in log space. Otherwise, prof2 is interpolated
+        to the pressure levels of prof1 first. The winds are interpolated as components.
+    prof1:  The profile at the earlier time
+    prof2:  The profile at the later time
+    weight: How far the time is from prof1 to prof2 (0 is prof1 and 1 is prof2)
+    date:   The datetime object for the new profile
+    Returns a raw profile (profile.Profile).
+    """
+    def columns(prof):
+        cols = {}
+        for col in [ 'pres', 'hght', 'tmpc', 'dwpc', 'omeg' ]:
+            if prof.__dict__.get(col, None) is not None:
+                cols[col] = ma.masked_where(ma.getdata(prof.__dict__[col]) == prof.missing, prof.__dict__[col])
+        if prof.u is not None:
+            cols['u'], cols['v'] = [ ma.masked_where(ma.getdata(c) == prof.missing, c) for c in [ prof.u, prof.v ] ]
+        else:
+            wdir, wspd = [ ma.masked_where(ma.getdata(c) == prof.missing, c) for c in [ prof.wdir, prof.wspd ] ]
+            cols['u'], cols['v'] = utils.vec2comp(wdir, wspd)
+        cols['pres'] = ma.log10(cols['pres'])
+        return cols
+
+    cols1, cols2 = columns(prof1), columns(prof2)
+    if len(cols1['pres']) != len(cols2['pres']):
+        logp1, logp2 = ma.getdata(cols1['pres']), cols2['pres'][::-1]
+        cols2 = dict( (col, interp.generic_interp_pres(logp1, logp2, vals[::-1])) for col, vals in cols2.iteritems() )
+
+    kwargs = dict( (col, (1 - weight) * cols1[col] + weight * cols2[col]) for col in cols1 if col in cols2 )
+    kwargs['pres'] = 10 ** kwargs['pres']
+    return profile.Profile(location=prof1.location, date=date, latitude=prof1.latitude, missing=prof1.missing, **kwargs)
 
-def doCopy(target_type, prof, idx, pipe):
-    pipe.put((target_type.copy(prof), idx))
-    
 class ProfCollection(object):
     """
     ProfCollection: A class to keep track of profiles from a single data source. Handles time switching, ensemble member switching,
         and modifications to profiles.
     """
+
+    # How many times ahead of the current time (in the direction time was last advanced) get converted before the other
+    #   ensemble members at the current time.
+    copy_lookahead = 3
     def __init__(self, profiles, dates, target_type=profile.ConvectiveProfile, **kwargs):
         """
         Initialize the collection.
@@ -36,11 +122,42 @@ class ProfCollection(object):
         self._mod_wind = [ False for d in self._dates ]
         self._interp = [ False for d in self._dates ]
 
+        # Modifications are stored as sparse diffs: {time index: {variable: {level: original value}}}. The originals are
+        #   relative to the interpolated profile if there is one.
+        self._mod_diffs = {}
+        # The profiles from before interpolation, along with any modification diffs they had.
         self._orig_profs = {}
-        self._interp_profs = {}
         self._async = None
-        self._cancel_copy = False
-        self._procs = []
+        # Bumped every time the background conversion is cancelled, so a conversion that's still winding down knows to stop
+        self._copy_gen = 0
+        self._copying = False
+        self._copy_queue = []
+        self._copy_lock = threading.Lock()
+        self._direction = 1
+        self._copy_all = False
+        self._max_pending = None
+        self._max_block_size = None
+        self._progress = None
+        # BasicProfiles made for drawing the other ensemble members, until the background conversion replaces them.
+        self._basic_profs = {}
+        self._array = None
+        # Index values over the members and times: {index name: (values, the profiles they came from)}
+        self._index_cache = {}
+        self._stats_cache = {}
+        # Profiles interpolated in time: {(member, date): (profile before, profile after, interpolated profile)}
+        self._time_cache = {}
+
+    def __getstate__(self):
+        # The lock and the background conversion stay with this process (e.g. when a collection is decoded in a worker
+        #   process and sent back).
+        state = dict(self.__dict__)
+        del state['_copy_lock']
+        state.update(_async=None, _copying=False, _copy_queue=[])
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._copy_lock = threading.Lock()
 
     def subset(self, idxs):
         """
@@ -51,27 +168,462 @@ class ProfCollection(object):
         dates = [ self._dates[idx] for idx in idxs ]
         return ProfCollection(profiles, dates, highlight=self._highlight, **self._meta)
 
-    def _backgroundCopy(self, member, max_procs=2):
-        pipe = Queue(max_procs)
+    def pack(self):
+        """
+        Store the data for all the profiles in dense (member, time, level) arrays (see ProfArray). The raw profiles are
+            made from the arrays when they're needed. Profiles that have already been converted or modified are kept
+            as they are; the arrays have their data, too.
+        """
+        self._array = ProfArray(self._profs, self._dates)
+        profs = {}
+        for mem, mem_profs in self._profs.iteritems():
+            profs[mem] = MemberProfs(self._array, mem)
+            for idx, prof in enumerate(mem_profs):
+                if type(prof) != profile.Profile:
+                    profs[mem][idx] = prof
+        self._profs = profs
+
+    @classmethod
+    def fromArray(cls, prof_array, target_type=profile.ConvectiveProfile, **kwargs):
+        """
+        Make a collection from profiles that are already in dense arrays (see ProfArray).
+        prof_array: The ProfArray with the profiles.
+        target_type, **kwargs: The same as for the constructor.
+        """
+        profs = dict( (mem, MemberProfs(prof_array, mem)) for mem in prof_array.members )
+        prof_coll = cls(profs, prof_array.dates, target_type=target_type, **kwargs)
+        prof_coll._array = prof_array
+        return prof_coll
+
+    def regrid(self, levels, coord='pres'):
+        """
+        Returns a new collection with every ensemble member at every time interpolated onto the same vertical levels
+            (see ProfArray.regrid). The new collection is stored in dense arrays. Any modifications or interpolation
+            are included.
+        levels: The pressure (hPa) or height (m MSL) levels.
+        coord [optional]:   Either 'pres' or 'hght', for what the levels are. Default is 'pres'.
+        """
+        prof_coll = ProfCollection.fromArray(self.toArray().regrid(levels, coord=coord), target_type=self._target_type,
+            **self._meta)
+        prof_coll._highlight = self._highlight
+        prof_coll._prof_idx = self._prof_idx
+        return prof_coll
+
+    def getArray(self):
+        """
+        Returns the ProfArray with the data for all the profiles, or None if the collection hasn't been packed. The
+            arrays have the data the collection was packed with; modifications and interpolation aren't included.
+        """
+        return self._array
+
+    def toArray(self):
+        """
+        Returns a ProfArray with the data for all the profiles as they are now, including modifications and
+            interpolation.
+        """
+        if self._array is not None and not any(self._mod_therm + self._mod_wind + self._interp):
+            return self._array
+        return ProfArray(self._profs, self._dates)
+
+    def _convert(self, keys):
+        """
+        Convert the profiles for a list of (member, time index) pairs to the target type in the worker pool, and wait for
+            them to finish. Profiles that fail to convert are left as they are.
+        """
+        orig_profs = dict( (key, self._profs[key[0]][key[1]]) for key in keys )
+        orig_profs = dict( (key, prof) for key, prof in orig_profs.iteritems() if type(prof) != self._target_type )
+        for key, prof in self._convertProfs(orig_profs).iteritems():
+            self._storeCopy(orig_profs[key], None, prof, key)
+
+    def _convertProfs(self, orig_profs):
+        """
+        Convert a dictionary of profiles to the target type in the worker pool, and wait for them to finish. Returns a
+            dictionary with the same keys of the converted profiles (or the exceptions for the ones that failed). Raises a
+            RuntimeError if no profiles come back from the pool for CONVERT_TIMEOUT seconds.
+        """
+        if len(orig_profs) == 0:
+            return {}
+
+        pool = getCopyPool()
+        block = ProfBlock(orig_profs)
+        done = Queue.Queue()
+        converted = {}
+        try:
+            pending = [ (key, pool.apply_async(doCopy, (self._target_type, block.getProf(key, prof), key),
+                callback=lambda ret_val: done.put(None))) for key, prof in orig_profs.iteritems() ]
+            last_done = time.time()
+            while len(pending) > 0:
+                # Poll for the results the same way as the background conversion, so a profile that's never coming
+                #   back raises an error instead of hanging the caller (which may be the GUI).
+                ready = [ item for item in pending if item[1].ready() ]
+                if len(ready) == 0:
+                    if time.time() - last_done > CONVERT_TIMEOUT:
+                        raise RuntimeError("Lost %d profile(s) in the worker pool while converting them" % len(pending))
+                    try:
+                        done.get(timeout=POLL_TIME)
+                    except Queue.Empty:
+                        pass
+                    continue
+
+                last_done = time.time()
+                for key, result in ready:
+                    pending.remove((key, result))
+                    try:
+                        prof = result.get()[0]
+                    except Exception as e:
+                        prof = e
+                    if type(prof) == tuple:
+                        prof, col_info = prof
+                        prof = block.getProf(key, orig_profs[key]).restore(prof, col_info)
+                    converted[key] = prof
+        finally:
+            block.close()
+        return converted
+
+    def atTime(self, dts, member=None):
+        """
+        Returns the profile at a time between the times in the collection, interpolated linearly in time from the
+            profiles on either side (see timeInterp()). The profiles at the times in the collection are returned as they
+            are. Interpolated profiles are only made when they're asked for, and they're cached until the profiles on
+            either side change.
+        dts:    A datetime object, or a list of them. The interpolated profiles for a list are converted to the target type
+            together in the worker pool.
+        member [optional]:  The ensemble member. Default is the highlighted member.
+        Returns a profile of the target type, or a list of them for a list of times.
+        """
+        single = isinstance(dts, datetime)
+        if single:
+            dts = [ dts ]
+        if member is None:
+            member = self._highlight
+
+        profs = {}
+        new_profs = {}
+        bounds = {}
+        for dt in dts:
+            if dt in self._dates:
+                idx = self._dates.index(dt)
+                self._convert([ (member, idx) ])
+                profs[dt] = self._profs[member][idx]
+                continue
+
+            if dt < min(self._dates) or dt > max(self._dates):
+                raise ValueError("%s is outside the times in the collection" % dt)
+
+            idx = np.searchsorted(self._dates, dt)
+            prof1, prof2 = self._profs[member][idx - 1], self._profs[member][idx]
+            cached = self._time_cache.get((member, dt), None)
+            if cached is not None and cached[0] is prof1 and cached[1] is prof2:
+                profs[dt] = cached[2]
+                continue
+
+            weight = (dt - self._dates[idx - 1]).total_seconds() / (self._dates[idx] - self._dates[idx - 1]).total_seconds()
+            new_profs[dt] = timeInterp(prof1, prof2, weight, dt)
+            bounds[dt] = (prof1, prof2)
+
+        for dt, prof in self._convertProfs(new_profs).iteritems():
+            if isinstance(prof, Exception):
+                raise prof
+            self._time_cache[(member, dt)] = bounds[dt] + (prof,)
+            profs[dt] = prof
+
+        if single:
+            return profs[dts[0]]
+        return [ profs[dt] for dt in dts ]
+
+    def _indexValues(self, name, member):
+        """
+        Returns the values of an index for one ensemble member at every time, as a masked array. The values are cached,
+            and only the ones for profiles that have changed (or times that have been added) since the last call are
+            computed. Profiles that haven't been converted to the target type give masked values.
+        """
+        vals, val_profs = self._index_cache.setdefault(name, {}).get(member, ([], []))
+        n_new = len(self._dates) - len(vals)
+        vals.extend([ ma.masked ] * n_new)
+        val_profs.extend([ None ] * n_new)
+
+        changed = n_new > 0
+        for idx in xrange(len(self._dates)):
+            prof = self._profs[member][idx]
+            if prof is val_profs[idx]:
+                continue
+
+            if type(prof) == self._target_type:
+                vals[idx] = ensemble.get_index(prof, name)
+            else:
+                vals[idx] = ma.masked
+            val_profs[idx] = prof
+            changed = True
+
+        self._index_cache[name][member] = (vals, val_profs)
+        if changed:
+            for key in [ key for key in self._stats_cache if key[0] == name ]:
+                del self._stats_cache[key]
+        return ma.array(vals, dtype=float)
+
+    def getIndexArray(self, name):
+        """
+        Returns the values of an index for every ensemble member at every time, as a masked array with dimensions
+            (member, time). The members are in alphabetical order. Any profiles that haven't been converted to the target
+            type yet are converted in the worker pool. The values are cached, and only the ones for profiles that have
+            changed since the last call are recomputed.
+        name:   The name of the index (see sharppy.sharptab.ensemble.INDICES)
+        """
+        if name not in ensemble.INDICES:
+            raise ValueError("Unknown index '%s'" % name)
+
+        members = sorted(self._profs.keys())
+        self._convert([ (mem, idx) for mem in members for idx in xrange(len(self._dates)) ])
+        vals = ma.masked_all((len(members), len(self._dates)))
+        for mdx, mem in enumerate(members):
+            vals[mdx] = self._indexValues(name, mem)
+        return vals
+
+    def getIndexSeries(self, names, member=None):
+        """
+        Returns time series of indices for one ensemble member. Any profiles that haven't been converted to the target
+            type yet are converted in the worker pool. The values are cached, so after the first call, only the times
+            that have been added or changed are computed.
+        names:  A list of index names (see sharppy.sharptab.ensemble.INDICES)
+        member [optional]:  The ensemble member. Default is the highlighted member.
+        Returns the list of dates and a dictionary of index names to masked arrays of the values at those dates.
+        """
+        for name in names:
+            if name not in ensemble.INDICES:
+                raise ValueError("Unknown index '%s'" % name)
+
+        if member is None:
+            member = self._highlight
+
+        self._convert([ (member, idx) for idx in xrange(len(self._dates)) ])
+        series = dict( (name, self._indexValues(name, member)) for name in names )
+        return list(self._dates), series
+
+    def addTimes(self, profiles, dates):
+        """
+        Add times to the end of the collection (e.g. when more forecast hours come in).
+        profiles:   A dictionary of lists of profiles, with the same ensemble members as the collection.
+        dates:      A list of datetime objects for the new times.
+        """
+        for mem, mem_profs in self._profs.iteritems():
+            for prof in profiles[mem]:
+                mem_profs.append(prof)
+
+        self._dates = self._dates + list(dates)
+        self._mod_therm.extend( False for d in dates )
+        self._mod_wind.extend( False for d in dates )
+        self._interp.extend( False for d in dates )
+        self._reprioritize()
+
+    def getEnsembleStats(self, name, percentiles=(10, 25, 50, 75, 90), thresholds=()):
+        """
+        Returns the distribution of an index across the ensemble members at each time (see
+            sharppy.sharptab.ensemble.ens_stats). The results are cached until a profile changes.
+        name:   The name of the index (see sharppy.sharptab.ensemble.INDICES)
+        percentiles [optional]: The percentiles to compute.
+        thresholds [optional]:  The thresholds to compute the probabilities of exceeding.
+        """
+        vals = self.getIndexArray(name)
+        key = (name, tuple(percentiles), tuple(thresholds))
+        if key not in self._stats_cache:
+            self._stats_cache[key] = ensemble.ens_stats(vals, percentiles=percentiles, thresholds=thresholds)
+        return self._stats_cache[key]
+
+    def _backgroundCopy(self, gen):
+        """
+        Convert profiles to the target type in the worker pool, in the order given by _copyOrder(). Profiles are handed
+            to the pool a few at a time, so changes in the current time or highlighted member take effect quickly, and
+            they're stored as they're finished. cancelCopy() stops the conversion without having to wait on (or kill)
+            the rest.
+        gen:    The value of _copy_gen when the conversion was started. The conversion stops when it changes.
+        """
+        pool = getCopyPool()
+        max_pending = self._max_pending or 2 * cpu_count()
+        done = Queue.Queue()
+        # The profiles out in the pool: [ (key, AsyncResult) ]
+        pending = []
+        sent = {}
+        # The shared memory blocks the profiles are sent in, and how many of each block's profiles are still out
+        blocks = {}
+        last_block = None
+
+        # How many profiles have been converted, for the progress function
+        n_done = [ sum( self._isConverted(mem, idx) for mem, profs in self._profs.iteritems()
+            for idx in xrange(len(profs)) ) ]
+        n_total = sum( len(profs) for profs in self._profs.itervalues() )
+
+        def cancelled():
+            return self._copy_gen != gen
+
+        def receive():
+            # Wait for one of the profiles to come back. A profile that fails without calling back (e.g. it can't be
+            #   sent back from the worker) shows up as ready, and a profile that never comes back (e.g. the worker was
+            #   killed) doesn't hold anything up once the conversion is cancelled.
+            while not any( result.ready() for key, result in pending ):
+                if cancelled():
+                    return
+                try:
+                    done.get(timeout=POLL_TIME)
+                except Queue.Empty:
+                    pass
+
+            key, result = next( item for item in pending if item[1].ready() )
+            pending.remove((key, result))
+            try:
+                prof = result.get()[0]
+            except Exception as e:
+                prof = e
+            if cancelled():
+                return
+
+            orig_prof, send_prof, block = sent[key]
+            if self._storeCopy(orig_prof, send_prof, prof, key):
+                n_done[0] = min(n_done[0] + 1, n_total)
+                if self._progress is not None:
+                    self._progress(n_done[0], n_total)
+
+            blocks[block] -= 1
+            if blocks[block] == 0 and block is not last_block:
+                block.close()
+                del blocks[block]
+
+        try:
+            while not cancelled():
+                key = self._nextCopy(sent, gen)
+                if key is None:
+                    break
+
+                # Put the columns in shared memory, so they don't have to be pickled to get them to the workers. The
+                #   profiles after this one in the queue go in the same block, up to the block size limit.
+                block = next(( blk for blk in blocks if key in blk ), None)
+                if block is None:
+                    block = last_block = self._makeCopyBlock(key)
+                    blocks[block] = 0
+
+                member, idx = key
+                orig_prof = self._profs[member][idx]
+                send_prof = block.getProf(key, orig_prof)
+                sent[key] = (orig_prof, send_prof, block)
+                blocks[block] += 1
 
-        for idx, prof in enumerate(self._profs[member]):
-            proc = Process(target=doCopy, args=(self._target_type, prof, idx, pipe))
-            proc.start()
+                result = pool.apply_async(doCopy, (self._target_type, send_prof, key),
+                    callback=lambda ret_val: done.put(None))
+                pending.append((key, result))
 
-            self._procs.append(proc)
-            
-            if (idx % max_procs) == 0 or idx == len(self._profs[member]) - 1:
-                for proc in self._procs:
+                if len(pending) >= max_pending:
+                    receive()
 
-                    if platform.system() != "Windows":
-                        # Windows hangs here for some reason, but runs fine without it.
-                        proc.join()
-                        
-                    prof, copy_idx  = pipe.get()
-                    self._profs[member][copy_idx] = prof
-                    
-                self._procs = []
-        return
+            while len(pending) > 0 and not cancelled():
+                receive()
+        finally:
+            # The blocks are deleted even if the conversion raised
+            for block in blocks:
+                block.close()
+
+    def _makeCopyBlock(self, key):
+        # Makes a shared memory block holding the profile for key and the ones after it in the queue, keeping the
+        #   block under the size limit (it always holds at least the profile for key).
+        with self._copy_lock:
+            keys = [ key ] + [ k for k in self._copy_queue if k != key ]
+
+        profs = {}
+        size = 0
+        for member, idx in keys:
+            if self._isConverted(member, idx):
+                continue
+
+            prof = self._profs[member][idx]
+            size += profBytes(prof)
+            if self._max_block_size is not None and size > self._max_block_size and len(profs) > 0:
+                break
+            profs[(member, idx)] = prof
+        return ProfBlock(profs)
+
+    def _nextCopy(self, sent, gen):
+        # Returns the next profile to convert, or None if there's nothing left (in which case the background conversion
+        #   is finished, and _reprioritize() will start a new one if more work shows up) or the conversion was cancelled.
+        with self._copy_lock:
+            if self._copy_gen != gen:
+                return None
+
+            while len(self._copy_queue) > 0:
+                member, idx = self._copy_queue.pop(0)
+                if (member, idx) not in sent and not self._isConverted(member, idx):
+                    return member, idx
+
+            self._copying = False
+        return None
+
+    def _storeCopy(self, orig_prof, send_prof, prof, key):
+        # Don't replace the profile if it failed to convert (it'll be tried again when it's needed), or if it's been
+        #   converted or modified since it was sent off.
+        member, idx = key
+        if isinstance(prof, Exception) or self._profs[member][idx] is not orig_prof:
+            return False
+
+        if type(prof) == tuple:
+            # The columns came back through the shared memory
+            prof, col_info = prof
+            prof = send_prof.restore(prof, col_info)
+        self._profs[member][idx] = prof
+        self._basic_profs.pop(key, None)
+        return True
+
+    def _copyOrder(self):
+        """
+        Returns the (member, time index) pairs that still need to be converted to the target type, most important first:
+            the highlighted profile, the next few times in the direction time was last advanced (and the time before),
+            the other members at the current time, and then the rest of the highlighted member's times, nearest first.
+        """
+        n_times = len(self._dates)
+        cur_idx = max(self._prof_idx, 0)
+
+        def steps(idx):
+            # How far idx is from the current time, counting steps against the direction of travel double.
+            fwd = ((idx - cur_idx) * self._direction) % n_times
+            return min(fwd, 2 * (n_times - fwd))
+
+        times = sorted(range(n_times), key=steps)
+        near = [ idx for idx in times if steps(idx) <= self.copy_lookahead ]
+        far = [ idx for idx in times if steps(idx) > self.copy_lookahead ]
+
+        order = [ (self._highlight, idx) for idx in near ]
+        if self.hasCurrentProf():
+            order.extend( (mem, cur_idx) for mem in sorted(self._profs.keys()) if mem != self._highlight )
+        order.extend( (self._highlight, idx) for idx in far )
+        if self._copy_all:
+            order.extend( (mem, idx) for idx in times for mem in sorted(self._profs.keys())
+                if mem != self._highlight and idx != cur_idx )
+
+        return [ (mem, idx) for mem, idx in order if not self._isConverted(mem, idx) ]
+
+    def _isConverted(self, member, idx):
+        """
+        Checks whether the profile for a member at a time index has been converted to the target type, without making
+            the profile (building it from the dense arrays or decoding it) if it hasn't. Converted profiles are always
+            stored in the member's list, so only those need to be looked at.
+        """
+        profs = self._profs[member]
+        prof = profs.getStored(idx) if isinstance(profs, MemberProfs) else profs[idx]
+        return type(prof) == self._target_type
+
+    def _reprioritize(self):
+        """
+        Reorder the background conversion around the current time and highlighted member, and start it if it isn't
+            already running.
+        """
+        if self._async is None:
+            return
+
+        with self._copy_lock:
+            self._copy_queue = self._copyOrder()
+            start = not self._copying and len(self._copy_queue) > 0
+            if start:
+                self._copying = True
+            gen = self._copy_gen
+
+        if start:
+            self._async.post(self._backgroundCopy, None, gen)
 
     def setAsync(self, async):
         """
@@ -79,16 +631,49 @@ class ProfCollection(object):
         async:  An AsyncThreads instance.
         """
         self._async = async
-        self._async.post(self._backgroundCopy, None, self._highlight)
+        self._reprioritize()
+
+    def setCopyMode(self, all_members=False, max_pending=None, max_block_size=None, progress=None):
+        """
+        Set how the profiles are converted in the background.
+        all_members [optional]: If True, convert every ensemble member at every time (after the ones that are needed
+            first). Otherwise, only the highlighted member and the other members at the current time are converted.
+            Default is False.
+        max_pending [optional]: The most profiles to have out to the worker pool at once. Default is twice the number of
+            cores.
+        max_block_size [optional]:  The most memory (in bytes) for each shared memory block the profiles are sent to the
+            worker pool in (see ProfBlock). This only limits the memory used to get the profiles to and from the
+            workers; the converted profiles are kept in the collection (outside any ProfCache) until they're replaced.
+            Default is no limit.
+        progress [optional]:    A function that's called as progress(n_done, n_total) every time a profile has been
+            converted. It's called from the background thread.
+        """
+        self._copy_all = all_members
+        self._max_pending = max_pending
+        self._max_block_size = max_block_size
+        self._progress = progress
+        self._reprioritize()
+
+    def getConvertedProf(self, member, date):
+        """
+        Returns the profile for ensemble member 'member' at time 'date' if it's been converted to the target type, or
+            None if it hasn't been converted yet.
+        """
+        prof = self._profs[member][self._dates.index(date)]
+        if type(prof) != self._target_type:
+            return None
+        return prof
 
     def cancelCopy(self):
         """
-        Terminates any threads that are running in the background.
+        Stops converting profiles in the background. Anything the worker pool is already working on is thrown away
+            when it's done. The background thread is left to finish on its own (within POLL_TIME), rather than killed,
+            so it can't be stopped while it holds the lock.
         """
-        for proc in self._procs:
-            proc.terminate()
-        if self._async is not None:
-            self._async.clearQueue()
+        with self._copy_lock:
+            self._copy_gen += 1
+            self._copying = False
+            self._copy_queue = []
 
     def getMeta(self, key, index=False):
         """
@@ -102,6 +687,18 @@ class ProfCollection(object):
             meta = meta[self._prof_idx]
         return meta
 
+    def getMetaKeys(self):
+        """
+        Returns the keys of all the metadata.
+        """
+        return self._meta.keys()
+
+    def getHighlightedMember(self):
+        """
+        Returns the name of the highlighted ensemble member.
+        """
+        return self._highlight
+
     def getCurrentDate(self):
         """
         Returns the current date in the profile object
@@ -130,16 +727,21 @@ class ProfCollection(object):
         if not self.hasCurrentProf():
             return {}
 
-        for mem, profs in self._profs.iteritems():
+        profs = {}
+        for mem, mem_profs in self._profs.iteritems():
             # Copy the profiles on the fly
-            cur_prof = profs[self._prof_idx]
+            cur_prof = mem_profs[self._prof_idx]
+            key = (mem, self._prof_idx)
 
             if mem == self._highlight and type(cur_prof) != self._target_type:
-                self._profs[mem][self._prof_idx] = self._target_type.copy(cur_prof)
+                self._profs[mem][self._prof_idx] = cur_prof = self._target_type.copy(cur_prof)
             elif type(cur_prof) not in [ profile.BasicProfile, self._target_type ]:
-                self._profs[mem][self._prof_idx] = profile.BasicProfile.copy(cur_prof)
+                # Keep the BasicProfile on the side, so the background conversion can still replace the original.
+                if key not in self._basic_profs:
+                    self._basic_profs[key] = profile.BasicProfile.copy(cur_prof)
+                cur_prof = self._basic_profs[key]
 
-        profs = dict( (mem, profs[self._prof_idx]) for mem, profs in self._profs.iteritems() ) 
+            profs[mem] = cur_prof
         return profs
 
     def getAnalogDate(self):
@@ -193,6 +795,7 @@ class ProfCollection(object):
         Sets the highlighted ensemble member to be 'member_name'.
         """
         self._highlight = member_name
+        self._reprioritize()
 
     def setCurrentDate(self, cur_dt):
         """
@@ -203,6 +806,7 @@ class ProfCollection(object):
             self._prof_idx = self._dates.index(cur_dt)
         except ValueError:
             self._prof_idx = -1
+        self._reprioritize()
 
     def setAnalogToDate(self, analog_to_date):
         """
@@ -226,6 +830,9 @@ class ProfCollection(object):
             self._prof_idx = length - 1
         else:
             self._prof_idx += direction
+
+        self._direction = 1 if direction > 0 else -1
+        self._reprioritize()
         return self._dates[self._prof_idx]
 
     def advanceHighlight(self, direction):
@@ -246,6 +853,7 @@ class ProfCollection(object):
             adv_idx = high_idx + direction
 
         self._highlight = mem_names[adv_idx]
+        self._reprioritize()
 
     def defineUserParcel(self, parcel):
         """
@@ -261,31 +869,69 @@ class ProfCollection(object):
         idx:    The vertical index to modify
         **kwargs:   The variables to modify ('tmpc', 'dwpc', 'u', or 'v')
         """
+        mods = [ (idx, kwargs) ]
+        self.setModifiedProf(self.getModifiedProf(mods), mods)
+
+    def getModifiedProf(self, mods, prof_type=None):
+        """
+        Returns a modified copy of the profile at the current time without changing the collection. This only reads from
+            the collection, so it's safe to call from a background thread.
+        mods:   A list of (idx, kwargs) tuples, where idx is the vertical index to modify and kwargs are the variables to
+            modify ('tmpc', 'dwpc', 'u', or 'v'). The modifications are applied in order.
+        prof_type [optional]:   The type of profile to return. Default is the type of the current profile. A cheaper type
+            (e.g. BasicProfile) can be used to get a quick preview of the modifications.
+        """
         if self.isEnsemble():
             raise ValueError("Can't modify ensemble profiles")
 
         prof = self._profs[self._highlight][self._prof_idx]
+        cls = type(prof) if prof_type is None else prof_type
 
-        # Save original, if one hasn't already been saved
-        if self._prof_idx not in self._orig_profs:
-            self._orig_profs[self._prof_idx] = prof
-
-        cls = type(prof)
-        # Copy the variables to be modified
-        prof_vars = dict( (k, prof.__dict__[k].copy()) for k in kwargs.iterkeys() )
+        # Copy the variables to be modified. Nothing else is copied.
+        prof_vars = dict( (k, prof.__dict__[k].copy()) for k in modVars(mods) )
 
         # Do the modification
-        for var, val in kwargs.iteritems():
-            prof_vars[var][idx] = val
-        
+        for idx, kwargs in mods:
+            for var, val in kwargs.iteritems():
+                prof_vars[var][idx] = val
+
+            # Keep the other form of the wind in step at this level, so it doesn't get recomputed for the whole column
+            if 'u' in kwargs or 'v' in kwargs:
+                prof_vars['wdir'][idx], prof_vars['wspd'][idx] = utils.comp2vec(prof_vars['u'][idx], prof_vars['v'][idx])
+            elif 'wdir' in kwargs or 'wspd' in kwargs:
+                prof_vars['u'][idx], prof_vars['v'][idx] = utils.vec2comp(prof_vars['wdir'][idx], prof_vars['wspd'][idx])
+
         # Make a copy of the profile object with the newly modified variables inserted.
-        self._profs[self._highlight][self._prof_idx] = cls.copy(prof, **prof_vars)
+        # Anything that doesn't depend on the modified variables is carried over from
+        # the old profile instead of being recomputed.
+        return cls.copy(prof, reuse=prof, **prof_vars)
+
+    def setModifiedProf(self, prof, mods):
+        """
+        Replace the profile at the current time with a modified profile from getModifiedProf().
+        prof:   The modified profile
+        mods:   The list of modifications that were used to make prof.
+        """
+        if self.isEnsemble():
+            raise ValueError("Can't modify ensemble profiles")
+
+        # Save the original values at the modified levels, if they haven't already been saved
+        cur_prof = self._profs[self._highlight][self._prof_idx]
+        diffs = self._mod_diffs.setdefault(self._prof_idx, {})
+        for idx, kwargs in mods:
+            for var in modVars([ (idx, kwargs) ]):
+                var_diffs = diffs.setdefault(var, {})
+                if idx not in var_diffs:
+                    var_diffs[idx] = cur_prof.__dict__[var][idx]
+
+        self._profs[self._highlight][self._prof_idx] = prof
 
         # Update bookkeeping
-        if 'tmpc' in kwargs or 'dwpc' in kwargs:
+        mod_vars = modVars(mods)
+        if 'tmpc' in mod_vars or 'dwpc' in mod_vars:
             self._mod_therm[self._prof_idx] = True
 
-        if 'u' in kwargs or 'v' in kwargs or 'wdir' in kwargs or 'wspd' in kwargs:
+        if 'u' in mod_vars or 'v' in mod_vars or 'wdir' in mod_vars or 'wspd' in mod_vars:
             self._mod_wind[self._prof_idx] = True
 
     def interp(self, dp=-25):
@@ -298,14 +944,33 @@ class ProfCollection(object):
 
         prof = self._profs[self._highlight][self._prof_idx]
 
-        # Save original, if one hasn't already been saved
+        # Save original, if one hasn't already been saved. The modifications were made on the original levels, so
+        #   they're saved with it.
+        diffs = self._mod_diffs.pop(self._prof_idx, {})
         if self._prof_idx not in self._orig_profs:
-            self._orig_profs[self._prof_idx] = prof
+            self._orig_profs[self._prof_idx] = (prof, diffs)
+            diffs = {}
+
+        interp_prof = self._interpProf(prof, dp)
+        if len(diffs) > 0:
+            # The profile was modified after it was last interpolated. Interpolate the unmodified profile as well and
+            #   move the modifications onto the new levels, so they can still be reset.
+            base_prof = self._interpProf(self._revert(prof, dict(diffs), diffs.keys()), dp)
+            self._mod_diffs[self._prof_idx] = self._rebase(base_prof, interp_prof, diffs.keys())
+
+        self._profs[self._highlight][self._prof_idx] = interp_prof
+
+        # Update bookkeeping
+        self._interp[self._prof_idx] = True
 
+    def _interpProf(self, prof, dp):
+        """
+        Interpolate a profile to a specific pressure level spacing.
+        prof:   The profile to interpolate
+        dp:     The pressure level spacing (mb)
+        """
         cls = type(prof)
         # Copy the tmpc, dwpc, etc. profiles to be inteprolated
-        keys = ['tmpc', 'dwpc', 'hght', 'wspd', 'wdir', 'omeg']
-        
         prof_vars = {'pres': np.arange(prof.pres[prof.sfc], prof.pres[prof.top], dp)}
         prof_vars['tmpc'] = interp.temp(prof, prof_vars['pres'])
         prof_vars['dwpc'] = interp.dwpt(prof, prof_vars['pres'])
@@ -318,37 +983,31 @@ class ProfCollection(object):
         prof_vars['u'] = u
         prof_vars['v'] = v
 
-        interp_prof = cls.copy(prof, **prof_vars)
-        self._profs[self._highlight][self._prof_idx] = interp_prof
+        return cls.copy(prof, **prof_vars)
 
-         # Save the original like in modify()
-        if self._prof_idx not in self._interp_profs:
-            self._interp_profs[self._prof_idx] = interp_prof
-       
-        # Update bookkeeping
-        self._interp[self._prof_idx] = True
+    def _rebase(self, base_prof, prof, mod_vars):
+        """
+        Make the modification diffs that take an unmodified profile to a modified one on the same levels.
+        base_prof:  The unmodified profile
+        prof:       The modified profile
+        mod_vars:   The variables that were modified
+        """
+        diffs = {}
+        for var in mod_vars:
+            base_vals, vals = base_prof.__dict__[var], prof.__dict__[var]
+            base_mask, mask = np.ma.getmaskarray(base_vals), np.ma.getmaskarray(vals)
+            changed = (base_mask != mask) | (~mask & (np.ma.getdata(base_vals) != np.ma.getdata(vals)))
+            diffs[var] = dict( (int(idx), base_vals[idx]) for idx in np.nonzero(changed)[0] )
+        return diffs
 
     def resetModification(self, *args):
         """
         Reset the profile to its original state.
         *args:  The variables to reset ('tmpc', 'dwpc', 'u', or 'v').
         """
-        if not self._prof_idx in self._orig_profs:
-            return
-
-        if self._interp[self._prof_idx]:
-            orig_prof = self._interp_profs[self._prof_idx]
-        else:
-            orig_prof = self._orig_profs[self._prof_idx]
-
         prof = self._profs[self._highlight][self._prof_idx]
-        cls = type(prof)
-
-        # Get the original variables
-        prof_vars = dict( (k, orig_prof.__dict__[k]) for k in args )
-
-        # Make a copy of the profile object with the original variables inserted
-        self._profs[self._highlight][self._prof_idx] = cls.copy(prof, **prof_vars)
+        diffs = self._mod_diffs.get(self._prof_idx, {})
+        self._profs[self._highlight][self._prof_idx] = self._revert(prof, diffs, args)
 
         # Update bookkeeping
         if 'tmpc' in args or 'dwpc' in args:
@@ -357,21 +1016,43 @@ class ProfCollection(object):
         if 'u' in args or 'v' in args or 'wdir' in args or 'wspd' in args:
             self._mod_wind[self._prof_idx] = False
 
-        if not self.isModified() and not self.isInterpolated():
-            del self._orig_profs[self._prof_idx]
+        if len(diffs) == 0:
+            self._mod_diffs.pop(self._prof_idx, None)
 
     def resetInterpolation(self):
-        if not self._prof_idx in self._interp_profs:
+        if not self._interp[self._prof_idx]:
             return
 
-        self._profs[self._highlight][self._prof_idx] = self._orig_profs[self._prof_idx]
-
-        prof = self._profs[self._highlight][self._prof_idx]
-#       print dict( (k, prof.__dict__[k].shape[0]) for k in [ 'pres', 'hght', 'tmpc', 'dwpc', 'u', 'v' ])
-
-        del self._orig_profs[self._prof_idx]
-        del self._interp_profs[self._prof_idx]
+        # Go back to the original profile and undo any modifications that were made to it before it was interpolated.
+        prof, diffs = self._orig_profs.pop(self._prof_idx)
+        self._profs[self._highlight][self._prof_idx] = self._revert(prof, diffs, diffs.keys())
+        self._mod_diffs.pop(self._prof_idx, None)
 
         self._mod_wind[self._prof_idx] = False
         self._mod_therm[self._prof_idx] = False
         self._interp[self._prof_idx] = False
+
+    def _revert(self, prof, diffs, mod_vars):
+        """
+        Put the original values from a set of modification diffs back into a profile. Only the columns that were modified
+            are copied; everything else is shared with prof. The reverted variables are removed from diffs.
+        prof:   The modified profile
+        diffs:  The modification diffs for the profile ({variable: {level: original value}})
+        mod_vars:   The variables to revert
+        """
+        prof_vars = {}
+        if any(k in mod_vars for k in WIND_VARS):
+            mod_vars = set(mod_vars) | set(WIND_VARS)
+
+        for var in mod_vars:
+            if var not in diffs:
+                continue
+
+            prof_vars[var] = prof.__dict__[var].copy()
+            for idx, val in diffs.pop(var).iteritems():
+                prof_vars[var][idx] = val
+
+        if len(prof_vars) == 0:
+            return prof
+
+        return type(prof).copy(prof, reuse=prof, **prof_vars)
@@ -2,14 +2,34 @@
 from __future__ import division
 import numpy as np
 import numpy.ma as ma
-import getpass
-from datetime import datetime
+import copy
+import Queue
 from sharppy.sharptab import utils, winds, params, interp, thermo, watch_type, fire
 import sharppy.io.qc_tools as qc_tools
 from sharppy.databases.sars import hail, supercell
 from sharppy.databases.pwv import pwv_climo
 from sharppy.sharptab.constants import MISSING
 
+def as_column(data, dtype=float):
+    '''
+        Converts profile data to a masked array.  Masked arrays that already
+        have the right type are used as-is instead of being copied, so the
+        columns a modified profile didn't change are shared with the profile
+        it was copied from.  Profiles never change their columns in place.
+
+        Parameters
+        ----------
+        data : array_like
+        dtype : data type (default: float; None keeps the type of data)
+
+        Returns
+        -------
+        A masked array
+        '''
+    if isinstance(data, ma.MaskedArray) and (dtype is None or data.dtype == dtype):
+        return data
+    return ma.asanyarray(data, dtype=dtype)
+
 def create_profile(**kwargs):
     '''
     This is a wrapper function for constructing Profile objects
@@ -100,37 +120,37 @@ class Profile(object):
         self.latitude = kwargs.get('latitude', ma.masked)
 
         ## get the data and turn them into arrays
-        self.pres = ma.asanyarray(kwargs.get('pres'), dtype=float)
-        self.hght = ma.asanyarray(kwargs.get('hght'), dtype=float)
-        self.tmpc = ma.asanyarray(kwargs.get('tmpc'), dtype=float)
-        self.dwpc = ma.asanyarray(kwargs.get('dwpc'), dtype=float)
+        self.pres = as_column(kwargs.get('pres'))
+        self.hght = as_column(kwargs.get('hght'))
+        self.tmpc = as_column(kwargs.get('tmpc'))
+        self.dwpc = as_column(kwargs.get('dwpc'))
+
+        ## the wind can be given in vector form, u,v form, or both (copies
+        ## of a profile pass both, so neither has to be recomputed)
+        self.wdir = None
+        self.wspd = None
+        self.u = None
+        self.v = None
 
         if 'wdir' in kwargs:
-            self.wdir = ma.asanyarray(kwargs.get('wdir'), dtype=float)
-            self.wspd = ma.asanyarray(kwargs.get('wspd'), dtype=float)
-
-            self.u = None
-            self.v = None
+            self.wdir = as_column(kwargs.get('wdir'))
+            self.wspd = as_column(kwargs.get('wspd'))
 
-        ## did the user provide the wind in u,v form?
-        elif 'u' in kwargs:
-            self.u = ma.asanyarray(kwargs.get('u'), dtype=float)
-            self.v = ma.asanyarray(kwargs.get('v'), dtype=float)
-
-            self.wdir = None
-            self.wspd = None
+        if 'u' in kwargs:
+            self.u = as_column(kwargs.get('u'))
+            self.v = as_column(kwargs.get('v'))
 
         ## check if any standard deviation data was supplied
         if 'tmp_stdev' in kwargs:
-            self.dew_stdev = ma.asanyarray(kwargs.get('dew_stdev'), dtype=float)
-            self.tmp_stdev = ma.asanyarray(kwargs.get('tmp_stdev'), dtype=float)
+            self.dew_stdev = as_column(kwargs.get('dew_stdev'))
+            self.tmp_stdev = as_column(kwargs.get('tmp_stdev'))
         else:
             self.dew_stdev = None
             self.tmp_stdev = None
 
         if kwargs.get('omeg', None) is not None:
             ## get the omega data and turn into arrays
-            self.omeg = ma.asanyarray(kwargs.get('omeg'))
+            self.omeg = as_column(kwargs.get('omeg'), dtype=None)
         else:
             self.omeg = None
 
@@ -141,39 +161,28 @@ class Profile(object):
     @classmethod
     def copy(cls, prof, **kwargs):
         '''
-            Copies a profile object.
+            Copies a profile object.  The columns that aren't passed in
+            kwargs are shared with prof rather than copied.
         '''            
         new_kwargs = dict( (k, prof.__dict__[k]) for k in [ 'pres', 'hght', 'tmpc', 'dwpc', 'omeg', 'location', 'date', 'latitude' ])
-        if 'u' in kwargs or 'v' in kwargs:
+        if 'u' in kwargs or 'v' in kwargs or prof.wdir is None:
             new_kwargs.update({'u':prof.u, 'v':prof.v})
-        else:   
+        elif 'wspd' in kwargs or 'wdir' in kwargs or prof.u is None:
             new_kwargs.update({'wspd':prof.wspd, 'wdir':prof.wdir})
+        else:
+            new_kwargs.update({'wspd':prof.wspd, 'wdir':prof.wdir, 'u':prof.u, 'v':prof.v})
 
         new_kwargs.update(kwargs)
         return cls(**new_kwargs)
 
     def toFile(self, file_name):
-        snd_file = open(file_name, 'w')
-        def qc(val):
-            return -9999. if not utils.QC(val) else val
-
-        snd_loc = (" " * (4 - len(self.location))) + self.location
-
-        now = datetime.utcnow()
-        user = getpass.getuser()
-        snd_file.write("%TITLE%\n")
-        snd_file.write("%s   %s\n Saved by user: %s on %s UTC\n" % (snd_loc, self.date.strftime("%y%m%d/%H%M"), user, now.strftime('%Y%m%d/%H%M')))
-        snd_file.write("   LEVEL       HGHT       TEMP       DWPT       WDIR       WSPD\n")
-        snd_file.write("-------------------------------------------------------------------\n")
-        snd_file.write("%RAW%\n")
-        for idx in xrange(self.pres.shape[0]):
-            str = ""
-            for col in ['pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd']:
-                str += "%8.2f,  " % qc(self.__dict__[col][idx])
-
-            snd_file.write(str[:-3] + "\n")
-        snd_file.write("%END%\n")
-        snd_file.close()
+        '''
+            Writes the profile to an SPC text file (see
+            sharppy.io.writer.writeProfiles() to write a lot of profiles at
+            once, or other formats).
+        '''
+        from sharppy.io.writer import writeProfiles
+        writeProfiles(self, file_name)
 
 class BasicProfile(Profile):
     '''
@@ -231,6 +240,12 @@ class BasicProfile(Profile):
         A flag that indicates whether or not the strict quality control
         routines should be run on the profile upon construction.
 
+        reuse : Profile object (default: None)
+        A previously computed profile of the same type.  Any results that
+        only depend on data that is the same in both profiles (e.g. the
+        thermodynamic data when only the winds were modified) are taken
+        from it instead of being recomputed.
+
         Returns
         -------
         prof: Profile object
@@ -246,32 +261,29 @@ class BasicProfile(Profile):
         ## did the user provide the wind in vector form?
         if self.wdir is not None:
             assert len(self.wdir) == len(self.wspd) == len(self.pres), "Length of wdir and wspd arrays passed to constructor are not the same length as the pres array."
-            self.wdir[self.wdir == self.missing] = ma.masked
-            self.wspd[self.wspd == self.missing] = ma.masked
-            self.wdir[self.wspd.mask] = ma.masked
-            self.wspd[self.wdir.mask] = ma.masked
-            self.u, self.v = utils.vec2comp(self.wdir, self.wspd)
+            self.wdir, self.wspd = self.mask_missing(self.wdir, self.wspd)
 
         ## did the user provide the wind in u,v form?
-        elif self.u is not None:
+        if self.u is not None:
             assert len(self.u) == len(self.v) == len(self.pres), "Length of u and v arrays passed to constructor are not the same length as the pres array."
-            self.u[self.u == self.missing] = ma.masked
-            self.v[self.v == self.missing] = ma.masked
-            self.u[self.v.mask] = ma.masked
-            self.v[self.u.mask] = ma.masked
+            self.u, self.v = self.mask_missing(self.u, self.v)
+
+        if self.u is None and self.wdir is not None:
+            self.u, self.v = utils.vec2comp(self.wdir, self.wspd)
+        elif self.wdir is None and self.u is not None:
             self.wdir, self.wspd = utils.comp2vec(self.u, self.v)
 
         ## check if any standard deviation data was supplied
         if self.tmp_stdev is not None:
-            self.dew_stdev[self.dew_stdev == self.missing] = ma.masked
-            self.tmp_stdev[self.tmp_stdev == self.missing] = ma.masked
+            self.dew_stdev = self.mask_missing(self.dew_stdev)
+            self.tmp_stdev = self.mask_missing(self.tmp_stdev)
             self.dew_stdev.set_fill_value(self.missing)
             self.tmp_stdev.set_fill_value(self.missing)
 
         if self.omeg is not None:
             ## get the omega data and turn into arrays
             assert len(self.omeg) == len(self.pres), "Length of omeg array passed to constructor is not the same length as the pres array."
-            self.omeg[self.omeg == self.missing] = ma.masked
+            self.omeg = self.mask_missing(self.omeg)
         else:
             self.omeg = ma.masked_all(len(self.hght))
 
@@ -279,10 +291,10 @@ class BasicProfile(Profile):
         qc_tools.areProfileArrayLengthEqual(self)
        
         ## mask the missing values
-        self.pres[self.pres == self.missing] = ma.masked
-        self.hght[self.hght == self.missing] = ma.masked
-        self.tmpc[self.tmpc == self.missing] = ma.masked
-        self.dwpc[self.dwpc == self.missing] = ma.masked
+        self.pres = self.mask_missing(self.pres)
+        self.hght = self.mask_missing(self.hght)
+        self.tmpc = self.mask_missing(self.tmpc)
+        self.dwpc = self.mask_missing(self.dwpc)
 
         #if not qc_tools.isPRESValid(self.pres):
         ##    qc_tools.raiseError("Incorrect order of pressure array (or repeat values) or pressure array is of length <= 1.", ValueError)
@@ -298,6 +310,17 @@ class BasicProfile(Profile):
             qc_tools.raiseError("Invalid wind direction array. Array contains a value < 0 degrees or value > 360 degrees.", ValueError)     
 
 
+        reuse = kwargs.get('reuse', None)
+        if isinstance(reuse, BasicProfile) and self.same_thermo(reuse):
+            ## the thermodynamic data hasn't changed, so neither have these
+            self.logp = reuse.logp
+            self.vtmp = reuse.vtmp
+            self.sfc = reuse.sfc
+            self.top = reuse.top
+            self.wetbulb = reuse.wetbulb
+            self.thetae = reuse.thetae
+            return
+
         self.logp = np.log10(self.pres.copy())
         self.vtmp = thermo.virtemp( self.pres, self.tmpc, self.dwpc )
         idx = np.ma.where(self.pres > 0)[0]
@@ -311,6 +334,79 @@ class BasicProfile(Profile):
         ## generate theta-e profile
         self.thetae = self.get_thetae_profile()
 
+    def mask_missing(self, *cols):
+        '''
+            Masks the missing values in one or more columns.  If more than
+            one column is given, a level that is masked in any of them is
+            masked in all of them.  Columns can be shared with other
+            profiles, so their masks are never changed in place; a column
+            that needs a different mask gets a new view of its data.
+
+            Parameters
+            ----------
+            cols : masked arrays
+
+            Returns
+            -------
+            The masked column, or a list of the masked columns if more
+            than one was given
+            '''
+        masks = [ ma.getmaskarray(col) | (ma.getdata(col) == self.missing) for col in cols ]
+        mask = np.logical_or.reduce(masks)
+
+        new_cols = []
+        for col in cols:
+            if ma.getmask(col) is ma.nomask or not np.array_equal(mask, col.mask):
+                col = ma.array(col, mask=mask, copy=False)
+            new_cols.append(col)
+        return new_cols[0] if len(new_cols) == 1 else new_cols
+
+    def same_thermo(self, prof):
+        '''
+            Checks whether another profile has the same thermodynamic data
+            (pressure, height, temperature, dew point, and omega) as this one.
+
+            Parameters
+            ----------
+            prof : Profile object
+
+            Returns
+            -------
+            True if the thermodynamic data are identical, False otherwise
+            '''
+        return self._same_columns(prof, [ 'pres', 'hght', 'tmpc', 'dwpc', 'omeg' ])
+
+    def same_wind(self, prof):
+        '''
+            Checks whether another profile has the same kinematic data
+            (pressure, height, and wind components) as this one.
+
+            Parameters
+            ----------
+            prof : Profile object
+
+            Returns
+            -------
+            True if the kinematic data are identical, False otherwise
+            '''
+        return self._same_columns(prof, [ 'pres', 'hght', 'u', 'v' ])
+
+    def _same_columns(self, prof, cols):
+        for col in cols:
+            mine = self.__dict__[col]
+            theirs = prof.__dict__.get(col, None)
+            if mine is theirs:
+                continue
+            if mine is None or theirs is None or mine.shape != theirs.shape:
+                return False
+
+            mask = ma.getmaskarray(mine)
+            if not np.array_equal(mask, ma.getmaskarray(theirs)):
+                return False
+            if not np.array_equal(ma.getdata(mine)[~mask], ma.getdata(theirs)[~mask]):
+                return False
+        return True
+
     def get_sfc(self):
         '''
             Convenience function to get the index of the surface. It is
@@ -405,6 +501,24 @@ class BasicProfile(Profile):
 
 
 
+def run_stage(prof, stage):
+    '''
+    Runs a ConvectiveProfile stage (in a worker process or thread) and
+    returns the results it added to the profile.
+
+    Parameters
+    ----------
+    prof : ConvectiveProfile
+    stage : the name of the stage
+
+    Returns
+    -------
+    A dictionary of the results
+    '''
+    before = dict(prof.__dict__)
+    getattr(prof, 'get_' + stage)()
+    return dict( (k, v) for k, v in prof.__dict__.items() if k not in before or before[k] is not v )
+
 class ConvectiveProfile(BasicProfile):
     '''
     The Convective data class for SHARPPy. This is the class used
@@ -413,6 +527,53 @@ class ConvectiveProfile(BasicProfile):
     This class inherits from the Profile object.
 
     '''
+    ## Results that only depend on the thermodynamic data
+    thermo_attrs = [ 'ppbl_top', 'sfc_rh', 'rh01km', 'pblrh', 'bplus_fire',
+        'dgz_pbot', 'dgz_ptop', 'dgz_meanrh', 'dgz_pw', 'dgz_meanq', 'dgz_meanomeg', 'oprh',
+        'plevel', 'phase', 'tmp', 'st', 'tpos', 'tneg', 'ttop', 'tbot', 'wpos', 'wneg', 'wtop', 'wbot',
+        'precip_type', 'ebottom', 'etop', 'ebotm', 'etopm', 'k_idx', 'pwat', 'lapserate_3km',
+        'lapserate_3_6km', 'lapserate_850_500', 'lapserate_700_500', 'convT', 'maxT', 'mean_mixr',
+        'low_rh', 'mid_rh', 'totals_totals', 'pwv_flag', 'dcape', 'dpcl_ttrace', 'dpcl_ptrace',
+        'drush', 'tei', 'esp', 'mburst' ]
+    ## The parcels also only depend on the thermodynamic data, except for their
+    ## bulk Richardson numbers
+    parcel_attrs = [ 'mupcl', 'sfcpcl', 'fcstpcl', 'mlpcl', 'effpcl' ]
+    ## Results that only depend on the winds
+    wind_attrs = [ 'wind1km', 'wind6km', 'sfc_1km_shear', 'sfc_3km_shear', 'sfc_6km_shear',
+        'sfc_8km_shear', 'sfc_9km_shear', 'mean_1km', 'mean_3km', 'mean_6km', 'mean_8km',
+        'upshear_downshear' ]
+    ## Results that depend on the winds and the storm motion, which depends on the
+    ## most unstable parcel and the effective inflow layer
+    storm_attrs = [ 'lcl_el_shear', 'mean_lcl_el', 'srwind', 'eff_shear', 'ebwd', 'ebwspd',
+        'mean_eff', 'mean_ebw', 'srw_eff', 'srw_ebw', 'right_esrh', 'left_esrh', 'critical_angle',
+        'srw_1km', 'srw_3km', 'srw_6km', 'srw_8km', 'srw_4_5km', 'srw_lcl_el', 'srw_0_2km',
+        'srw_4_6km', 'srw_9_11km', 'srh1km', 'srh3km' ]
+
+    ## The stages that compute the indices (each one is a get_<stage>() method),
+    ## in the order they're run in serially, with the stages each one needs to
+    ## have finished first
+    stages = [
+        ('fire_thermo', []),
+        ('precip', []),
+        ('parcels', []),
+        ('thermo_indices', []),
+        ('PWV_loc', []),
+        ('thermo_composites', [ 'parcels', 'thermo_indices' ]),
+        ('wind_kinematics', []),
+        ('storm_kinematics', [ 'parcels' ]),
+        ('fire_winds', [ 'fire_thermo' ]),
+        ('temp_adv', []),
+        ('severe', [ 'parcels', 'wind_kinematics', 'storm_kinematics' ]),
+        ('sars', [ 'parcels', 'thermo_indices', 'wind_kinematics', 'storm_kinematics' ]),
+        ('traj', [ 'parcels', 'storm_kinematics' ]),
+        ('mixed_composites', [ 'parcels', 'thermo_indices', 'thermo_composites', 'wind_kinematics',
+            'storm_kinematics' ]),
+        ('watch', [ 'fire_thermo', 'precip', 'parcels', 'thermo_indices', 'PWV_loc', 'thermo_composites',
+            'wind_kinematics', 'storm_kinematics', 'severe', 'sars', 'mixed_composites' ]),
+    ]
+    ## The stages that only depend on the thermodynamic data
+    thermo_stages = [ 'fire_thermo', 'precip', 'parcels', 'thermo_indices', 'PWV_loc', 'thermo_composites' ]
+
     def __init__(self, **kwargs):
         '''
         Create the sounding data object
@@ -457,6 +618,20 @@ class ConvectiveProfile(BasicProfile):
 
         omeg : array_like
         List of the vertical velocity in pressure coordinates with height (Pascals/second)
+
+        reuse : ConvectiveProfile (default: None)
+        A previously computed profile (e.g. the profile before a modification).
+        If only its winds differ from this profile, all of the thermodynamic
+        results are taken from it.  If only its thermodynamic data differ, the
+        kinematic results are taken from it (including the storm-relative ones,
+        if the storm motion inputs didn't change).  Only the indices that
+        depend on both are recomputed.
+
+        executor : multiprocessing Pool or ThreadPool (default: None)
+        If given, the stages that don't depend on each other (see
+        ConvectiveProfile.stages) are run at the same time in the pool.
+        The results are the same as when the stages are run one after
+        another.
             
         Returns
         -------
@@ -465,38 +640,165 @@ class ConvectiveProfile(BasicProfile):
         ## call the constructor for Profile
         super(ConvectiveProfile, self).__init__(**kwargs)
 
-        # Generate the fire weather paramters
-        self.get_fire()
+        reuse = kwargs.get('reuse', None)
+        if not isinstance(reuse, ConvectiveProfile):
+            reuse = None
+        same_thermo = reuse is not None and self.same_thermo(reuse)
+        ## the fixed layers for the kinematics are relative to the surface
+        same_wind = reuse is not None and self.sfc == reuse.sfc and self.same_wind(reuse)
+
+        ## skip the stages whose results can be taken from the reused profile
+        skip = []
+        local = {}
+        if same_thermo:
+            self.reuse_thermo(reuse)
+            skip.extend(ConvectiveProfile.thermo_stages)
+
+        if same_wind:
+            self.reuse_attrs(reuse, ConvectiveProfile.wind_attrs)
+            skip.append('wind_kinematics')
+
+            ## whether the storm motion changed isn't known until the parcels are done
+            def storm_kinematics():
+                if self.same_storm_inputs(reuse):
+                    self.reuse_attrs(reuse, ConvectiveProfile.storm_attrs)
+                else:
+                    self.get_storm_kinematics()
+            local['storm_kinematics'] = storm_kinematics
+
+        self.run_stages([ stage for stage, deps in ConvectiveProfile.stages if stage not in skip ],
+            executor=kwargs.get('executor', None), local=local)
+
+    def run_stages(self, stages, executor=None, local=None):
+        '''
+        Function to run the stages that compute the indices.  Without an
+        executor, they're run one after another in the order given by
+        ConvectiveProfile.stages.  With an executor, each stage is sent to
+        the pool as soon as the stages it depends on have finished.
 
-        # Generate the winter inset/precipitation types
-        self.get_precip()
-        
-        ## generate various parcels
-        self.get_parcels()
+        Parameters
+        ----------
+        stages : list of the names of the stages to run (the stages that
+            aren't in the list are assumed to be done already)
+        executor : multiprocessing Pool or ThreadPool (default: None)
+        local : dictionary of stage names to functions that are run in
+            place of those stages in this process (default: None)
 
-        ## calculate thermodynamic window indices
-        self.get_thermo()
+        Returns
+        -------
+        None
+        '''
+        if local is None:
+            local = {}
+
+        if executor is None:
+            for stage in stages:
+                local.get(stage, getattr(self, 'get_' + stage))()
+            return
+
+        deps = dict(ConvectiveProfile.stages)
+        done = set( stage for stage in deps if stage not in stages )
+        waiting = list(stages)
+        finished = Queue.Queue()
+        running = {}
+
+        while len(waiting) > 0 or len(running) > 0:
+            ready = [ stage for stage in waiting if all( dep in done for dep in deps[stage] ) ]
+            for stage in ready:
+                waiting.remove(stage)
+                if stage in local:
+                    local[stage]()
+                    done.add(stage)
+                else:
+                    ## the stage gets its own copy of the profile (not of the data), so it
+                    ## doesn't see the other stages' results come in while it's running
+                    running[stage] = executor.apply_async(run_stage, (copy.copy(self), stage),
+                        callback=lambda attrs, stage=stage: finished.put(stage))
+
+            if len(running) == 0:
+                ## a local stage may have made more stages ready
+                continue
+
+            try:
+                stage = finished.get(timeout=0.1)
+            except Queue.Empty:
+                ## a stage that fails doesn't call back, so look for one
+                failed = [ stage for stage, result in running.iteritems() if result.ready() ]
+                if len(failed) == 0:
+                    continue
+                stage = failed[0]
+
+            ## this raises the exception if the stage failed
+            self.__dict__.update(running.pop(stage).get())
+            done.add(stage)
+
+    def reuse_attrs(self, prof, attrs):
+        '''
+        Function to take already computed results from another profile
+        instead of computing them again.
+
+        Parameters
+        ----------
+        prof : ConvectiveProfile
+        attrs : list of the names of the results to take
+
+        Returns
+        -------
+        None
+        '''
+        for attr in attrs:
+            setattr(self, attr, getattr(prof, attr))
 
-        ## generate wind indices
-        self.get_kinematics()
+    def reuse_thermo(self, prof):
+        '''
+        Function to take all of the thermodynamic results from another
+        profile with the same thermodynamic data.  The parcels are copied
+        and only their bulk Richardson numbers, which depend on the winds,
+        are recomputed.
 
-        ## get SCP, STP(cin), STP(fixed), SHIP
-        self.get_severe()
+        Parameters
+        ----------
+        prof : ConvectiveProfile
 
-        ## calculate the SARS database matches
-        self.get_sars()
+        Returns
+        -------
+        None
+        '''
+        self.reuse_attrs(prof, ConvectiveProfile.thermo_attrs)
+
+        # Some of the parcels may be the same object (e.g. when the surface
+        # parcel is the most unstable parcel), so keep them that way.
+        pcl_copies = {}
+        for attr in ConvectiveProfile.parcel_attrs:
+            pcl = getattr(prof, attr)
+            if id(pcl) not in pcl_copies:
+                pcl_copies[id(pcl)] = params.bulk_rich(self, params.Parcel(**pcl.__dict__))
+            setattr(self, attr, pcl_copies[id(pcl)])
+        self.usrpcl = params.Parcel()
 
-        ## get the precipitable water climatology
-        self.get_PWV_loc()
+    def same_storm_inputs(self, prof):
+        '''
+        Function to check whether the inputs to the storm motion (the
+        effective inflow layer and the most unstable parcel) are the same
+        in this profile and another profile.
 
-        ## get the parcel trajectory
-        self.get_traj()
+        Parameters
+        ----------
+        prof : ConvectiveProfile
 
-        ## miscellaneous indices I didn't know where to put
-        self.get_indices()
+        Returns
+        -------
+        True if the storm motion inputs are identical, False otherwise
+        '''
+        def same(a, b):
+            if a is ma.masked or b is ma.masked:
+                return a is b
+            return a == b
 
-        ## get the possible watch type
-        self.get_watch()
+        return same(self.ebottom, prof.ebottom) and same(self.etop, prof.etop) and \
+            same(self.mupcl.lclpres, prof.mupcl.lclpres) and same(self.mupcl.elpres, prof.mupcl.elpres) and \
+            same(self.mupcl.elhght, prof.mupcl.elhght) and \
+            same(self.mupcl.bplus > 100., prof.mupcl.bplus > 100.)
 
     def get_fire(self):
         '''
@@ -512,21 +814,53 @@ class ConvectiveProfile(BasicProfile):
         -------
         None
         '''
-        self.fosberg = fire.fosberg(self)
+        self.get_fire_thermo()
+        self.get_fire_winds()
+
+    def get_fire_thermo(self):
+        '''
+        Function to generate the fire weather indices that only
+        depend on the thermodynamic data.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
         self.ppbl_top = params.pbl_top(self)
         self.sfc_rh = thermo.relh(self.pres[self.sfc], self.tmpc[self.sfc], self.dwpc[self.sfc])
         pres_sfc = self.pres[self.sfc]
         pres_1km = interp.pres(self, interp.to_msl(self, 1000.))
-        pbl_h = interp.to_agl(self, interp.hght(self, self.ppbl_top))
         self.rh01km = params.mean_relh(self, pbot=pres_sfc, ptop=pres_1km)
         self.pblrh = params.mean_relh(self, pbot=pres_sfc, ptop=self.ppbl_top)
+        mulplvals = params.DefineParcel(self, flag=3, pres=500)
+        mupcl = params.cape(self, lplvals=mulplvals)
+        self.bplus_fire = mupcl.bplus
+
+    def get_fire_winds(self):
+        '''
+        Function to generate the fire weather indices that depend on
+        the winds.  Requires calling get_fire_thermo() first.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.fosberg = fire.fosberg(self)
+        pres_sfc = self.pres[self.sfc]
+        pres_1km = interp.pres(self, interp.to_msl(self, 1000.))
+        pbl_h = interp.to_agl(self, interp.hght(self, self.ppbl_top))
         self.meanwind01km = winds.mean_wind(self, pbot=pres_sfc, ptop=pres_1km)
         self.meanwindpbl = winds.mean_wind(self, pbot=pres_sfc, ptop=self.ppbl_top)
         self.pblmaxwind = winds.max_wind(self, lower=0, upper=pbl_h)
         #self.pblmaxwind = [np.ma.masked, np.ma.masked]
-        mulplvals = params.DefineParcel(self, flag=3, pres=500)
-        mupcl = params.cape(self, lplvals=mulplvals)
-        self.bplus_fire = mupcl.bplus
 
     def get_precip(self):
         '''
@@ -641,13 +975,29 @@ class ConvectiveProfile(BasicProfile):
         ----------
         None
 
+        Returns
+        -------
+        None
+        '''
+        self.get_wind_kinematics()
+        self.get_storm_kinematics()
+
+    def get_wind_kinematics(self):
+        '''
+        Function to generate the kinematic quantities that only depend
+        on the winds (fixed-layer shear and mean winds).
+
+        Parameters
+        ----------
+        None
+
         Returns
         -------
         None
         '''
         sfc = self.pres[self.sfc]
-        heights = np.array([1000., 3000., 4000., 5000., 6000., 8000., 9000.])
-        p1km, p3km, p4km, p5km, p6km, p8km, p9km = interp.pres(self, interp.to_msl(self, heights))
+        heights = np.array([1000., 3000., 6000., 8000., 9000.])
+        p1km, p3km, p6km, p8km, p9km = interp.pres(self, interp.to_msl(self, heights))
         ## 1km and 6km winds
         self.wind1km = interp.vec(self, p1km)
         self.wind6km = interp.vec(self, p6km)
@@ -657,12 +1007,35 @@ class ConvectiveProfile(BasicProfile):
         self.sfc_6km_shear = winds.wind_shear(self, pbot=sfc, ptop=p6km)
         self.sfc_8km_shear = winds.wind_shear(self, pbot=sfc, ptop=p8km)
         self.sfc_9km_shear = winds.wind_shear(self, pbot=sfc, ptop=p9km)
-        self.lcl_el_shear = winds.wind_shear(self, pbot=self.mupcl.lclpres, ptop=self.mupcl.elpres)
         ## calculate mean wind
         self.mean_1km = utils.comp2vec(*winds.mean_wind(self, pbot=sfc, ptop=p1km))
         self.mean_3km = utils.comp2vec(*winds.mean_wind(self, pbot=sfc, ptop=p3km))
         self.mean_6km = utils.comp2vec(*winds.mean_wind(self, pbot=sfc, ptop=p6km))
         self.mean_8km = utils.comp2vec(*winds.mean_wind(self, pbot=sfc, ptop=p8km))
+        ## calculate upshear and downshear
+        self.upshear_downshear = winds.mbe_vectors(self)
+
+    def get_storm_kinematics(self):
+        '''
+        Function to generate the kinematic quantities that depend on
+        the storm motion or the parcels.  It requires that the parcel
+        calculations have already been called for the lcl to el shear
+        and mean wind vectors, as well as indices that require an
+        effective inflow layer.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        sfc = self.pres[self.sfc]
+        heights = np.array([1000., 3000., 4000., 5000., 6000., 8000.])
+        p1km, p3km, p4km, p5km, p6km, p8km = interp.pres(self, interp.to_msl(self, heights))
+        self.lcl_el_shear = winds.wind_shear(self, pbot=self.mupcl.lclpres, ptop=self.mupcl.elpres)
+        ## calculate mean wind
         self.mean_lcl_el = utils.comp2vec(*winds.mean_wind(self, pbot=self.mupcl.lclpres, ptop=self.mupcl.elpres))
         ## parameters that depend on the presence of an effective inflow layer
         if self.etop is ma.masked or self.ebottom is ma.masked:
@@ -707,8 +1080,6 @@ class ConvectiveProfile(BasicProfile):
         self.srw_4_6km = winds.sr_wind(self, pbot=interp.pres(self, interp.to_msl(self, 4000.)), ptop=p6km, stu=self.srwind[0], stv=self.srwind[1])
         self.srw_9_11km = winds.sr_wind(self, pbot=interp.pres(self, interp.to_msl(self, 9000.)), ptop=interp.pres(self, interp.to_msl(self, 11000.)), stu=self.srwind[0], stv=self.srwind[1])
         
-        ## calculate upshear and downshear
-        self.upshear_downshear = winds.mbe_vectors(self)
         self.srh1km = winds.helicity(self, 0, 1000., stu=self.srwind[0], stv=self.srwind[1])
         self.srh3km = winds.helicity(self, 0, 3000., stu=self.srwind[0], stv=self.srwind[1])
 
@@ -736,6 +1107,23 @@ class ConvectiveProfile(BasicProfile):
         ----------
         None
         
+        Returns
+        -------
+        None
+        '''
+        self.get_thermo_indices()
+        self.get_temp_adv()
+
+    def get_thermo_indices(self):
+        '''
+        Function to generate the thermodynamic indices that only depend
+        on the thermodynamic data (all of get_thermo() except the inferred
+        temperature advection).
+
+        Parameters
+        ----------
+        None
+
         Returns
         -------
         None
@@ -767,7 +1155,20 @@ class ConvectiveProfile(BasicProfile):
             ptop=(self.pres[self.sfc] - 350) )
         ## calculate the totals totals index
         self.totals_totals = params.t_totals( self )
-        ## calculate the inferred temperature advection
+
+    def get_temp_adv(self):
+        '''
+        Function to calculate the inferred temperature advection, which
+        depends on both the temperature and the winds.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
         self.inf_temp_adv = params.inferred_temp_adv(self, lat=self.latitude)
 
     def get_severe(self):
@@ -826,14 +1227,14 @@ class ConvectiveProfile(BasicProfile):
         sfc_3km_shear = utils.KTS2MS( utils.mag( self.sfc_3km_shear[0], self.sfc_3km_shear[1]) )
         sfc_9km_shear = utils.KTS2MS( utils.mag( self.sfc_9km_shear[0], self.sfc_9km_shear[1]) )
         h500t = interp.temp(self, 500.)
-        lapse_rate = params.lapse_rate( self, 700., 500., pres=True )
+        lapse_rate = self.lapserate_700_500
         srh3km = self.srh3km[0]
         srh1km = self.srh1km[0]
         mucape = self.mupcl.bplus
         mlcape = self.mlpcl.bplus
         mllcl = self.mlpcl.lclhght
         mumr = thermo.mixratio(self.mupcl.pres, self.mupcl.dwpc)
-        self.ship = params.ship(self)
+        self.ship = params.ship(self, h5_temp=h500t)
 
         self.hail_database = 'sars_hail.txt'
         self.supercell_database = 'sars_supercell.txt'
@@ -922,11 +1323,47 @@ class ConvectiveProfile(BasicProfile):
         -------
         None
         '''
-        self.tei = params.tei(self)
-        self.esp = params.esp(self)
-        self.mmp = params.mmp(self)
-        self.wndg = params.wndg(self)
-        self.sig_severe = params.sig_severe(self)
+        self.get_thermo_composites()
+        self.get_mixed_composites()
+
+    def get_thermo_composites(self):
+        '''
+        Function to calculate DCAPE and the composite indices that only
+        depend on the thermodynamic data (TEI, ESP, and the Microburst
+        Composite).  Requires calling get_parcels() and get_thermo_indices().
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
         self.dcape, self.dpcl_ttrace, self.dpcl_ptrace = params.dcape(self)
         self.drush = thermo.ctof(self.dpcl_ttrace[-1])
-        self.mburst = params.mburst(self)
+
+        ## the parcels, lapse rates, shear, etc. these share are gathered once
+        ctx = params.IndexContext(self)
+        self.tei = params.tei(self, ctx=ctx)
+        self.esp = params.esp(self, ctx=ctx)
+        self.mburst = params.mburst(self, ctx=ctx)
+
+    def get_mixed_composites(self):
+        '''
+        Function to calculate the composite indices that depend on both
+        the thermodynamic data and the winds (MMP, WNDG, and SigSevere).
+        Requires calling get_parcels() and get_kinematics().
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        ctx = params.IndexContext(self)
+        self.mmp = params.mmp(self, ctx=ctx)
+        self.wndg = params.wndg(self, ctx=ctx)
+        self.sig_severe = params.sig_severe(self, ctx=ctx)
@@ -0,0 +1,82 @@
+import gzip
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as npt
+import pytest
+import sharppy.io.decoder as decoder
+from sharppy.io.archive_decoder import ArchiveDecoder, writeArchive, HEADER_DTYPE, VERSION
+from sharppy.io.buf_decoder import BufDecoder
+from sharppy.io.spc_decoder import SPCDecoder
+import test_buf_decoder
+import test_spc_decoder
+
+
+def check_same(prof_coll, orig):
+    assert prof_coll._dates == orig._dates
+    assert prof_coll.getHighlightedMember() == orig.getHighlightedMember()
+    assert sorted(prof_coll._profs) == sorted(orig._profs)
+    for mem in orig._profs:
+        for prof, orig_prof in zip(prof_coll._profs[mem], orig._profs[mem]):
+            for col in [ 'pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd', 'omeg' ]:
+                values, orig_values = getattr(prof, col), getattr(orig_prof, col)
+                if orig_values is None:
+                    assert values is None
+                    continue
+                npt.assert_almost_equal(ma.filled(values, prof.missing), ma.filled(orig_values, orig_prof.missing))
+            assert prof.location == orig_prof.location
+            assert prof.date == orig_prof.date
+            assert prof.latitude == orig_prof.latitude
+
+
+def test_round_trip(tmpdir):
+    orig = BufDecoder(test_buf_decoder.write_bufkit(tmpdir, n_mem=2, n_times=3)).getProfiles()
+    orig.setHighlightedMember('mem1')
+    arc_name = str(tmpdir.join('test.arc'))
+    writeArchive(orig, arc_name)
+
+    dec = ArchiveDecoder(arc_name)
+    check_same(dec.getProfiles(), orig)
+    assert dec.getProfiles().getMeta('base_time') == orig.getMeta('base_time')
+    assert dec.getProfiles().getMeta('loc') == 'KOUN'
+    assert decoder.sniffFormat(arc_name) == 'archive'
+
+
+def test_round_trip_missing(tmpdir):
+    # Masked values are written as the missing value, and raw profiles are read back in
+    orig = SPCDecoder(test_spc_decoder.write_spc(tmpdir)).getProfiles()
+    prof = orig._profs[''][0]
+    prof.wdir, prof.wspd = ma.masked_values(prof.wdir, -9999.), ma.masked_values(prof.wspd, -9999.)
+    arc_name = str(tmpdir.join('test.arc'))
+    writeArchive(orig, arc_name)
+    prof_coll = ArchiveDecoder(arc_name).getProfiles()
+    check_same(prof_coll, orig)
+    npt.assert_array_equal(prof_coll._profs[''][0].wdir == prof_coll._profs[''][0].missing, prof.wdir.mask)
+
+
+def test_round_trip_gzip(tmpdir):
+    orig = BufDecoder(test_buf_decoder.write_bufkit(tmpdir, n_mem=2, n_times=3)).getProfiles()
+    arc_name = str(tmpdir.join('test.arc.gz'))
+    arc_file = gzip.open(arc_name, 'wb')
+    writeArchive(orig, arc_file)
+    arc_file.close()
+
+    assert open(arc_name, 'rb').read(2) == '\x1f\x8b'
+    assert decoder.sniffFormat(arc_name) == 'archive'
+    check_same(decoder.openFile(arc_name).getProfiles(), orig)
+
+
+def test_bad_archive(tmpdir):
+    orig = BufDecoder(test_buf_decoder.write_bufkit(tmpdir, n_mem=1, n_times=1)).getProfiles()
+    arc_name = str(tmpdir.join('test.arc'))
+    writeArchive(orig, arc_name)
+    data = open(arc_name, 'rb').read()
+
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1).copy()
+    header['version'] = VERSION + 1
+    tmpdir.join('newer.arc').write_binary(header.tostring() + data[HEADER_DTYPE.itemsize:])
+    with pytest.raises(IOError):
+        ArchiveDecoder(str(tmpdir.join('newer.arc')))
+
+    tmpdir.join('other.arc').write_binary('NOTANARC' + data[8:])
+    with pytest.raises(IOError):
+        ArchiveDecoder(str(tmpdir.join('other.arc')))
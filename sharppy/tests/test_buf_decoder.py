@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as npt
+from sharppy.io.buf_decoder import BufDecoder
+
+# pres, tmpc, dwpc, wdir, wspd, omeg, hght for each level
+levels = np.array([
+    [ 966.00,  24.20,  19.60, 170.00, 15.00,  0.40,   357.00 ],
+    [ 950.00,  22.80,  18.40, 185.00, 25.00,  0.10,   498.00 ],
+    [ 900.00,  18.60,  15.80, 205.00, 35.00, -0.30,   955.00 ],
+    [ 850.00,  15.20,  11.20, 215.00, 42.00, -1.20,  1432.00 ],
+    [ 700.00,   4.80,  -6.30, 230.00, 50.00,  0.80,  3089.00 ],
+    [ 500.00, -12.90, -31.40, 240.00, 65.00,  1.50,  5790.00 ],
+])
+start = datetime(2015, 5, 1, 0)
+
+
+def member_levels(mem, time):
+    # The values for each member and time are a bit different
+    values = levels.copy()
+    values[:, 1] += mem - time * 0.5
+    values[:, 5] += mem * 0.1
+    return values
+
+
+def bufkit_text(n_mem, n_times, station='KOUN', cfrl=True, ragged=False, shifted=False):
+    members = []
+    for mem in range(n_mem):
+        lines = [ 'mem%d' % mem, '', ' SNPARM = PRES;TMPC;TMWC;DWPC;THTE;DRCT;SKNT;OMEG;CFRL;HGHT', '' ]
+        for time in range(n_times):
+            date = (start + timedelta(hours=time)).strftime('%y%m%d/%H%M')
+            lines += [ ' STID = %s STNM = 723570 TIME = %s' % (station, date),
+                       ' SLAT = 35.23 SLON = -97.47 SELV = 357.0', ' STIM = %d' % time, '',
+                       ' PRES TMPC TMWC DWPC THTE DRCT SKNT OMEG', ' CFRL HGHT' if cfrl else ' HGHT' ]
+            for lev, (pres, tmpc, dwpc, wdir, wspd, omeg, hght) in enumerate(member_levels(mem, time)):
+                first = ' %.2f %.2f %.2f %.2f 300.00 %.2f %.2f %.2f' % (pres, tmpc, tmpc - 1, dwpc, wdir, wspd, omeg)
+                if ragged and lev == 2:
+                    first += ' 1.00'
+                second = ' 50.00 %.2f' % hght if cfrl else ' %.2f' % hght
+                if shifted and lev == 2:
+                    second = ' %.2f' % hght
+                elif shifted and lev == 3:
+                    second += ' 1.00'
+                lines += [ first, second ]
+            lines.append('')
+        lines += [ ' STN YYMMDD/HHMM PMSL PRES SKTC', ' 723570 150519/0000 1000 966 20' ]
+        members.append('\r\n'.join(lines))
+    return '\r\n\r\n\r\n'.join(members) + '\r\n\r\n\r\n'
+
+
+def write_bufkit(tmpdir, name='test.buf', **kwargs):
+    path = tmpdir.join(name)
+    path.write_binary(bufkit_text(**kwargs))
+    return str(path)
+
+
+def check_profiles(prof_coll, n_mem, n_times, station='KOUN'):
+    assert prof_coll._highlight == 'mem0'
+    assert prof_coll._dates == [ start + timedelta(hours=time) for time in range(n_times) ]
+    for mem in range(n_mem):
+        profs = prof_coll._profs['mem%d' % mem]
+        assert len(profs) == n_times
+        for time, prof in enumerate(profs):
+            values = member_levels(mem, time)
+            for col, name in enumerate([ 'pres', 'tmpc', 'dwpc', 'wdir', 'wspd', 'omeg', 'hght' ]):
+                npt.assert_almost_equal(ma.getdata(getattr(prof, name)), values[:, col])
+            assert prof.location == station
+            assert prof.date == start + timedelta(hours=time)
+            assert prof.latitude == 35.23
+
+
+def test_decode_eager(tmpdir):
+    dec = BufDecoder(write_bufkit(tmpdir, n_mem=2, n_times=3))
+    check_profiles(dec.getProfiles(), 2, 3)
+    assert dec.getStnId() == 'KOUN'
+
+
+def count_parsing(monkeypatch):
+    # Counts the profiles that get decoded
+    parsed = []
+    parse_record = BufDecoder._parseRecord
+
+    def counted(self, text, info):
+        parsed.append(text.split('\r\n', 1)[0])
+        return parse_record(self, text, info)
+    monkeypatch.setattr(BufDecoder, '_parseRecord', counted)
+    return parsed
+
+
+def test_decode_stream(tmpdir, monkeypatch):
+    file_name = write_bufkit(tmpdir, n_mem=2, n_times=3)
+    parsed = count_parsing(monkeypatch)
+    prof_coll = BufDecoder(file_name, stream=True).getProfiles()
+    assert len(parsed) == 1
+    check_profiles(prof_coll, 2, 3)
+    assert len(parsed) == 6
+
+    # Only the profiles that get used are decoded, and the most recent ones are kept around
+    del parsed[:]
+    prof_coll = BufDecoder(file_name, stream=True, cache_size=2).getProfiles()
+    profs = prof_coll._profs['mem1']
+    npt.assert_almost_equal(ma.getdata(profs[2].tmpc), member_levels(1, 2)[:, 1])
+    npt.assert_almost_equal(ma.getdata(profs[2].tmpc), member_levels(1, 2)[:, 1])
+    assert len(parsed) == 2
+    [ profs[idx] for idx in [ 1, 0, 2 ] ]
+    assert len(parsed) == 5
+
+    subset = BufDecoder(file_name, stream=True).getProfiles([ 1, 2 ])
+    assert subset._dates == prof_coll._dates[1:]
+    npt.assert_almost_equal(ma.getdata(subset._profs['mem1'][0].tmpc), member_levels(1, 1)[:, 1])
+
+
+def test_decode_no_station(tmpdir):
+    # Some files have a blank where the station name goes
+    prof_coll = BufDecoder(write_bufkit(tmpdir, n_mem=1, n_times=2, station='')).getProfiles()
+    check_profiles(prof_coll, 1, 2, station='')
+
+
+def test_decode_no_cloud_fraction(tmpdir):
+    prof_coll = BufDecoder(write_bufkit(tmpdir, n_mem=1, n_times=2, cfrl=False)).getProfiles()
+    check_profiles(prof_coll, 1, 2)
+
+
+def test_decode_ragged(tmpdir):
+    # A level with an extra value on it goes through the level-by-level fallback
+    prof_coll = BufDecoder(write_bufkit(tmpdir, n_mem=2, n_times=2, ragged=True)).getProfiles()
+    check_profiles(prof_coll, 2, 2)
+
+
+def test_decode_shifted(tmpdir):
+    # A level missing its cloud fraction followed by one with an extra value has the right number of values in all, but
+    #   the levels don't line up, so it goes through the fallback too
+    prof_coll = BufDecoder(write_bufkit(tmpdir, n_mem=2, n_times=2, shifted=True)).getProfiles()
+    check_profiles(prof_coll, 2, 2)
@@ -0,0 +1,93 @@
+import os
+import tarfile
+import tempfile
+import zipfile
+from datetime import datetime
+import sharppy.io.bulk as bulk
+from sharppy.sharptab.prof_collection import ProfCollection
+import test_spc_decoder
+
+# The SPC files to decode, by name, with the hour of the sounding in each
+hours = dict( ('%02d.txt' % hour, hour) for hour in range(0, 24, 3) )
+
+
+def write_files(tmpdir):
+    src = tmpdir.mkdir('src')
+    for name, hour in hours.iteritems():
+        file_name = test_spc_decoder.write_spc(src, name=name)
+        text = open(file_name).read().replace('110524/0000', '110524/%02d00' % hour)
+        open(file_name, 'wb').write(text)
+    return src
+
+
+def check_results(results, paths):
+    assert [ path for path, prof_coll in results ] == paths
+    for path, prof_coll in results:
+        assert isinstance(prof_coll, ProfCollection)
+        assert prof_coll.getCurrentDate() == datetime(2011, 5, 24, hours[os.path.basename(path)])
+
+
+def test_decode_ordered(tmpdir):
+    src = write_files(tmpdir)
+    results = list(bulk.decodeFiles(str(src), processes=2, ordered=True, max_pending=3))
+    check_results(results, [ str(src.join(name)) for name in sorted(hours) ])
+
+    results = list(bulk.decodeFiles(str(src.join('*.txt')), decoder='spc', processes=2, ordered=True))
+    check_results(results, [ str(src.join(name)) for name in sorted(hours) ])
+
+
+def test_decode_unordered(tmpdir):
+    src = write_files(tmpdir)
+    names = [ str(src.join(name)) for name in sorted(hours) ]
+    results = sorted(bulk.decodeFiles(names, processes=2, max_pending=2))
+    check_results(results, names)
+
+
+def test_decode_archives(tmpdir, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir('tmp')))
+    src = write_files(tmpdir)
+
+    tar_name = str(tmpdir.join('soundings.tar.gz'))
+    with tarfile.open(tar_name, 'w:gz') as archive:
+        for name in sorted(hours):
+            archive.add(str(src.join(name)), name)
+    results = list(bulk.decodeFiles(tar_name, processes=2, ordered=True))
+    check_results(results, [ os.path.join(tar_name, name) for name in sorted(hours) ])
+
+    zip_name = str(tmpdir.join('soundings.zip'))
+    with zipfile.ZipFile(zip_name, 'w') as archive:
+        for name in sorted(hours):
+            archive.write(str(src.join(name)), 'snd/' + name)
+    results = sorted(bulk.decodeFiles(zip_name, processes=2))
+    check_results(results, [ os.path.join(zip_name, 'snd', name) for name in sorted(hours) ])
+
+    # The files copied out of the archives are gone
+    assert tmpdir.join('tmp').listdir() == []
+
+
+def test_decode_errors(tmpdir):
+    src = write_files(tmpdir)
+    src.join('junk.txt').write('not a sounding\n')
+    results = dict(bulk.decodeFiles(str(src), processes=2))
+    assert isinstance(results.pop(str(src.join('junk.txt'))), Exception)
+    check_results(sorted(results.items()), [ str(src.join(name)) for name in sorted(hours) ])
+
+    results = list(bulk.decodeFiles([ str(src.join('00.txt')) ], decoder='bufkit', processes=1))
+    assert isinstance(results[0][1], Exception)
+
+
+def test_decode_stopped(tmpdir, monkeypatch):
+    # Stopping early removes the files copied out of the archive that hadn't been decoded yet
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir('tmp')))
+    src = write_files(tmpdir)
+    tar_name = str(tmpdir.join('soundings.tar'))
+    with tarfile.open(tar_name, 'w') as archive:
+        for name in sorted(hours):
+            archive.add(str(src.join(name)), name)
+
+    results = bulk.decodeFiles(tar_name, processes=2, ordered=True, max_pending=4)
+    path, prof_coll = next(results)
+    assert path == os.path.join(tar_name, '00.txt')
+    assert len(tmpdir.join('tmp').listdir()) > 0
+    results.close()
+    assert tmpdir.join('tmp').listdir() == []
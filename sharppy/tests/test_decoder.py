@@ -0,0 +1,203 @@
+import json
+import mmap
+import tempfile
+import urllib
+import sys
+import pytest
+import sharppy.io.decoder as decoder
+from sharppy.io.buf_decoder import BufDecoder
+from sharppy.io.spc_decoder import SPCDecoder
+import test_buf_decoder
+import test_spc_decoder
+
+
+def index_files(tmpdir, monkeypatch, **kwargs):
+    # Save the record index for even small files, and keep the fallback index directory out of the home directory
+    monkeypatch.setattr(decoder, 'INDEX_MIN_SIZE', 0)
+    monkeypatch.setattr(decoder, 'INDEX_DIR', str(tmpdir.join('index')))
+    file_name = test_buf_decoder.write_bufkit(tmpdir, **kwargs)
+    return file_name, file_name + '.idx'
+
+
+def count_indexing(monkeypatch):
+    # Counts the times a BUFKIT file gets scanned for its records
+    calls = []
+    index_records = BufDecoder._indexRecords
+
+    def counted(self, file_data):
+        calls.append(self._file_name)
+        return index_records(self, file_data)
+    monkeypatch.setattr(BufDecoder, '_indexRecords', counted)
+    return calls
+
+
+def test_index_reuse(tmpdir, monkeypatch):
+    file_name, idx_name = index_files(tmpdir, monkeypatch, n_mem=2, n_times=3)
+    calls = count_indexing(monkeypatch)
+
+    BufDecoder(file_name, stream=True)
+    assert len(calls) == 1
+    index = json.loads(open(idx_name).read())
+    assert index['version'] == decoder.INDEX_VERSION
+    assert len(index['records']) == 6
+
+    test_buf_decoder.check_profiles(BufDecoder(file_name, stream=True).getProfiles(), 2, 3)
+    test_buf_decoder.check_profiles(BufDecoder(file_name).getProfiles(), 2, 3)
+    assert len(calls) == 1
+
+
+def test_index_changed_file(tmpdir, monkeypatch):
+    file_name, idx_name = index_files(tmpdir, monkeypatch, n_mem=2, n_times=3)
+    calls = count_indexing(monkeypatch)
+    BufDecoder(file_name)
+
+    test_buf_decoder.write_bufkit(tmpdir, n_mem=1, n_times=4)
+    test_buf_decoder.check_profiles(BufDecoder(file_name, stream=True).getProfiles(), 1, 4)
+    assert len(calls) == 2
+    assert len(json.loads(open(idx_name).read())['records']) == 4
+    BufDecoder(file_name)
+    assert len(calls) == 2
+
+
+def test_index_rejected(tmpdir, monkeypatch):
+    file_name, idx_name = index_files(tmpdir, monkeypatch, n_mem=2, n_times=3)
+    calls = count_indexing(monkeypatch)
+    BufDecoder(file_name)
+    index = json.loads(open(idx_name).read())
+
+    # Sidecars that aren't JSON (e.g. pickles) are never loaded
+    with open(idx_name, 'wb') as idx_file:
+        idx_file.write("cos\nsystem\n(S'exit 1'\ntR.")
+    test_buf_decoder.check_profiles(BufDecoder(file_name, stream=True).getProfiles(), 2, 3)
+    assert len(calls) == 2
+    assert json.loads(open(idx_name).read()) == index
+
+    # Records that point outside the file
+    bad_index = dict(index, records=[ rec[:4] + [ rec[4] + 10 ** 6 ] + rec[5:] for rec in index['records'] ])
+    with open(idx_name, 'wb') as idx_file:
+        json.dump(bad_index, idx_file)
+    test_buf_decoder.check_profiles(BufDecoder(file_name, stream=True).getProfiles(), 2, 3)
+    assert len(calls) == 3
+
+    # Indexes from other versions
+    with open(idx_name, 'wb') as idx_file:
+        json.dump(dict(index, version=decoder.INDEX_VERSION - 1), idx_file)
+    BufDecoder(file_name)
+    assert len(calls) == 4
+
+
+def test_mapped_file(tmpdir):
+    file_name = test_buf_decoder.write_bufkit(tmpdir, n_mem=1, n_times=2)
+    dec = BufDecoder(file_name)
+    file_data = dec._downloadFile(mapped=True)
+    assert isinstance(file_data, mmap.mmap)
+    assert file_data[:] == open(file_name, 'rb').read()
+
+    # The map is copy-on-write, so changing it doesn't change the file
+    file_data[0] = 'X'
+    assert open(file_name, 'rb').read(1) == 'm'
+
+    empty = tmpdir.join('empty.buf')
+    empty.write('')
+    dec._file_name = str(empty)
+    assert dec._downloadFile(mapped=True) == ''
+
+
+def test_mapped_url(tmpdir, monkeypatch):
+    # Files from URLs are read into memory, without going through a temporary file
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir.mkdir('tmp')))
+    file_name = test_buf_decoder.write_bufkit(tmpdir, n_mem=2, n_times=3)
+    url = 'file://' + urllib.pathname2url(file_name)
+    file_data = BufDecoder(url)._downloadFile(mapped=True)
+    assert isinstance(file_data, str)
+    assert file_data == open(file_name, 'rb').read()
+
+    test_buf_decoder.check_profiles(BufDecoder(url).getProfiles(), 2, 3)
+    test_buf_decoder.check_profiles(BufDecoder(url, stream=True).getProfiles(), 2, 3)
+    assert tmpdir.join('tmp').listdir() == []
+
+
+custom_decoder = '''
+from sharppy.io.spc_decoder import SPCDecoder
+
+__fmtname__ = "myfmt"
+__classname__ = "MyDecoder"
+__signature__ = r"\\AMYFMT"
+
+class MyDecoder(SPCDecoder):
+    def _downloadFile(self, mapped=False):
+        return super(MyDecoder, self)._downloadFile(mapped)[len("MYFMT"):]
+'''
+
+
+def find_decoders(tmpdir, monkeypatch):
+    # Look for the custom decoders and keep the registry cache in tmpdir
+    monkeypatch.setattr(decoder, 'HOME_DIR', str(tmpdir.mkdir('decoders')))
+    monkeypatch.setattr(decoder, 'REGISTRY_CACHE', str(tmpdir.join('decoders.cache')))
+    monkeypatch.setattr(decoder, '_decoders', None)
+    monkeypatch.delitem(sys.modules, 'my_decoder', raising=False)
+
+
+def test_sniff_format(tmpdir, monkeypatch):
+    find_decoders(tmpdir, monkeypatch)
+    tmpdir.join('junk.txt').write('not a sounding\n')
+    assert decoder.sniffFormat(test_buf_decoder.write_bufkit(tmpdir, n_mem=1, n_times=1)) == 'bufkit'
+    assert decoder.sniffFormat(test_spc_decoder.write_spc(tmpdir)) == 'spc'
+    assert decoder.sniffFormat(str(tmpdir.join('junk.txt'))) is None
+    assert decoder.sniffFormat(str(tmpdir.join('missing.txt'))) is None
+
+    # The decoders' modules are only imported when they're used
+    assert sorted(decoder.getDecoders()) == [ 'archive', 'bufkit', 'pecan', 'spc' ]
+    assert [ decoder._decoders.sniff(head) for head in [ '%TITLE%\n', ' SNPARM = PRES\r\n', 'TIME = 150501/0000\n' ] ] \
+        == [ [ 'spc' ], [ 'bufkit' ], [ 'pecan' ] ]
+
+
+def test_open_file(tmpdir, monkeypatch):
+    find_decoders(tmpdir, monkeypatch)
+    assert isinstance(decoder.openFile(test_buf_decoder.write_bufkit(tmpdir, n_mem=1, n_times=2)), BufDecoder)
+
+    dec = decoder.openFile(test_spc_decoder.write_spc(tmpdir, name='test.buf'))
+    assert isinstance(dec, SPCDecoder)
+    test_spc_decoder.check_profile(dec.getProfiles())
+
+    tmpdir.join('junk.txt').write('not a sounding\n')
+    with pytest.raises(IOError):
+        decoder.openFile(str(tmpdir.join('junk.txt')))
+
+
+def test_custom_decoder(tmpdir, monkeypatch):
+    find_decoders(tmpdir, monkeypatch)
+    tmpdir.join('decoders', 'my_decoder.py').write(custom_decoder)
+    file_name = test_spc_decoder.write_spc(tmpdir)
+    tmpdir.join('test.my').write('MYFMT' + open(file_name).read())
+
+    assert decoder.sniffFormat(str(tmpdir.join('test.my'))) == 'myfmt'
+    assert 'my_decoder' not in sys.modules
+    dec = decoder.openFile(str(tmpdir.join('test.my')))
+    assert type(dec).__name__ == 'MyDecoder'
+    test_spc_decoder.check_profile(dec.getProfiles())
+
+    # The next time, the decoders come out of the cache without reading the modules
+    cache = json.loads(tmpdir.join('decoders.cache').read())
+    assert cache['version'] == decoder.REGISTRY_VERSION
+    read = []
+    read_metadata = decoder._readMetadata
+    monkeypatch.setattr(decoder, '_readMetadata', lambda dec_file: read.append(dec_file) or read_metadata(dec_file))
+    monkeypatch.setattr(decoder, '_decoders', None)
+    assert 'myfmt' in decoder.getDecoders()
+    assert read == []
+
+    # A cache entry can't point at a module somewhere else
+    entries = cache['dirs'][decoder.HOME_DIR]['entries']
+    entries[0][-1] = str(tmpdir.join('other.py'))
+    tmpdir.join('decoders.cache').write(json.dumps(cache))
+    monkeypatch.setattr(decoder, '_decoders', None)
+    decoder.findDecoders()
+    assert read == [ str(tmpdir.join('decoders', 'my_decoder.py')) ]
+    assert decoder._decoders._entries['myfmt'][-1] == str(tmpdir.join('decoders', 'my_decoder.py'))
+
+    # Neither can a cache that isn't JSON
+    tmpdir.join('decoders.cache').write("cos\nsystem\n(S'exit 1'\ntR.")
+    monkeypatch.setattr(decoder, '_decoders', None)
+    assert 'myfmt' in decoder.getDecoders()
+    assert len(read) == 6
@@ -132,4 +132,13 @@ def test_to_msl():
     npt.assert_almost_equal(returned_agl, correct_agl)
 
 
-
+def test_generic_interp_pres_stack():
+    input_p = np.log10([[1050., 900., 500., 50.], [950., 700., 300., 200.]])
+    logp = np.log10(prof.pres[::-1])
+    pres = [ logp, logp[5:] ]
+    fields = [ prof.tmpc[::-1], prof.tmpc[::-1][5:] ]
+    returned_t = interp.generic_interp_pres_stack(input_p, pres, fields)
+    for i in range(len(pres)):
+        correct_t = interp.generic_interp_pres(input_p[i], pres[i], fields[i])
+        npt.assert_equal(ma.getmaskarray(returned_t[i]), ma.getmaskarray(correct_t))
+        npt.assert_almost_equal(returned_t[i].compressed(), correct_t.compressed())
@@ -0,0 +1,64 @@
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as npt
+import sharppy.sharptab.params as params
+import sharppy.sharptab.winds as winds
+from sharppy.sharptab.profile import BasicProfile
+import test_profile
+
+
+prof = BasicProfile(pres=test_profile.pres, hght=test_profile.hght,
+                    tmpc=test_profile.tmpc, dwpc=test_profile.dwpc,
+                    wdir=test_profile.wdir, wspd=test_profile.wspd)
+
+
+def test_layer_mean_wind():
+    pbots = np.array([950., 850., 700.])
+    ptops = np.array([850., 700., 500.])
+    u, v = params._layer_mean_wind(prof, pbots, ptops)
+    for i in range(len(pbots)):
+        correct_u, correct_v = winds.mean_wind(prof, pbot=pbots[i], ptop=ptops[i])
+        npt.assert_almost_equal([u[i], v[i]], [correct_u, correct_v])
+
+
+def test_inferred_temp_adv_bounds():
+    pbounds = np.array([900., 700., 500., 300.])
+    temp_adv, bounds = params.inferred_temp_adv(prof, lat=35, pbounds=pbounds)
+    npt.assert_equal(temp_adv.shape, (3,))
+    npt.assert_almost_equal(bounds, [[900., 700.], [700., 500.], [500., 300.]])
+
+
+def test_inferred_temp_adv_series():
+    pbounds = np.arange(1000., 99., -100.)
+    temp_adv, bounds = params.inferred_temp_adv_series([prof, prof], lat=35, pbounds=pbounds)
+    correct = params.inferred_temp_adv(prof, lat=35, pbounds=pbounds)[0]
+    npt.assert_equal(temp_adv.shape, (2, len(pbounds) - 1))
+    npt.assert_almost_equal(temp_adv[1], correct)
+    # The 1000 mb level is below the surface of the test profile
+    assert temp_adv[0, 0] is ma.masked
+
+
+def test_index_context_from_profile():
+    pcl = params.Parcel(bplus=1000.)
+    ctx = params.IndexContext(prof, mupcl=pcl)
+    assert ctx.mupcl is pcl
+    npt.assert_almost_equal(ctx.lr75, params.lapse_rate(prof, 700., 500., pres=True))
+    # Ingredients are only computed once
+    assert ctx.mlpcl is ctx.mlpcl
+
+
+def test_composite_indices():
+    ctx = params.IndexContext(prof).precompute()
+    indices = params.composite_indices(prof, ctx=ctx)
+    npt.assert_equal(sorted(indices.keys()), sorted(params.COMPOSITE_INDICES))
+    npt.assert_almost_equal(indices['sig_severe'], params.sig_severe(prof))
+    npt.assert_almost_equal(indices['sweat'], params.sweat(prof))
+
+
+def test_sherb_ctx_overrides():
+    ctx = params.IndexContext(prof).precompute()
+    ebottom, etop = 900., 750.
+    correct = params.sherb(prof, effective=True, ebottom=ebottom, etop=etop)
+    npt.assert_almost_equal(params.sherb(prof, effective=True, ebottom=ebottom, etop=etop, ctx=ctx), correct)
+    # The context itself isn't changed
+    assert ctx.ebottom != ebottom
@@ -0,0 +1,88 @@
+import warnings
+from datetime import datetime, timedelta
+import numpy.ma as ma
+import numpy.testing as npt
+import pytest
+from sharppy.io.pecan_decoder import PECANDecoder
+from test_buf_decoder import member_levels, start
+
+
+def section_text(mem, time):
+    date = (start + timedelta(hours=time)).strftime('%y%m%d/%H%M')
+    lines = [ 'MEMBER = mem%d' % mem, 'TIME = %s' % date, 'STID = OUN SLAT = 35.2 SLON = -97.4', 'STNM = 72357', '',
+              'PRES, HGHT, TMPC, DWPC, DRCT, SKNT, OMEG' ]
+    for pres, tmpc, dwpc, wdir, wspd, omeg, hght in member_levels(mem, time):
+        lines.append('%.2f, %.2f, %.2f, %.2f, %.2f, %.2f, %.3f' % (pres, hght, tmpc, dwpc, wdir, wspd, omeg))
+    return lines
+
+
+def write_pecan(tmpdir, sections):
+    path = tmpdir.join('test.pecan')
+    path.write_binary('\n\n\n'.join( '\n'.join(lines) for lines in sections ) + '\n')
+    return str(path)
+
+
+def all_sections(n_mem, n_times):
+    return [ section_text(mem, time) for mem in range(n_mem) for time in range(n_times) ]
+
+
+def decode(file_name, **kwargs):
+    with warnings.catch_warnings(record=True) as warns:
+        warnings.simplefilter('always')
+        dec = PECANDecoder(file_name, **kwargs)
+    return dec, [ str(warn.message) for warn in warns if 'Skipping' in str(warn.message) ]
+
+
+def check_profiles(prof_coll, times):
+    # times is the list of the times each member has
+    for mem, mem_times in enumerate(times):
+        profs = prof_coll._profs['mem%d' % mem]
+        assert len(profs) == len(mem_times)
+        for prof, time in zip(profs, mem_times):
+            values = member_levels(mem, time)
+            for col, name in enumerate([ 'pres', 'tmpc', 'dwpc', 'wdir', 'wspd', 'omeg', 'hght' ]):
+                npt.assert_almost_equal(ma.getdata(getattr(prof, name)), values[:, col])
+            assert prof.location == 'OUN'
+            assert prof.date == start + timedelta(hours=time)
+
+
+def test_decode(tmpdir):
+    file_name = write_pecan(tmpdir, all_sections(2, 3))
+    for stream in [ False, True ]:
+        dec, warns = decode(file_name, stream=stream)
+        check_profiles(dec.getProfiles(), [ range(3), range(3) ])
+        assert dec.getProfiles()._dates == [ start + timedelta(hours=time) for time in range(3) ]
+        assert dec.getMalformedSections() == []
+        assert warns == []
+
+
+def test_decode_uneven_members(tmpdir):
+    # Members with different numbers of times can't go into one array
+    sections = all_sections(2, 3)
+    dec, warns = decode(write_pecan(tmpdir, sections[:5]))
+    check_profiles(dec.getProfiles(), [ range(3), range(2) ])
+
+
+def test_malformed_sections(tmpdir):
+    sections = all_sections(2, 3)
+    sections[1] = [ 'garbage', 'more garbage' ]
+
+    # A short line followed by a long one has the right number of values in all, but the rows don't line up
+    sections[3][8] = sections[3][8].rsplit(',', 1)[0]
+    sections[3][9] = sections[3][9] + ', 0.500'
+
+    sections[5][7] = sections[5][7].replace(',', ' x,', 1)
+    file_name = write_pecan(tmpdir, sections)
+    dec, warns = decode(file_name)
+
+    malformed = dec.getMalformedSections()
+    assert [ (sec_num, line_num) for sec_num, line_num, reason in malformed ] == [ (1, 15), (3, 33), (5, 61) ]
+    assert "can't read the header" in malformed[0][2]
+    assert all( "comma-separated numbers on every line" in reason for sec_num, line_num, reason in malformed[1:] )
+    assert len(warns) == 3
+    check_profiles(dec.getProfiles(), [ [ 0, 2 ], [ 1 ] ])
+
+
+def test_nothing_decoded(tmpdir):
+    with pytest.raises(IOError):
+        decode(write_pecan(tmpdir, [ [ 'garbage' ] ]))
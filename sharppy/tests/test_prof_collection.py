@@ -0,0 +1,484 @@
+import time
+import tempfile
+import threading
+from datetime import datetime
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as npt
+import pytest
+from sharppy.sharptab.profile import Profile, BasicProfile, ConvectiveProfile
+import sharppy.sharptab.interp as interp
+import sharppy.sharptab.prof_collection as prof_collection
+import sharppy.sharptab.prof_block as prof_block
+from sharppy.sharptab.prof_collection import ProfCollection, doCopy
+from sharppy.sharptab.prof_block import ProfBlock
+from sharppy.sharptab.prof_array import LazyProfs, ProfCache
+import test_profile
+
+
+def prof_kwargs():
+    return dict(pres=test_profile.pres, hght=test_profile.hght, tmpc=test_profile.tmpc,
+                dwpc=test_profile.dwpc, wdir=test_profile.wdir, wspd=test_profile.wspd)
+
+
+def make_collection():
+    prof = ConvectiveProfile(location='TEST', date=datetime(2000, 1, 1, 0), **prof_kwargs())
+    return ProfCollection({'': [prof]}, [prof.date])
+
+
+def recompute(prof):
+    return ConvectiveProfile(pres=prof.pres, hght=prof.hght, tmpc=prof.tmpc,
+                             dwpc=prof.dwpc, u=prof.u, v=prof.v, location=prof.location,
+                             date=prof.date)
+
+
+class ThreadAsync(object):
+    # Stands in for AsyncThreads, running each posted function in a plain thread
+    def __init__(self):
+        self.threads = []
+
+    def post(self, func, callback, *args):
+        thd = threading.Thread(target=func, args=args)
+        thd.start()
+        self.threads.append(thd)
+
+    def join(self, timeout):
+        for thd in self.threads:
+            thd.join(timeout)
+        return not any( thd.is_alive() for thd in self.threads )
+
+
+class BrokenPool(object):
+    # A worker pool that can't take any work
+    def apply_async(self, func, args, callback=None):
+        raise RuntimeError("The pool is broken")
+
+
+class StuckPool(object):
+    # A worker pool that never sends anything back (as if the workers were killed)
+    class Result(object):
+        def ready(self):
+            return False
+
+    def apply_async(self, func, args, callback=None):
+        return StuckPool.Result()
+
+
+def assert_same_indices(prof, correct):
+    for attr in ['mupcl', 'sfcpcl', 'mlpcl', 'effpcl']:
+        for field in ['bplus', 'bminus', 'lclhght', 'elhght', 'brnshear']:
+            npt.assert_equal(ma.filled(getattr(getattr(prof, attr), field), np.nan),
+                             ma.filled(getattr(getattr(correct, attr), field), np.nan))
+    for attr in ['srw_1km', 'sfc_6km_shear', 'srwind', 'right_esrh', 'ebwd',
+                 'stp_cin', 'right_scp', 'ship', 'lapserate_700_500', 'pwat']:
+        npt.assert_equal(ma.filled(np.asarray(getattr(prof, attr), dtype=float), np.nan),
+                         ma.filled(np.asarray(getattr(correct, attr), dtype=float), np.nan))
+
+
+def test_modify_wind_reuses_thermo():
+    prof_coll = make_collection()
+    orig = prof_coll.getHighlightedProf()
+    idx = orig.sfc + 2
+    prof_coll.modify(idx, u=orig.u[idx] + 10., v=orig.v[idx] - 5.)
+    prof = prof_coll.getHighlightedProf()
+
+    assert prof.mupcl is not orig.mupcl
+    assert prof.lapserate_700_500 == orig.lapserate_700_500
+    assert_same_indices(prof, recompute(prof))
+
+
+def test_modify_thermo_reuses_wind():
+    prof_coll = make_collection()
+    orig = prof_coll.getHighlightedProf()
+    idx = orig.sfc + 2
+    prof_coll.modify(idx, tmpc=orig.tmpc[idx] + 2.)
+    prof = prof_coll.getHighlightedProf()
+
+    assert prof.u is orig.u
+    assert prof.sfc_6km_shear is orig.sfc_6km_shear
+    assert_same_indices(prof, recompute(prof))
+
+
+def test_reset_modification():
+    prof_coll = make_collection()
+    orig = prof_coll.getHighlightedProf()
+    idx = orig.sfc + 2
+    prof_coll.modify(idx, tmpc=orig.tmpc[idx] + 2.)
+    prof_coll.modify(idx, tmpc=orig.tmpc[idx] + 4.)
+    prof_coll.modify(idx + 1, u=orig.u[idx + 1] + 10., v=orig.v[idx + 1])
+
+    # Only the original values at the modified levels are kept
+    assert prof_coll._mod_diffs[0]['tmpc'] == {idx:orig.tmpc[idx]}
+    assert sorted(prof_coll._mod_diffs[0].keys()) == ['tmpc', 'u', 'v', 'wdir', 'wspd']
+    # The unmodified columns are shared with the original profile
+    prof = prof_coll.getHighlightedProf()
+    assert prof.dwpc is orig.dwpc
+    assert prof.hght is orig.hght
+
+    prof_coll.resetModification('tmpc', 'dwpc')
+    prof_coll.resetModification('u', 'v')
+    prof = prof_coll.getHighlightedProf()
+    assert not prof_coll.isModified()
+    assert 0 not in prof_coll._mod_diffs
+    for col in ['tmpc', 'dwpc', 'u', 'v', 'wspd', 'wdir']:
+        npt.assert_equal(getattr(prof, col), getattr(orig, col))
+
+
+def test_reinterp_keeps_modification():
+    prof_coll = make_collection()
+    orig = prof_coll.getHighlightedProf()
+    prof_coll.interp(dp=-25)
+    first = prof_coll.getHighlightedProf()
+    idx = first.sfc + 2
+    prof_coll.modify(idx, tmpc=first.tmpc[idx] + 5.)
+
+    # The modification is moved onto the new levels when interpolating again
+    prof_coll.interp(dp=-10)
+    prof = prof_coll.getHighlightedProf()
+    unmod = prof_coll._interpProf(first, -10)
+    assert prof_coll.isModified()
+    assert sorted(prof_coll._mod_diffs[0].keys()) == ['tmpc']
+    assert np.any(prof.tmpc != unmod.tmpc)
+
+    prof_coll.resetModification('tmpc')
+    npt.assert_almost_equal(prof_coll.getHighlightedProf().tmpc, unmod.tmpc)
+    assert not prof_coll.isModified()
+
+    prof_coll.resetInterpolation()
+    npt.assert_equal(prof_coll.getHighlightedProf().tmpc, orig.tmpc)
+
+
+def test_copy_order():
+    raw = Profile(**prof_kwargs())
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(10) ]
+    prof_coll = ProfCollection({'a':[ raw ] * 10, 'b':[ raw ] * 10}, dates)
+    prof_coll.setHighlightedMember('a')
+    prof_coll.setCurrentDate(dates[6])
+    prof_coll.advanceTime(-1)
+
+    order = prof_coll._copyOrder()
+    # The current time first, then the times ahead in the direction of travel
+    assert order[:3] == [('a', 5), ('a', 4), ('a', 3)]
+    assert order.index(('b', 5)) < order.index(('a', 0))
+    assert ('b', 4) not in order
+    assert len(order) == 11
+
+    # Converting all the members adds the rest of the other members' times at the end, nearest first
+    prof_coll.setCopyMode(all_members=True)
+    order = prof_coll._copyOrder()
+    assert len(order) == 20
+    assert order[11:13] == [('b', 4), ('b', 3)]
+
+
+def test_copy_order_lazy():
+    loaded = []
+    def loader(member, idx):
+        loaded.append((member, idx))
+        return Profile(date=datetime(2000, 1, 1, idx), **prof_kwargs())
+
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(10) ]
+    cache = ProfCache(4)
+    profs = dict( (mem, LazyProfs(loader, mem, len(dates), cache)) for mem in [ 'a', 'b' ] )
+    prof_coll = ProfCollection(profs, dates)
+    prof_coll.setHighlightedMember('a')
+    prof_coll.setCopyMode(all_members=True)
+    prof_coll._profs['a'][3] = ConvectiveProfile(date=dates[3], **prof_kwargs())
+
+    # Working out what's left to convert doesn't decode anything
+    order = prof_coll._copyOrder()
+    assert len(order) == 19
+    assert ('a', 3) not in order
+    assert loaded == []
+
+
+def test_shared_copy():
+    raw = Profile(location='TEST', date=datetime(2000, 1, 1, 0), **prof_kwargs())
+    block = ProfBlock({0:raw})
+    try:
+        (prof, col_info), key = doCopy(ConvectiveProfile, block.getProf(0, raw), 0)
+        assert 'tmpc' not in prof.__dict__
+        prof = block.getProf(0, raw).restore(prof, col_info)
+    finally:
+        block.close()
+
+    full = ConvectiveProfile.copy(raw)
+    for col in ['pres', 'tmpc', 'dwpc', 'u', 'wspd', 'logp', 'thetae']:
+        npt.assert_equal(getattr(prof, col), getattr(full, col))
+    assert_same_indices(prof, full)
+
+
+def test_shared_copy_kwargs():
+    # Going through shared memory builds the profile the same way as Profile.copy()
+    raw = Profile(location='TEST', date=datetime(2000, 1, 1, 0), missing=-999., **prof_kwargs())
+    block = ProfBlock({0:raw})
+    try:
+        (prof, col_info), key = doCopy(BasicProfile, block.getProf(0, raw), 0)
+    finally:
+        block.close()
+
+    full = BasicProfile.copy(raw)
+    for attr in ['missing', 'location', 'date', 'latitude']:
+        assert repr(getattr(prof, attr)) == repr(getattr(full, attr))
+
+
+def test_blocks_removed(tmpdir, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(3) ]
+    prof_coll = ProfCollection({'':[ Profile(**prof_kwargs()) for date in dates ]}, dates)
+
+    # A conversion that raises still deletes its blocks
+    monkeypatch.setattr(prof_collection, 'getCopyPool', lambda: BrokenPool())
+    prof_coll._copy_queue = prof_coll._copyOrder()
+    with pytest.raises(RuntimeError):
+        prof_coll._backgroundCopy(prof_coll._copy_gen)
+    assert tmpdir.listdir() == []
+
+    # Blocks that are never closed are deleted when the program exits
+    ProfBlock({0:prof_coll._profs[''][0]})
+    assert len(tmpdir.listdir()) == 1
+    prof_block._removeFiles()
+    assert tmpdir.listdir() == []
+    assert prof_block._open_files == set()
+
+
+def test_block_size():
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(3) ]
+    prof_coll = ProfCollection({'':[ Profile(**prof_kwargs()) for date in dates ]}, dates)
+    prof_coll._copy_queue = prof_coll._copyOrder()
+    block = prof_coll._makeCopyBlock(('', 0))
+    assert sorted(block.layout) == [ ('', 0), ('', 1), ('', 2) ]
+    block.close()
+
+    # The limit is on each block, and a block always holds at least one profile
+    prof_coll.setCopyMode(max_block_size=1)
+    block = prof_coll._makeCopyBlock(('', 1))
+    assert sorted(block.layout) == [ ('', 1) ]
+    block.close()
+
+
+def test_background_copy(monkeypatch):
+    pool = ThreadPool(2)
+    monkeypatch.setattr(prof_collection, 'getCopyPool', lambda: pool)
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(3) ]
+    prof_coll = ProfCollection({'':[ Profile(**prof_kwargs()) for date in dates ]}, dates)
+    progress = []
+    prof_coll.setCopyMode(max_pending=1, progress=lambda n_done, n_total: progress.append(n_done))
+
+    async = ThreadAsync()
+    try:
+        prof_coll.setAsync(async)
+        assert async.join(30.)
+    finally:
+        pool.close()
+    assert all( type(prof) == ConvectiveProfile for prof in prof_coll._profs[''] )
+    assert progress == [ 1, 2, 3 ]
+
+
+def test_cancel_stuck_copy(monkeypatch):
+    monkeypatch.setattr(prof_collection, 'getCopyPool', lambda: StuckPool())
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(3) ]
+    prof_coll = ProfCollection({'':[ Profile(**prof_kwargs()) for date in dates ]}, dates)
+
+    async = ThreadAsync()
+    prof_coll.setAsync(async)
+    time.sleep(2 * prof_collection.POLL_TIME)
+    prof_coll.cancelCopy()
+
+    # The background thread stops on its own, without holding on to the lock
+    assert async.join(10 * prof_collection.POLL_TIME)
+    assert prof_coll._copy_lock.acquire(False)
+    prof_coll._copy_lock.release()
+    assert not prof_coll._copying
+
+
+def test_convert_lost_worker(monkeypatch):
+    # Waiting on a conversion gives up on profiles that never come back, instead of hanging
+    monkeypatch.setattr(prof_collection, 'getCopyPool', lambda: StuckPool())
+    monkeypatch.setattr(prof_collection, 'CONVERT_TIMEOUT', 2 * prof_collection.POLL_TIME)
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(3) ]
+    prof_coll = ProfCollection({'':[ Profile(**prof_kwargs()) for date in dates ]}, dates)
+    with pytest.raises(RuntimeError):
+        prof_coll.getIndexArray('mlcape')
+    assert all( type(prof) == Profile for prof in prof_coll._profs[''] )
+
+
+def test_pack():
+    kwargs = prof_kwargs()
+    short = dict( (k, v[:-5]) for k, v in kwargs.iteritems() )
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(2) ]
+    prof_coll = ProfCollection({'a':[ Profile(**kwargs), Profile(**short) ],
+                                'b':[ Profile(**short), Profile(**kwargs) ]}, dates)
+    prof_coll.pack()
+
+    prof_array = prof_coll.getArray()
+    assert prof_array.data['tmpc'].shape == (2, 2, len(test_profile.pres))
+    # The shorter profiles are padded with masked values
+    assert prof_array.data['tmpc'][0, 1, -5:].mask.all()
+
+    # The profiles are views of the arrays
+    prof = prof_coll._profs['b'][0]
+    assert prof is prof_coll._profs['b'][0]
+    assert len(prof.pres) == len(test_profile.pres) - 5
+    assert np.may_share_memory(prof.tmpc, prof_array.data['tmpc'])
+    npt.assert_equal(prof.tmpc, short['tmpc'])
+
+    prof_coll.setHighlightedMember('b')
+    prof = prof_coll.getHighlightedProf()
+    assert type(prof_coll._profs['b'][0]) == ConvectiveProfile
+    assert_same_indices(prof, ConvectiveProfile(**short))
+
+
+def test_ensemble_stats():
+    kwargs = prof_kwargs()
+    tmpc, dwpc = np.asarray(test_profile.tmpc), np.asarray(test_profile.dwpc)
+    warm = dict(kwargs, tmpc=np.where(tmpc > -9999., tmpc + 2., tmpc), dwpc=np.where(dwpc > -9999., dwpc + 1., dwpc))
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(2) ]
+    prof_coll = ProfCollection({'a':[ Profile(**kwargs), Profile(**warm) ],
+                                'b':[ Profile(**warm), Profile(**warm) ]}, dates)
+
+    cape = prof_coll.getIndexArray('mlcape')
+    correct = [ ConvectiveProfile(**kwargs).mlpcl.bplus, ConvectiveProfile(**warm).mlpcl.bplus ]
+    npt.assert_almost_equal(cape, [ [ correct[0], correct[1] ], [ correct[1], correct[1] ] ])
+
+    stats = prof_coll.getEnsembleStats('mlcape', percentiles=(50,), thresholds=(correct[0],))
+    npt.assert_almost_equal(stats['mean'], [ (correct[0] + correct[1]) / 2., correct[1] ])
+    npt.assert_almost_equal(stats['percentiles'][50], stats['median'])
+    npt.assert_almost_equal(stats['prob'][correct[0]], [ 0.5, 1. ])
+    assert prof_coll.getEnsembleStats('mlcape', percentiles=(50,), thresholds=(correct[0],)) is stats
+
+    # Changing a profile only recomputes its value, and throws out the cached statistics
+    prof_coll._profs['b'][1] = ConvectiveProfile(**kwargs)
+    npt.assert_almost_equal(prof_coll.getIndexArray('mlcape')[1, 1], correct[0])
+    assert prof_coll.getEnsembleStats('mlcape', percentiles=(50,), thresholds=(correct[0],)) is not stats
+
+
+def test_index_series():
+    kwargs = prof_kwargs()
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(2) ]
+    prof_coll = ProfCollection({'':[ Profile(**kwargs), Profile(**kwargs) ]}, dates)
+    prof_coll.pack()
+    correct = ConvectiveProfile(**kwargs)
+
+    series_dates, series = prof_coll.getIndexSeries(['mlcape', 'pwat'])
+    assert series_dates == dates
+    npt.assert_almost_equal(series['mlcape'], [ correct.mlpcl.bplus ] * 2)
+    npt.assert_almost_equal(series['pwat'], [ correct.pwat ] * 2)
+
+    # New times are added on to the cached series
+    new_date = datetime(2000, 1, 1, 2)
+    prof_coll.addTimes({'':[ Profile(**kwargs) ]}, [ new_date ])
+    cached = prof_coll._index_cache['mlcape']['']
+    series_dates, series = prof_coll.getIndexSeries(['mlcape'])
+    assert series_dates == dates + [ new_date ]
+    npt.assert_almost_equal(series['mlcape'], [ correct.mlpcl.bplus ] * 3)
+    assert prof_coll._index_cache['mlcape'][''][1][0] is cached[1][0]
+
+
+def test_concurrent_stages():
+    kwargs = prof_kwargs()
+    serial = ConvectiveProfile(**kwargs)
+
+    # In a process pool, each stage runs on a pickled copy of the profile and only its results come back
+    for pool in [ ThreadPool(4), Pool(2) ]:
+        try:
+            concurrent = ConvectiveProfile(executor=pool, **kwargs)
+        finally:
+            pool.close()
+            pool.join()
+
+        assert sorted(concurrent.__dict__.keys()) == sorted(serial.__dict__.keys())
+        assert_same_indices(concurrent, serial)
+        assert concurrent.watch_type == serial.watch_type
+        npt.assert_equal(concurrent.srh3km, serial.srh3km)
+        npt.assert_equal(concurrent.slinky_traj, serial.slinky_traj)
+
+
+def test_regrid():
+    kwargs = prof_kwargs()
+    short = dict( (k, v[:-5]) for k, v in kwargs.iteritems() )
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(2) ]
+    prof_coll = ProfCollection({'a':[ Profile(**kwargs), Profile(**short) ],
+                                'b':[ Profile(**short), Profile(**kwargs) ]}, dates)
+    prof_coll.pack()
+
+    levels = np.arange(1000., 100., -50.)
+    regridded = prof_coll.regrid(levels)
+    assert regridded.getArray().data['tmpc'].shape == (2, 2, len(levels))
+
+    # Same as interpolating the profiles one at a time
+    for mem in [ 'a', 'b' ]:
+        for idx in range(2):
+            prof = BasicProfile.copy(prof_coll._profs[mem][idx])
+            new_prof = regridded._profs[mem][idx]
+            valid = (levels <= prof.pres.max()) & (levels >= prof.pres.min())
+            npt.assert_almost_equal(new_prof.pres, levels[valid])
+            npt.assert_almost_equal(new_prof.tmpc, interp.temp(prof, levels[valid]))
+            npt.assert_almost_equal(new_prof.hght, interp.hght(prof, levels[valid]))
+            npt.assert_almost_equal(new_prof.u, interp.components(prof, levels[valid])[0])
+
+    heights = np.arange(1000., 10000., 500.)
+    regridded = prof_coll.regrid(heights, coord='hght')
+    prof = BasicProfile.copy(prof_coll._profs['a'][0])
+    npt.assert_almost_equal(regridded._profs['a'][0].pres, interp.pres(prof, heights))
+
+
+def test_at_time():
+    valid = test_profile.tmpc != -9999
+    kwargs = prof_kwargs()
+    warm_kwargs = dict(kwargs, tmpc=np.where(valid, test_profile.tmpc + 2., test_profile.tmpc))
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(0, 6, 3) ]
+    prof_coll = ProfCollection({'':[ Profile(**kwargs), Profile(**warm_kwargs) ]}, dates)
+
+    # Halfway between the two times
+    prof = prof_coll.atTime(datetime(2000, 1, 1, 1, 30))
+    correct = ConvectiveProfile(**dict(kwargs, tmpc=np.where(valid, test_profile.tmpc + 1., test_profile.tmpc)))
+    assert type(prof) == ConvectiveProfile
+    assert prof.date == datetime(2000, 1, 1, 1, 30)
+    npt.assert_almost_equal(prof.tmpc, correct.tmpc)
+    npt.assert_almost_equal(prof.pres, correct.pres)
+    npt.assert_almost_equal(prof.wspd, correct.wspd)
+    for attr in [ 'sfcpcl', 'mlpcl', 'mupcl' ]:
+        npt.assert_almost_equal(getattr(prof, attr).bplus, getattr(correct, attr).bplus, decimal=5)
+
+    # Interpolated profiles are cached, and the times in the collection come back as they are
+    profs = prof_coll.atTime([ datetime(2000, 1, 1, 1, 30), datetime(2000, 1, 1, 2), dates[1] ])
+    assert profs[0] is prof
+    npt.assert_almost_equal(profs[1].tmpc[valid], test_profile.tmpc[valid] + 4. / 3.)
+    assert profs[2] is prof_coll._profs[''][1]
+
+    try:
+        prof_coll.atTime(datetime(2000, 1, 1, 6))
+    except ValueError:
+        pass
+    else:
+        assert False, "Time outside the collection should raise a ValueError"
+
+
+def test_lazy_profs():
+    kwargs = prof_kwargs()
+    loaded = []
+    def loader(member, idx):
+        loaded.append((member, idx))
+        return Profile(date=datetime(2000, 1, 1, idx), **kwargs)
+
+    cache = ProfCache(2)
+    dates = [ datetime(2000, 1, 1, hr) for hr in range(4) ]
+    profs = dict( (mem, LazyProfs(loader, mem, len(dates), cache)) for mem in [ 'a', 'b' ] )
+    prof_coll = ProfCollection(profs, dates)
+    assert loaded == []
+
+    # Profiles are only decoded once while they're in the cache
+    prof = prof_coll._profs['a'][0]
+    assert prof_coll._profs['a'][0] is prof
+    assert prof.date == dates[0]
+    assert loaded == [ ('a', 0) ]
+
+    # Dropped profiles are decoded again, unless they're still being used
+    for idx in range(1, 4):
+        prof_coll._profs['b'][idx]
+    assert len(cache) == 2
+    assert prof_coll._profs['a'][0] is prof
+    prof_coll._profs['b'][1]
+    assert loaded.count(('b', 1)) == 2
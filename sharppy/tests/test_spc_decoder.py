@@ -0,0 +1,72 @@
+from datetime import datetime
+from StringIO import StringIO
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as npt
+import pytest
+from sharppy.io.spc_decoder import SPCDecoder
+import test_profile
+
+columns = np.genfromtxt(StringIO(test_profile.sounding), delimiter=',', unpack=True)
+
+
+def write_spc(tmpdir, data=test_profile.sounding, name='test.txt'):
+    path = tmpdir.join(name)
+    path.write_binary('%TITLE%\n OUN   110524/0000\n\n'
+                      '   LEVEL       HGHT       TEMP       DWPT       WDIR       WSPD\n'
+                      '-------------------------------------------------------------------\n'
+                      '%RAW%\n' + data.strip('\n') + '\n%END%\n')
+    return str(path)
+
+
+def count_fallback(monkeypatch):
+    # Counts the times the data go through genfromtxt instead of the bulk parse
+    calls = []
+    genfromtxt = np.genfromtxt
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return genfromtxt(*args, **kwargs)
+    monkeypatch.setattr(np, 'genfromtxt', counted)
+    return calls
+
+
+def check_profile(prof_coll, values=columns):
+    prof = prof_coll._profs[''][0]
+    for col, name in enumerate([ 'pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd' ]):
+        npt.assert_almost_equal(ma.filled(getattr(prof, name), -9999.), values[col])
+    assert prof.location == 'OUN'
+    assert prof.date == datetime(2011, 5, 24, 0)
+    assert prof_coll.getMeta('observed')
+
+
+def test_decode_fast(tmpdir, monkeypatch):
+    calls = count_fallback(monkeypatch)
+    check_profile(SPCDecoder(write_spc(tmpdir)).getProfiles())
+    assert calls == []
+
+
+def test_decode_fallback(tmpdir, monkeypatch):
+    # Missing values and comments can't go through the bulk parse
+    lines = test_profile.sounding.strip('\n').split('\n')
+    data = '\n'.join(lines[:5] + [ '%comment' ] + lines[5:])
+    calls = count_fallback(monkeypatch)
+    check_profile(SPCDecoder(write_spc(tmpdir, data)).getProfiles())
+    assert len(calls) == 1
+
+    data = '\n'.join([ lines[0], lines[1].replace('160.00', '', 1) ] + lines[2:])
+    prof = SPCDecoder(write_spc(tmpdir, data)).getProfiles()._profs[''][0]
+    assert np.isnan(prof.wdir[1])
+    npt.assert_almost_equal(ma.getdata(prof.tmpc), columns[2])
+    assert len(calls) == 2
+
+
+def test_decode_ragged(tmpdir, monkeypatch):
+    # A short line followed by a long one has the right number of values in all, but the rows don't line up
+    lines = test_profile.sounding.strip('\n').split('\n')
+    lines[1] = lines[1].rsplit(',', 1)[0]
+    lines[2] = lines[2] + ',  10.00'
+    calls = count_fallback(monkeypatch)
+    with pytest.raises(ValueError):
+        SPCDecoder(write_spc(tmpdir, '\n'.join(lines)))
+    assert len(calls) == 1
@@ -0,0 +1,100 @@
+import gzip
+from datetime import datetime
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as npt
+import pytest
+from sharppy.io.writer import writeProfiles
+from sharppy.io.archive_decoder import ArchiveDecoder
+from sharppy.io.buf_decoder import BufDecoder
+from sharppy.io.spc_decoder import SPCDecoder
+from sharppy.sharptab.profile import BasicProfile
+import sharppy.sharptab.utils as utils
+import test_buf_decoder
+import test_spc_decoder
+from test_archive_decoder import check_same
+
+
+def read_spc(file_name):
+    prof = SPCDecoder(file_name).getProfiles()._profs[''][0]
+    return [ ma.getdata(getattr(prof, col)) for col in [ 'pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd' ] ]
+
+
+def test_write_spc(tmpdir):
+    orig = SPCDecoder(test_spc_decoder.write_spc(tmpdir)).getProfiles()
+    out_name = str(tmpdir.join('out.txt'))
+    assert writeProfiles(orig, out_name) == [ out_name ]
+    test_spc_decoder.check_profile(SPCDecoder(out_name).getProfiles())
+
+    text = open(out_name).read().split('\n')
+    assert text[0] == '%TITLE%'
+    assert text[1].startswith(' OUN   110524/0000')
+    assert text[5] == '%RAW%'
+    assert text[6] == ' 1000.00,    133.00,  -9999.00,  -9999.00,  -9999.00,  -9999.00'
+
+
+def test_write_spc_many(tmpdir):
+    orig = BufDecoder(test_buf_decoder.write_bufkit(tmpdir, n_mem=2, n_times=3)).getProfiles()
+    file_names = writeProfiles(orig, str(tmpdir.join('{member}_{index}.txt')))
+    assert file_names == [ str(tmpdir.join('mem%d_%d.txt' % (mem, idx + 3 * mem))) for mem in range(2) for idx in range(3) ]
+
+    for name, (mem, time) in zip(file_names, [ (mem, time) for mem in range(2) for time in range(3) ]):
+        values = test_buf_decoder.member_levels(mem, time)
+        npt.assert_almost_equal(read_spc(name), values[:, [ 0, 6, 1, 2, 3, 4 ]].T)
+
+    with pytest.raises(ValueError):
+        writeProfiles(orig, str(tmpdir.join('{member}.txt')))
+    with pytest.raises(ValueError):
+        writeProfiles(orig, str(tmpdir.join('out.txt')), fmt='netcdf')
+
+
+def test_write_masked(tmpdir):
+    # Masked values are written as -9999, and the wind direction and speed come from the components if need be
+    kwargs = dict( (col, ma.masked_values(values, -9999.)) for col, values in
+        zip([ 'pres', 'hght', 'tmpc', 'dwpc', 'wdir', 'wspd' ], test_spc_decoder.columns) )
+    u, v = utils.vec2comp(kwargs.pop('wdir'), kwargs.pop('wspd'))
+    prof = BasicProfile(u=u, v=v, location='OUN', date=datetime(2011, 5, 24, 0), **kwargs)
+
+    out_name = str(tmpdir.join('out.txt'))
+    prof.toFile(out_name)
+    values = read_spc(out_name)
+    for col in [ 0, 1, 2, 3 ]:
+        npt.assert_almost_equal(values[col], test_spc_decoder.columns[col])
+
+    wind = test_spc_decoder.columns[5] != -9999.
+    npt.assert_almost_equal(values[5][wind], test_spc_decoder.columns[5][wind], decimal=2)
+    npt.assert_almost_equal(values[4][wind & (test_spc_decoder.columns[5] > 0)],
+        test_spc_decoder.columns[4][wind & (test_spc_decoder.columns[5] > 0)], decimal=2)
+    assert np.all(values[4][~wind] == -9999.)
+
+
+def test_write_csv(tmpdir):
+    orig = BufDecoder(test_buf_decoder.write_bufkit(tmpdir, n_mem=2, n_times=3)).getProfiles()
+    out_name = str(tmpdir.join('out.csv.gz'))
+    assert writeProfiles(orig, out_name, fmt='csv', compress=True) == [ out_name ]
+
+    lines = gzip.open(out_name).read().strip().split('\n')
+    assert lines[0] == 'member,location,date,pres,hght,tmpc,dwpc,wdir,wspd,omeg'
+    levels = test_buf_decoder.levels
+    assert len(lines) == 1 + 2 * 3 * len(levels)
+    assert lines[1] == 'mem0,KOUN,2015-05-01 00:00:00,%.2f,%.2f,%.2f,%.2f,%.2f,%.2f,%.2f' % tuple(levels[0, [ 0, 6, 1, 2, 3, 4, 5 ]])
+    assert lines[-1].startswith('mem1,KOUN,2015-05-01 02:00:00,500.00,')
+
+
+def test_write_archive(tmpdir):
+    orig = BufDecoder(test_buf_decoder.write_bufkit(tmpdir, n_mem=2, n_times=3)).getProfiles()
+    spc = SPCDecoder(test_spc_decoder.write_spc(tmpdir)).getProfiles()
+
+    file_names = writeProfiles([ orig, spc ], str(tmpdir.join('{index}_{location}.arc.gz')), fmt='archive',
+        compress=True)
+    assert file_names == [ str(tmpdir.join('0_KOUN.arc.gz')), str(tmpdir.join('1_OUN.arc.gz')) ]
+    check_same(ArchiveDecoder(file_names[0]).getProfiles(), orig)
+    check_same(ArchiveDecoder(file_names[1]).getProfiles(), spc)
+
+    # Loose profiles are written as one collection
+    profs = orig._profs['mem0']
+    out_name = str(tmpdir.join('loose.arc'))
+    writeProfiles(list(profs), out_name, fmt='archive')
+    prof_coll = ArchiveDecoder(out_name).getProfiles()
+    assert prof_coll._dates == orig._dates
+    assert len(prof_coll._profs['']) == 3
@@ -15,6 +15,26 @@ import platform
 from os.path import expanduser
 import os
 from sharppy._sharppy_version import __version__, __version_name__
+from utils.async import AsyncThreads
+
+def previewParcel(prof_col, mods, lplvals):
+    """
+    Lifts a parcel through a cheap (BasicProfile) copy of the modified profile.  Used to
+    preview modifications while the profile is still being dragged.
+    prof_col:   The profile collection being modified
+    mods:       A list of (idx, kwargs) modifications (see ProfCollection.getModifiedProf())
+    lplvals:    The DefineParcel object for the parcel being displayed
+    """
+    # The effective inflow layer parcel is too expensive to be a preview.
+    if lplvals is None or lplvals.flag not in [1, 2, 3, 4, 5]:
+        return None
+
+    prof = prof_col.getModifiedProf(mods, prof_type=profile.BasicProfile)
+    if lplvals.flag == 5:
+        lplvals = tab.params.DefineParcel(prof, 5, pres=lplvals.pres)
+    else:
+        lplvals = tab.params.DefineParcel(prof, lplvals.flag)
+    return tab.params.parcelx(prof, lplvals=lplvals)
 
 class SPCWidget(QWidget):
     """
@@ -76,6 +96,23 @@ class SPCWidget(QWidget):
         if not self.config.has_option('paths', 'save_img') or not self.config.has_option('paths', 'save_txt'):
             self.config.set('paths', 'save_img', expanduser('~'))
             self.config.set('paths', 'save_txt', expanduser('~'))
+        if not self.config.has_section('modify'):
+            self.config.add_section('modify')
+            # How long (in ms) a drag has to sit still before the full profile is recomputed
+            self.config.set('modify', 'idle_time', '300')
+
+        ## modifications from dragging the profiles are recomputed in a background thread.
+        ## mod_gen goes up every time a new recomputation is requested, and the results
+        ## from older requests are thrown away.
+        self.mod_async = AsyncThreads(1)
+        self.mod_gen = 0
+        self.pending_mods = []
+        self.drag_mod = None
+        self.preview_running = False
+        self.preview_queued = False
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.timeout.connect(self.recomputeDrag)
 
         ## these are the boolean flags used throughout the program
         self.swap_inset = False
@@ -205,6 +242,8 @@ class SPCWidget(QWidget):
         file_types = "TXT (*.txt)"
         file_name, result = QFileDialog.getSaveFileName(self, "Save Sounding Text", path, file_types)
         if result:
+            self.flushModifications()
+            self.updateProfs()
             self.default_prof.toFile(file_name)
             self.config.set('paths', 'save_txt', os.path.dirname(file_name))
 
@@ -240,14 +279,17 @@ class SPCWidget(QWidget):
 
         self.sound.parcel.connect(self.defineUserParcel)
         self.sound.modified.connect(self.modifyProf)
+        self.sound.modifying.connect(self.previewProf)
         self.sound.reset.connect(self.resetProfModifications)
 
         self.hodo.modified.connect(self.modifyProf)
+        self.hodo.modifying.connect(self.previewProf)
         self.hodo.reset.connect(self.resetProfModifications)
 
         self.insets["SARS"].updatematch.connect(self.updateSARS)
 
     def addProfileCollection(self, prof_col, prof_id, focus=True):
+        self.flushModifications()
         self.prof_collections.append(prof_col)
         self.prof_ids.append(prof_id)
         self.sound.addProfileCollection(prof_col)
@@ -270,6 +312,7 @@ class SPCWidget(QWidget):
 
     @Slot(str)
     def setProfileCollection(self, prof_id):
+        self.flushModifications()
         try:
             self.pc_idx = self.prof_ids.index(prof_id)
         except ValueError:
@@ -284,6 +327,7 @@ class SPCWidget(QWidget):
         self.updateProfs()
 
     def rmProfileCollection(self, prof_id):
+        self.flushModifications()
         try:
             pc_idx = self.prof_ids.index(prof_id)
         except ValueError:
@@ -331,20 +375,23 @@ class SPCWidget(QWidget):
         self.sound.setActiveCollection(self.pc_idx, update_gui=False)
         self.hodo.setActiveCollection(self.pc_idx)
 
-        self.storm_slinky.setProf(self.default_prof)
-        self.inferred_temp_advection.setProf(self.default_prof)
-        self.speed_vs_height.setProf(self.default_prof)
-        self.srwinds_vs_height.setProf(self.default_prof)
-        self.thetae_vs_pressure.setProf(self.default_prof)
-        self.watch_type.setProf(self.default_prof)
-        self.convective.setProf(self.default_prof)
-        self.kinematic.setProf(self.default_prof)
+        self.setInsetProfs(self.default_prof)
+
+    def setInsetProfs(self, prof):
+        self.storm_slinky.setProf(prof)
+        self.inferred_temp_advection.setProf(prof)
+        self.speed_vs_height.setProf(prof)
+        self.srwinds_vs_height.setProf(prof)
+        self.thetae_vs_pressure.setProf(prof)
+        self.watch_type.setProf(prof)
+        self.convective.setProf(prof)
+        self.kinematic.setProf(prof)
 
         for inset in self.insets.keys():
-            self.insets[inset].setProf(self.default_prof)
+            self.insets[inset].setProf(prof)
 
         # Update the parcels to match the new profiles
-        parcel = self.getParcelObj(self.default_prof, self.parcel_type)
+        parcel = self.getParcelObj(prof, self.parcel_type)
         self.sound.setParcel(parcel)
         self.storm_slinky.setParcel(parcel)
 
@@ -388,28 +435,143 @@ class SPCWidget(QWidget):
 
     @Slot(tab.params.Parcel)
     def defineUserParcel(self, parcel):
+        self.flushModifications()
         self.prof_collections[self.pc_idx].defineUserParcel(parcel)
         self.updateProfs()
         self.setFocus()
 
     @Slot(int, dict)
     def modifyProf(self, idx, kwargs):
-        self.prof_collections[self.pc_idx].modify(idx, **kwargs)
-        self.updateProfs()
+        """
+        Called when a drag on the Skew-T or hodograph is released.  The full profile
+        is recomputed in the background, and the collection is updated when it's done.
+        """
+        self.idle_timer.stop()
+        self.drag_mod = None
+        self.pending_mods.append((idx, kwargs))
+        self.postModification(self.pending_mods, commit=True)
         self.setFocus()
 
+    @Slot(int, dict)
+    def previewProf(self, idx, kwargs):
+        """
+        Called every time the mouse moves during a drag on the Skew-T or hodograph.
+        Thermodynamic modifications get a cheap preview of the displayed parcel, and
+        the full profile is recomputed once the drag has been idle for a while.
+        """
+        self.drag_mod = (idx, kwargs)
+        self.idle_timer.start(self.config.getint('modify', 'idle_time'))
+
+        if 'tmpc' in kwargs or 'dwpc' in kwargs:
+            if self.preview_running:
+                # Only the latest position is worth previewing, so just remember
+                # to do another one when this one is done.
+                self.preview_queued = True
+            else:
+                self.postPreview()
+
+    def postPreview(self):
+        prof_col = self.prof_collections[self.pc_idx]
+        pcl = self.getParcelObj(self.default_prof, self.parcel_type)
+        mods = self.pending_mods + [ self.drag_mod ]
+
+        self.preview_running = True
+        self.preview_queued = False
+        self.mod_async.post(previewParcel, self.previewDone, prof_col, mods, getattr(pcl, 'lplvals', None),
+            background=True)
+
+    def previewDone(self, ret_val):
+        self.preview_running = False
+        if self.drag_mod is None:
+            # The drag is over, so the full profile is on its way.
+            return
+
+        if self.preview_queued:
+            self.postPreview()
+
+        pcl = ret_val[0]
+        if isinstance(pcl, tab.params.Parcel):
+            self.sound.setParcel(pcl)
+
+    def recomputeDrag(self):
+        """
+        Called once a drag has been idle for a while.  The full profile with the drag
+        so far is shown in the insets, but nothing is committed until the release.
+        """
+        if self.drag_mod is None:
+            return
+        self.postModification(self.pending_mods + [ self.drag_mod ], commit=False)
+
+    def postModification(self, mods, commit):
+        self.mod_gen += 1
+        gen = self.mod_gen
+        mods = list(mods)
+        prof_col = self.prof_collections[self.pc_idx]
+
+        callback = lambda ret_val: self.modificationDone(gen, mods, commit, ret_val[0])
+        self.mod_async.post(self.computeModification, callback, prof_col, mods, gen, background=True)
+
+    def computeModification(self, prof_col, mods, gen):
+        # This runs in the background thread.  Don't bother with requests that were
+        # replaced while they were waiting in the queue.
+        if gen != self.mod_gen:
+            return None
+        return prof_col.getModifiedProf(mods)
+
+    def modificationDone(self, gen, mods, commit, prof):
+        if gen != self.mod_gen or prof is None:
+            # A newer request came in after this one was posted
+            return
+
+        if isinstance(prof, Exception):
+            self.pending_mods = []
+            self.updateProfs()
+            if commit:
+                # Only tell the user once they let go; previews while dragging just snap back
+                msgbox = QMessageBox()
+                msgbox.setText("An error has occurred while modifying the profile.")
+                msgbox.setInformativeText("The modification has been undone.")
+                msgbox.setDetailedText(str(prof))
+                msgbox.setIcon(QMessageBox.Warning)
+                msgbox.exec_()
+            return
+
+        if commit:
+            self.pending_mods = []
+            self.prof_collections[self.pc_idx].setModifiedProf(prof, mods)
+            self.updateProfs()
+        else:
+            self.setInsetProfs(prof)
+
+    def flushModifications(self):
+        """
+        Commits any modifications that are still being recomputed in the background.
+        This needs to happen before anything that changes the current profile.
+        """
+        self.idle_timer.stop()
+        self.drag_mod = None
+        self.mod_gen += 1
+
+        if len(self.pending_mods) > 0:
+            mods, self.pending_mods = self.pending_mods, []
+            prof_col = self.prof_collections[self.pc_idx]
+            prof_col.setModifiedProf(prof_col.getModifiedProf(mods), mods)
+
     def interpProf(self):
+        self.flushModifications()
         self.prof_collections[self.pc_idx].interp()
         self.updateProfs()
         self.setFocus()
 
     @Slot(list)
     def resetProfModifications(self, args):
+        self.flushModifications()
         self.prof_collections[self.pc_idx].resetModification(*args)
         self.updateProfs()
         self.setFocus()
 
     def resetProfInterpolation(self):
+        self.flushModifications()
         self.prof_collections[self.pc_idx].resetInterpolation()
         self.updateProfs()
         self.setFocus()
@@ -452,6 +614,8 @@ class SPCWidget(QWidget):
         if len(self.prof_collections) == 0 or self.coll_observed:
             return
 
+        self.flushModifications()
+
         prof_col = self.prof_collections[self.pc_idx]
         if prof_col.getMeta('observed'):
             cur_dt = prof_col.getCurrentDate()
@@ -485,6 +649,7 @@ class SPCWidget(QWidget):
             self.insets['SARS'].clearSelection()
 
     def swapProfCollections(self):
+        self.flushModifications()
         # See if we have any other observed profiles loaded at this time.
         prof_col = self.prof_collections[self.pc_idx]
         dt = prof_col.getCurrentDate()
@@ -508,6 +673,10 @@ class SPCWidget(QWidget):
     def closeEvent(self, e):
         self.sound.closeEvent(e)
 
+        # Throw away anything that's still being recomputed
+        self.idle_timer.stop()
+        self.mod_gen += 1
+
         for prof_coll in self.prof_collections:
             prof_coll.cancelCopy()
 
@@ -291,6 +291,7 @@ class plotHodo(backgroundHodo):
     '''
 
     modified = Signal(int, dict)
+    modifying = Signal(int, dict)
     reset = Signal(list)
 
     def __init__(self, **kwargs):
@@ -844,7 +845,8 @@ class plotHodo(backgroundHodo):
         elif self.cursor_type == 'none' and (self.initdrag or self.dragging):
             self.initdrag = False
             self.dragging = True
-            self.dragHodo(e)
+            idx, mod = self.dragHodo(e)
+            self.modifying.emit(idx, mod)
 
     def dragHodo(self, e):
         idx = self.drag_idx
@@ -898,6 +900,7 @@ class plotHodo(backgroundHodo):
 
         qp.end()
         self.update()
+        return idx, {'u':u, 'v':v}
 
     def resizeEvent(self, e):
         '''
@@ -317,6 +317,7 @@ class backgroundSkewT(QtGui.QWidget):
 
 class plotSkewT(backgroundSkewT):
     modified = Signal(int, dict)
+    modifying = Signal(int, dict)
     parcel = Signal(tab.params.Parcel)
     reset = Signal(list)
 
@@ -350,6 +351,7 @@ class plotSkewT(backgroundSkewT):
         self.dragging = False
         self.drag_idx = None
         self.drag_prof = None
+        self.drag_pos = None
         self.drag_buffer = 5
         self.clickradius = 6
         self.cursor_loc = None
@@ -539,6 +541,10 @@ class plotSkewT(backgroundSkewT):
         self.plotData()
         if self.readout:
             self.updateReadout()
+        if self.dragging and self.drag_pos is not None:
+            # The plot was redrawn in the middle of a drag, so put the dragged line back.
+            self.saveBitMap = None
+            self.dragLine(self.drag_pos)
         self.update()
 
     def setDGZ(self, flag):
@@ -578,6 +584,7 @@ class plotSkewT(backgroundSkewT):
 
             self.drag_idx = None
             self.dragging = False
+            self.drag_pos = None
             self.saveBitMap = None
 
         elif self.initdrag:
@@ -645,7 +652,9 @@ class plotSkewT(backgroundSkewT):
         elif self.initdrag or self.dragging:
             self.dragging = True
             self.initdrag = False
-            self.dragLine(e)
+            self.drag_pos = e.pos()
+            idx, mod = self.dragLine(e)
+            self.modifying.emit(idx, mod)
 
     def updateReadout(self):
         y = self.originy + self.pres_to_pix(self.readout_pres) / self.scale
@@ -742,6 +751,7 @@ class plotSkewT(backgroundSkewT):
 
         qp.end()
         self.update()
+        return idx, {prof_name:tmpc}
 
     def setReadoutCursor(self):
         self.parcelmenu.setEnabled(True)
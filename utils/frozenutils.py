@@ -1,5 +1,6 @@
 import sys, os
 import multiprocessing.forking
+import multiprocessing.pool
 import platform
 
 _env_frozen = 'frozen'
@@ -42,4 +43,8 @@ class _Popen(multiprocessing.forking.Popen):
 class Process(multiprocessing.Process):
     _Popen = _Popen
 
+class Pool(multiprocessing.pool.Pool):
+    Process = Process
+
 Queue = multiprocessing.Queue
+cpu_count = multiprocessing.cpu_count